@@ -1,203 +1,292 @@
+import os
 import sys
 sys.path.append('../')
 import json
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from functools import partial
 import pandas as pd
 import numpy as np
-from tqdm import tqdm
-from datetime import datetime, timedelta
-from tkinter import Tk, filedialog
 import helper_functions
+import task_spec
+import raw_reader
+import event_cache
+import session_store
+import profiling
+
+
+def window_number(stimulus, position):
+    """Extracts the digit at the `position` of the stimulus labels
+    (e.g. window or image number) as a float; NaN if it can't be parsed."""
+    return pd.to_numeric(stimulus.str[position], errors='coerce')
+
+
+def stimulus_text(trials_df, column):
+    """Stimulus labels of the column as text, empty if there is no label."""
+    return trials_df[column].fillna('').astype(str)
+
+
+def window_correct(trials_df):
+    """Number of the correct window, taken from the stimulus label with '+'."""
+    stim_correct = stimulus_text(trials_df, 'stimulusCorrect')
+    stim_incorrect = stimulus_text(trials_df, 'stimulusIncorrect')
+    return np.where(
+        stim_correct.str.find('+') == 2, window_number(stim_correct.str.split(' ').str[1], 1),
+        np.where(stim_incorrect.str.find('+') == 2, window_number(stim_incorrect.str.split(' ').str[1], 1),
+                 np.nan))
+
+
+def window_pressed(trials_df):
+    """Number of the window of the decision."""
+    return window_number(trials_df['decisionUnit'], 1)
+
+
+def image_pressed(trials_df):
+    """Number of the image in the pressed window."""
+    stim_correct = stimulus_text(trials_df, 'stimulusCorrect')
+    stim_incorrect = stimulus_text(trials_df, 'stimulusIncorrect')
+    return np.where(
+        trials_df['windowPressed'] == window_number(stim_correct, 5), window_number(stim_correct, -1),
+        np.where(trials_df['windowPressed'] == window_number(stim_incorrect, 5), window_number(stim_incorrect, -1),
+                 np.nan))
+
+
+def n_preservative(trials_df):
+    """Preservative number - amount of window pokes after the decision."""
+    return np.where(trials_df['decision'].notna(), trials_df['windowPokesAfterStart'] - 1, 0)
+
+
+WINDOW = {'column': 'unitLabel', 'startswith': 'W'}
+
+# trials of the task (see `task_spec.trial_table`)
+TRIAL_SPEC = {
+    # trials start with the 'wait poke' system message
+    'trial_start': 'wait poke',
+    'start_values': {'trialStart': 'DateTime'},
+    'duration': {'name': 'trialDuration'},
+    # check if animal initialized the stimulus presentation, then
+    # if mice made a decision (first window poke after the initialization)
+    'events': {'startRun': {'select': {'column': 'SystemMsg', 'startswith': 'start run'}},
+               'decision': {'select': WINDOW, 'from': 'startRun', 'direction': 'after'},
+               'reward': {'select': {'column': 'outLabel', 'equals': 'positive'}}},
+    'values': {'stimulusCorrect': {'event': 'startRun', 'column': 'MsgValue1', 'missing': ''},
+               'stimulusIncorrect': {'event': 'startRun', 'column': 'MsgValue2', 'missing': ''},
+               'decisionUnit': {'event': 'decision', 'column': 'unitLabel'}},
+    # premature number - amount of pokes before the end of iti
+    'counts': {'nPremature': {'select': WINDOW, 'before': 'startRun'},
+               'windowPokesAfterStart': {'select': WINDOW, 'after': 'startRun'}},
+    # check if a correction trial
+    'flags': {'correctionTrial': {'select': {'column': 'MsgValue3', 'equals': 'cr'}, 'requires': 'startRun'}},
+    'derive': {'windowCorrect': window_correct,
+               'windowPressed': window_pressed,
+               'imagePressed': image_pressed,
+               'nPreservative': n_preservative},
+    # decision on the correct window without the reward is 'undefined'
+    'outcome': {'name': 'outcome', 'default': 'undefined',
+                'cases': [{'case': 'correct', 'when': ['decision', {'equal': ['windowPressed', 'windowCorrect']}, 'reward']},
+                          {'case': 'noReward', 'when': ['decision', {'equal': ['windowPressed', 'windowCorrect']}],
+                           'label': 'undefined'},
+                          {'case': 'incorrect', 'when': ['decision']}]},
+    'latencies': {'startLatency': {'between': ['start', 'startRun']},
+                  'responseLatency': {'between': ['startRun', 'decision']},
+                  'rewardLatency': {'cases': {'correct': ['decision', 'reward'], 'noReward': -1}}},
+    'columns': ['session', 'trial', 'trialStart', 'trialDuration', 'stimulusCorrect', 'stimulusIncorrect',
+                'startLatency', 'correctionTrial', 'nPremature', 'windowCorrect', 'windowPressed',
+                'responseLatency', 'outcome', 'rewardLatency', 'imagePressed', 'nPreservative']}
+
+
+@profiling.profiled('trial_extraction')
+def tvdlr_trial_table(session_df):
+    """Transforms the observations of one animal's sessions into the trials
+    table in a single vectorized pass (see `TRIAL_SPEC`).
+
+    Parameters
+    ----------
+    session_df : DataFrame
+        Observations of all sessions of a single animal, ordered in time and
+        indexed from 0. The `session` column holds the session number.
+
+    Returns
+    ----------
+    trials_df : DataFrame
+        One row per trial with `session`, `trial`, `trialStart`, `trialDuration`,
+        `correctionTrial`, `imagePressed`, `stimulusCorrect`, `stimulusIncorrect`,
+        `windowCorrect`, `windowPressed`, `outcome`, `responseLatency`,
+        `rewardLatency`, `startLatency`, `nPremature` and `nPreservative` columns.
+    """
+    return task_spec.trial_table(session_df, TRIAL_SPEC)
+
+
+def read_input_file(fpath, input_encoding="utf_16", input_sep=";", tz=None, cache_dir=None):
+    """Reads the raw csv file, drops the rows with the technical info and
+    the extra columns, and performs the initial cleaning.
+
+    Parameters
+    ----------
+    fpath : str
+        Path to the csv file with the raw data or to the session store
+        made from it (see `session_store.py`).
+
+    input_encoding : str
+        Encoding of an input file. If the file cannot be read with it,
+        the encoding is detected (see `raw_reader.sniff_format`).
+
+    input_sep : str
+        Delimiter to use for an input file. Detected the same way.
+
+    tz : str or None
+        Time zone of the system clock. See `helper_functions.serial_to_datetime`.
+
+    cache_dir : str or None
+        Folder for the parsed files. If set, the file is parsed only once
+        and later loaded from the cache (see `event_cache.cached_table`).
+
+    Returns
+    ----------
+    df : DataFrame
+        Cleaned data sorted in time, with the `fname` column (name of the file),
+        in the compact representation (see `raw_reader.compact_events`).
+    """
+    if session_store.is_store(fpath):
+        # the file was already read and cleaned
+        return session_store.load_table(fpath, options={'parser': 'tvdlr', 'tz': tz})
+
+    if cache_dir is not None:
+        return event_cache.cached_table(
+            fpath,
+            partial(read_input_file, input_encoding=input_encoding, input_sep=input_sep, tz=tz),
+            options={'parser': 'tvdlr', 'fname': fpath.split('/')[-1], 'encoding': input_encoding,
+                     'sep': input_sep, 'tz': tz},
+            cache_dir=cache_dir)
+
+    # rows with the technical info and extra columns are not parsed
+    df = raw_reader.read_raw_file(fpath, input_encoding, input_sep)
+    df = df.assign(fname=fpath.split('/')[-1])
+    df = helper_functions.initial_cleaning(df, by=['fname', 'DateTime'], tz=tz)
+
+    return raw_reader.compact_events(df)
+
+
+def tvdlr_animal_trials(input_df, animal_id, index=None):
+    """Extracts the trials of all sessions of an animal.
+
+    Parameters
+    ----------
+    input_df : DataFrame
+        Cleaned data (see `helper_functions.initial_cleaning`), indexed from 0.
+
+    animal_id : str
+        Label of the animal.
+
+    index : tuple or None
+        Sessions of all animals in `input_df` (see `helper_functions.session_index`).
+        Built from `input_df` if not given.
+
+    Returns
+    ----------
+    animal_out : DataFrame or None
+        Trials table (see `tvdlr_trial_table`) with `IdLabel` and `fileName`
+        columns. `None` if no sessions were found.
+
+    n_sessions : int
+        Amount of sessions ('start exp' messages) of the animal.
+    """
+    with profiling.stage('session_detection'):
+        if index is None:
+            index = helper_functions.session_index(input_df)
+        # session = observations between 'start exp' and 'end exp'
+        # 'start exp' without the pair are counted, but skipped
+        animal_sessions = index[0].get(animal_id, [])
+        n_sessions = len(animal_sessions) + len(index[1].get(animal_id, ([], []))[0])
+
+        # check whether there are sessions for the animal
+        # (amount of 'start exp' may differ from 'end exp')
+        if n_sessions == 0:
+            # if the above condition doesn't hold no further data
+            # manipulations will be done with that animal
+            print(f"No sessions were found for the animal {animal_id}.")
+            return None, 0
 
+        sessions = [helper_functions.session_slice(input_df, session) for session in animal_sessions]
+        file_names = {session_number: file_name for _, _, file_name, session_number in animal_sessions}
 
-def tvdlr_data_cleaner(input_file_paths, params, input_encoding="utf_16", input_sep=";"):
-    # resulted data is encoded to 'utf_16', change if different
-    input_df = pd.DataFrame({})
-    for fpath in input_file_paths:
-        try:
-            df = pd.read_csv(fpath, encoding=input_encoding, sep=input_sep)
-            len(df['DateTime']) # check whether the `sep` was chosen right
-
-            # drop first rows from the data with the technical info
-            df = df[~df['DateTime'].astype(str).apply(lambda x: x.startswith('#'))]
-            # remove extra columns with additional information
-            df = df.loc[:, :"MsgValue3"]
-            df['fname'] = fpath.split('/')[-1]
-            input_df = input_df.append(df)
-        except:
-            # exit the function if the input file cannot be opened
-            print("\nError while reading the input file. Change the `encoding` or `sep` parameters in the script.")
-            return None
+    if not sessions:
+        return None, n_sessions
 
-    # sort the values since for some reason observations sometimes mixed in time
-    input_df['DateTime'] = input_df['DateTime'].astype(float)
-    input_df.sort_values(by=['fname', 'DateTime'], inplace=True)
-    input_df.reset_index(drop=True, inplace=True)
+    animal_out = tvdlr_trial_table(pd.concat(sessions, ignore_index=True))
+    animal_out['IdLabel'] = animal_id
+    animal_out['fileName'] = animal_out['session'].map(file_names)
 
-    # some datetime manipulations
-    input_df['Timestamp'] = input_df['DateTime'].apply(
-        lambda x: datetime.timestamp(helper_functions.from_ordinal(x)))
-    input_df['DateTime'] = input_df['Timestamp'].apply(
-        lambda x: datetime.fromtimestamp(x))
+    return animal_out, n_sessions
 
-    # select all possible animal IDs
-    ids = input_df['IdLabel'][~input_df['IdLabel'].isnull()].unique()
-    ids.sort()
-    ids_dict = dict(input_df[['IdLabel','IdRFID']].drop_duplicates().dropna().values)
 
-    # the final files templates
-    final_output = pd.DataFrame({})
+def tvdlr_file_trials(fpath, params, input_encoding="utf_16", input_sep=";", tz=None, cache_dir=None):
+    """Extracts the trials from a single raw csv file. Used by the parallel
+    mode of `tvdlr_data_cleaner`; sessions are counted within the file.
 
-    for animal_id in ids: # iterating over all animals
-        if animal_id in params['animals_to_ignore']:
-            print(f"\nAnimal {animal_id} is ignored.")
-            continue
+    Returns
+    ----------
+    file_output : dict
+        Trials table (see `tvdlr_animal_trials`) of each animal label.
 
-        print(f"\nGathering data for the animal {animal_id}...")
+    ids_dict : dict
+        RFID of each animal label.
 
-        # select the first session by the 'SystemMsg' variable
-        # session = observations between 'start exp' and 'end exp'
-        indices_start = input_df[(input_df['IdLabel'] == animal_id) & (input_df['SystemMsg'] == 'start exp')].index
-        indices_end = input_df[(input_df['IdLabel'] == animal_id) & (input_df['SystemMsg'] == 'end exp')].index
+    file_sessions : dict
+        Amount of sessions of each animal label.
 
-        try:
-            # check whether there are sessions for the animal
-            indices_start[0]
-            # check whether amount of 'start exp' equals to 'end exp'
-            # if len(indices_start) != len(indices_end):
-            #     raise Exception
-        except:
-            # if either of the above conditions don't hold no further data
-            # manipulations will be done with that animal
-            print(f"No sessions were found for the animal {animal_id}.")
+    `None` is returned if the file cannot be opened.
+    """
+    try:
+        input_df = read_input_file(fpath, input_encoding, input_sep, tz, cache_dir)
+    except:
+        return None
+
+    ids = sorted(input_df['IdLabel'].dropna().unique())
+    ids_dict = dict(input_df[['IdLabel','IdRFID']].drop_duplicates().dropna().values)
+    with profiling.stage('session_detection'):
+        index = helper_functions.session_index(input_df)
+
+    file_output = {}
+    file_sessions = {}
+    for animal_id in ids:
+        if animal_id in params['animals_to_ignore']:
             continue
+        animal_out, file_sessions[animal_id] = tvdlr_animal_trials(input_df, animal_id, index)
+        if animal_out is not None:
+            file_output[animal_id] = animal_out
 
-        for session_i in range(len(indices_start)): # iterating over all sessions
-            ind_start = indices_start[session_i]
-            try:
-                ind_end = indices_end[session_i]
-                session_df = input_df.iloc[ind_start:ind_end+1, :].reset_index(drop=True)
-            except:
-                continue
+    return file_output, ids_dict, file_sessions
 
-            # trials start with the 'wait poke' system message
-            trial_indx = session_df['SystemMsg'][session_df['SystemMsg'] == 'wait poke'].index
-
-            animal_out = pd.DataFrame({})
-
-            for i in tqdm(range(len(trial_indx)), desc=f'Session {session_i+1}'): # iterating over all trials
-                if i != len(trial_indx)-1:
-                    trial_df = session_df.iloc[trial_indx[i]:trial_indx[i+1],:]
-                else:
-                    trial_df = session_df.iloc[trial_indx[i]:,:]
-
-                trial_start = trial_df['DateTime'].to_list()[0]
-                trial_start_ts = trial_df['Timestamp'].to_list()[0]
-                trial_duration = trial_df['Timestamp'].to_list()[-1] - trial_start_ts
-
-                # check if animal initialized the stimulus presentation
-                mask = trial_df['SystemMsg'].apply(lambda x: x.startswith('start run') if type(x) == str else False)
-                if True in mask.unique():
-                    poke_time = trial_df[mask]['Timestamp'].values[0]
-                    stim_correct = trial_df[mask]['MsgValue1'].values[0]
-                    stim_incorrect = trial_df[mask]['MsgValue2'].values[0]
-                    start_latency = poke_time - trial_start_ts
-
-                    if 'cr' in trial_df['MsgValue3'].unique(): # check if a correction trial
-                        correction_trial = 1
-                    else:
-                        correction_trial = 0
-
-                    # premature number - amount of pokes before the end of iti
-                    n_premature = trial_df['unitLabel'][trial_df['Timestamp'] < poke_time]
-                    n_premature = n_premature.apply(lambda x: x.startswith('W')).sum()
-
-                else:
-                    poke_time = np.NaN
-                    stim_correct = ''
-                    stim_incorrect = ''
-                    start_latency = np.NaN
-                    correction_trial = np.NaN
-                    n_premature = 0
-
-
-                if stim_correct.find('+') == 2:
-                    window_correct = int(stim_correct.split(' ')[1][1])
-                elif stim_incorrect.find('+') == 2:
-                    window_correct = int(stim_incorrect.split(' ')[1][1])
-                else:
-                    window_correct = np.NaN
-
-                # check if mice made a decision
-                mask = (trial_df['unitLabel'].apply(lambda x: x.startswith('W'))) \
-                    & (trial_df['Timestamp'] > poke_time)
-                decision = trial_df[mask].head(1)
-
-                if len(decision) != 0:
-                    window_pressed = int(decision['unitLabel'].values[0][1])
-                    response_latency = decision['Timestamp'].values[0] - poke_time
-                    if window_pressed == window_correct:
-                        outcome = "correct"
-                        if 'positive' in trial_df['outLabel'].unique():
-                            reward_latency = trial_df[trial_df['outLabel'] == 'positive']['Timestamp'].values[0] \
-                            - decision['Timestamp'].values[0]
-                        else:
-                            outcome = 'undefined'
-                            reward_latency = -1
-                    else:
-                        outcome = "incorrect"
-                        reward_latency = np.NaN
-
-                    if window_pressed == int(stim_correct[5]):
-                        img_pressed = int(stim_correct[-1])
-                    elif window_pressed == int(stim_incorrect[5]):
-                        img_pressed = int(stim_incorrect[-1])
-                    else:
-                        img_pressed = np.NaN
-
-                    n_preservative = trial_df['unitLabel'][trial_df['Timestamp'] > poke_time]
-                    n_preservative = n_preservative.apply(lambda x: x.startswith('W')).sum() - 1
-
-                    # if (outcome == "correct") & ('positive' in trial_df['outLabel'].unique()):
-                    #
-                    # else:
-                    #     # outcome = "undefined"
-                    #     reward_latency = -1
-
-                else:
-                    outcome = "undefined"
-                    window_pressed = np.NaN
-                    response_latency = np.NaN
-                    img_pressed = np.NaN
-                    n_preservative = 0
-
-
-
-                animal_out = animal_out.append(
-                    {'session': session_i+1, 'trialStart': trial_start,
-                     'trialDuration': trial_duration,
-                     'correctionTrial': correction_trial, 'imagePressed': img_pressed,
-                     'stimulusCorrect': stim_correct, 'stimulusIncorrect': stim_incorrect,
-                     'windowCorrect': window_correct, 'windowPressed': window_pressed,
-                     'outcome': outcome, 'responseLatency': response_latency,
-                     'rewardLatency': reward_latency, 'startLatency': start_latency,
-                     'nPremature': n_premature, 'nPreservative': n_preservative
-                    },
-                    ignore_index=True)
-
-            animal_out['trial'] = np.arange(1, len(animal_out)+1) # trial indeces
-            animal_out['IdLabel'] = animal_id
-            animal_out['fileName'] = session_df['fname'][session_df['IdLabel'] == animal_id].values[0]
 
-            final_output = final_output.append(animal_out)
+@profiling.profiled('final_ranking', rows=lambda final_output, *args: sum(map(len, final_output)))
+def finalize_output(final_output, ids_dict):
+    """Combines the trials tables of all animals (and sessions) and counts
+    the trials disregarding the sessions.
+
+    Parameters
+    ----------
+    final_output : list of DataFrame
+        Trials tables (see `tvdlr_trial_table`) with `IdLabel` and `fileName` columns.
 
+    ids_dict : dict
+        RFID of each animal label.
+
+    Returns
+    ----------
+    final_output : DataFrame
+        Resulted DataFrame object.
+    """
+    final_output = pd.concat(final_output)
     final_output['IdRFID'] = final_output['IdLabel'].apply(lambda x: ids_dict[x])
     final_output.sort_values(by=['IdLabel', 'session', 'trial'], inplace=True)
     final_output['trialTotal'] = final_output.groupby('IdLabel').cumcount()+1
 
-    final_output['correctionTrial'] = final_output['correctionTrial'].apply(
-        lambda x: np.NaN if np.isnan(x) else bool(x))
-    final_output['windowCorrect'] = final_output['windowCorrect'].apply(
-        lambda x: np.NaN if np.isnan(x) else int(x))
+    # trials without the 'start run' event have no correction flag
+    final_output['correctionTrial'] = final_output['correctionTrial'].astype('boolean')
+    # whole numbers only if every trial has the correct window, as the floats with NaN otherwise
+    if final_output['windowCorrect'].notna().all():
+        final_output['windowCorrect'] = final_output['windowCorrect'].astype(int)
 
     clmns = ['session', 'nPremature', 'nPreservative']
     final_output[clmns] = final_output[clmns].astype(int)
@@ -213,8 +302,200 @@ def tvdlr_data_cleaner(input_file_paths, params, input_encoding="utf_16", input_
     return final_output
 
 
+def tvdlr_data_cleaner(input_file_paths, params, input_encoding="utf_16", input_sep=";", tz=None,
+                       chunksize=None, n_jobs=None, cache_dir=None):
+    """Performs data manipulation from the raw csv files. Transform data in a way
+    that 1 row represents the single trial.
+
+    Parameters
+    ----------
+    input_file_paths : list of str
+        Paths to the csv files with the raw data.
+
+    params : dict
+        Parameters from the `params.json` file.
+
+    input_encoding : str
+        Encoding of an input file.
+
+    input_sep : str
+        Delimiter to use for an input file.
+
+    tz : str or None
+        Time zone of the system clock, e.g. "Europe/Berlin". If `None`,
+        the local time zone is used. See `helper_functions.serial_to_datetime`.
+
+    chunksize : int or None
+        If set, the files are read in blocks of `chunksize` rows and only the
+        unfinished sessions are carried between the blocks, so the memory use
+        is bounded by the largest session rather than by the files size.
+        Each 'end exp' closes the latest 'start exp' of the animal.
+
+    n_jobs : int or None
+        If set, the files are processed in parallel by `n_jobs` processes
+        (-1 means all processors) and the results are merged in the order of
+        the file names. Sessions are paired within every file. Not used when
+        `chunksize` is set.
+
+    cache_dir : str or None
+        Folder for the parsed raw files. If set, every file is parsed only
+        once; later runs load the cleaned data from the cache. Not used when
+        `chunksize` is set.
+
+    Returns
+    ----------
+    final_output : DataFrame
+        Resulted DataFrame object.
+    """
+    # the final files templates
+    final_output = []
+
+    if chunksize is not None:
+        # streaming mode: the files are read block by block
+        # and only the finished sessions are kept in memory
+        file_chunks = []
+        # files are processed in the same order as in the sorting by `fname`
+        for fpath in sorted(input_file_paths, key=lambda x: x.split('/')[-1]):
+            try:
+                file_chunks.append((fpath.split('/')[-1],
+                                    raw_reader.read_raw_chunks(fpath, input_encoding, input_sep, chunksize)))
+            except:
+                # exit the function if the input file cannot be opened
+                print("\nError while reading the input file. Change the `encoding` or `sep` parameters in the script.")
+                return None
+        chunks = (chunk.assign(fname=fname) for fname, chunks in file_chunks for chunk in chunks)
+
+        ids_dict = {}
+        ignored_ids = set()
+        for animal_id, session_df in raw_reader.iter_sessions(chunks, by=['fname', 'DateTime'], tz=tz):
+            if animal_id in params['animals_to_ignore']:
+                if animal_id not in ignored_ids:
+                    print(f"\nAnimal {animal_id} is ignored.")
+                    ignored_ids.add(animal_id)
+                continue
+
+            ids_dict.update(session_df[['IdLabel','IdRFID']].drop_duplicates().dropna().values)
+
+            animal_out = tvdlr_trial_table(session_df)
+            animal_out['IdLabel'] = animal_id
+            animal_out['fileName'] = session_df['fname'][session_df['IdLabel'] == animal_id].values[0]
+
+            final_output.append(animal_out)
+
+        return finalize_output(final_output, ids_dict)
+
+    if n_jobs is not None:
+        # parallel mode: every file is processed in a separate process
+        file_paths = sorted(input_file_paths, key=lambda x: x.split('/')[-1])
+        with ProcessPoolExecutor(max_workers=None if n_jobs == -1 else n_jobs) as executor:
+            results = executor.map(tvdlr_file_trials, file_paths, repeat(params),
+                                   repeat(input_encoding), repeat(input_sep), repeat(tz), repeat(cache_dir))
+
+            ids_dict = {}
+            # sessions are counted disregarding the files
+            session_offset = {}
+            for fpath, result in zip(file_paths, results):
+                if result is None:
+                    # exit the function if the input file cannot be opened
+                    print("\nError while reading the input file. Change the `encoding` or `sep` parameters in the script.")
+                    return None
+                print(f"\nFile {fpath.split('/')[-1]} is processed.")
+
+                file_output, file_ids_dict, file_sessions = result
+                ids_dict.update(file_ids_dict)
+                for animal_id, animal_out in file_output.items():
+                    animal_out['session'] += session_offset.get(animal_id, 0)
+                    final_output.append(animal_out)
+                for animal_id, n_sessions in file_sessions.items():
+                    session_offset[animal_id] = session_offset.get(animal_id, 0) + n_sessions
+
+        for animal_id in sorted(ids_dict):
+            if animal_id in params['animals_to_ignore']:
+                print(f"\nAnimal {animal_id} is ignored.")
+
+        return finalize_output(final_output, ids_dict)
+
+    # resulted data is encoded to 'utf_16', change if different
+    input_df = []
+    # every file is sorted separately, so the files are combined
+    # in the same order as in the sorting by `fname`
+    for fpath in sorted(input_file_paths, key=lambda x: x.split('/')[-1]):
+        try:
+            input_df.append(read_input_file(fpath, input_encoding, input_sep, tz, cache_dir))
+        except:
+            # exit the function if the input file cannot be opened
+            print("\nError while reading the input file. Change the `encoding` or `sep` parameters in the script.")
+            return None
+    input_df = raw_reader.concat_events(input_df)
+
+    # select all possible animal IDs
+    ids = sorted(input_df['IdLabel'].dropna().unique())
+    ids_dict = dict(input_df[['IdLabel','IdRFID']].drop_duplicates().dropna().values)
+    with profiling.stage('session_detection'):
+        index = helper_functions.session_index(input_df)
+
+    for animal_id in ids: # iterating over all animals
+        if animal_id in params['animals_to_ignore']:
+            print(f"\nAnimal {animal_id} is ignored.")
+            continue
+
+        print(f"\nGathering data for the animal {animal_id}...")
+
+        animal_out, _ = tvdlr_animal_trials(input_df, animal_id, index)
+        if animal_out is not None:
+            final_output.append(animal_out)
+
+    return finalize_output(final_output, ids_dict)
+
+
+
+def load_params(params_path=None):
+    """Loads the parameters from the `params.json` file. By default the file is
+    searched in the current folder and in the `2vdlr` folder; if it's not
+    found, default values are used."""
+    for fpath in [params_path] if params_path is not None else ["2vdlr/params.json", "params.json"]:
+        if os.path.exists(fpath):
+            with open(fpath, "r") as f:
+                return json.load(f)
+
+    print("No parameters file found. Using default values.")
+    return {'animals_to_ignore': []}
+
+
+def tvdlr_process_files(input_file_paths, output_file, params, **kwargs):
+    """Preprocesses the raw csv files and saves the output to the `output_file`.
+
+    Parameters
+    ----------
+    input_file_paths : list of str
+        Paths to the csv files with the raw data.
+
+    output_file : str
+        Path to the output csv file.
+
+    params : dict
+        Parameters from the `params.json` file.
+
+    **kwargs
+        Other arguments of `tvdlr_data_cleaner`.
+
+    Returns
+    ----------
+    output_file : str or None
+        Path of the saved file. `None` if an input file cannot be opened or
+        there were no trials.
+    """
+    final_output = tvdlr_data_cleaner(input_file_paths=input_file_paths, params=params, **kwargs)
+
+    if final_output is None or final_output.empty:
+        return None
+
+    helper_functions.save_csv(final_output, output_file)
+    return output_file
+
 
 if __name__ == "__main__":
+    from tkinter import Tk, filedialog
 
     # interactive selection of an input file and output folder
     # ooutput file will be saved with the current time in a name
@@ -230,19 +511,7 @@ if __name__ == "__main__":
 
     output_file = f"{output_path}/{output_name}.csv"
 
-    try:
-        with open("2vdlr/params.json", "r") as f:
-            params = json.load(f)
-    except:
-        with open("params.json", "r") as f:
-            params = json.load(f)
-    else:
-        print("No parameters file found. Using default values.")
-        params = {'animals_to_ignore': []}
-
-
-    final_output = tvdlr_data_cleaner(input_file_paths=input_files, params=params)
+    params = load_params()
 
-    if not final_output.empty:
-        final_output.to_csv(output_file, index=False)
+    if tvdlr_process_files(input_files, output_file, params) is not None:
         print("\nOutput file was saved successfully!")
@@ -1,230 +1,291 @@
 import os
+import pickle
 import pandas as pd
 import numpy as np
 from tqdm import tqdm
 from datetime import datetime, timedelta
-from tkinter import Tk, filedialog
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import sys
 sys.path.append('../')
 import helper_functions
+import task_spec
+import raw_reader
+import event_cache
+import session_store
+import profiling
 
 
-def fcsrtt_data_cleaner(input_file_path, input_encoding="utf_16", input_sep=";", by_iti=False):
-    """Performs data maipulation from the raw csv file. Transform data in a way
-    that 1 row represents the single trial.
+def read_input_file(input_file_path, input_encoding="utf_16", input_sep=";", tz=None, cache_dir=None):
+    """Reads the raw csv file, drops the rows with the technical info and
+    the extra columns, and performs the initial cleaning.
 
     Parameters
     ----------
     input_file_path : str
-        Path to the csv file with the raw data.
+        Path to the csv file with the raw data or to the session store
+        made from it (see `session_store.py`).
 
     input_encoding : str
-        Encoding of an input file.
+        Encoding of an input file. If the file cannot be read with it,
+        the encoding is detected (see `raw_reader.sniff_format`).
 
     input_sep : str
-        Delimiter to use for an input file.
+        Delimiter to use for an input file. Detected the same way.
+
+    tz : str or None
+        Time zone of the system clock. See `helper_functions.serial_to_datetime`.
+
+    cache_dir : str or None
+        Folder for the parsed files. If set, the file is parsed only once
+        and later loaded from the cache (see `event_cache.cached_table`).
 
     Returns
     ----------
-    final_output : DataFrame
-        Resulted DataFrame object.
+    input_df : DataFrame
+        Cleaned data sorted in time, in the compact representation
+        (see `raw_reader.compact_events`).
     """
+    if session_store.is_store(input_file_path):
+        # the file was already read and cleaned
+        return session_store.load_table(input_file_path, options={'parser': 'fcsrtt', 'tz': tz})
+
+    if cache_dir is not None:
+        return event_cache.cached_table(
+            input_file_path,
+            partial(read_input_file, input_encoding=input_encoding, input_sep=input_sep, tz=tz),
+            options={'parser': 'fcsrtt', 'encoding': input_encoding, 'sep': input_sep, 'tz': tz},
+            cache_dir=cache_dir)
+
+    # rows with the technical info and extra columns are not parsed
+    input_df = raw_reader.read_raw_file(input_file_path, input_encoding, input_sep)
+    input_df = helper_functions.initial_cleaning(input_df, tz=tz)
+
+    return raw_reader.compact_events(input_df)
+
+
+# trials of the task (see `task_spec.trial_table`)
+TRIAL_SPEC = {
+    # trial = observations between 'symbol to touch' values
+    # for the last trial it's from 'symbol to touch' to 'end exp'
+    'trial_start': 'symbol to touch',
+    'start_values': {'trialStart': 'DateTime', 'stimulus': 'MsgValue1'},
+    'duration': {'name': 'trialDuration', 'round': 3},
+    'events': {'omission': {'select': 'omission'},
+               'incorrect': {'select': 'incorrect'},
+               'correct': {'select': 'correct'},
+               'reward': {'select': {'column': 'outLabel', 'equals': 'positive'}},
+               'presentTime': {'select': 'present time'}},
+    # duration of a stimulus; when 'present time' is not inside of the trial
+    # it is taken from the session at the time of the 'symbol to touch'
+    'values': {'stimulusDuration': {'event': 'presentTime', 'column': 'MsgValue1',
+                                    'fallback': {'select': 'present time', 'at': 'trialStart'}}},
+    # amount of premature events per trial
+    'counts': {'nPremature': {'select': 'premature'}},
+    # outcome precedence: omission > incorrect > correct
+    'outcome': {'name': 'outcome', 'default': 'undefined',
+                'cases': [{'case': 'omission', 'when': ['omission']},
+                          {'case': 'incorrect', 'when': ['incorrect']},
+                          {'case': 'correct', 'when': ['correct']}]},
+    # response time = time between 'incorrect'/'correct' and trial_start, in ms
+    # reward_latency = time between 'positive' and 'correct', in ms
+    # if the animal didn't get the reward rewardLatency will be -1
+    'latencies': {'responseLatency': {'cases': {'incorrect': ['start', 'incorrect'], 'correct': ['start', 'correct']},
+                                      'round': 3},
+                  'rewardLatency': {'cases': {'correct': ['correct', 'reward']}, 'missing': -1, 'round': 3}},
+    'columns': ['session', 'trial', 'trialStart', 'stimulus', 'trialDuration', 'outcome', 'responseLatency',
+                'rewardLatency', 'nPremature', 'stimulusDuration']}
+
+
+@profiling.profiled('trial_extraction')
+def fcsrtt_trial_table(session_df):
+    """Transforms the observations of one animal's sessions into the trials
+    table in a single vectorized pass (see `TRIAL_SPEC`).
 
-    # resulted data is encoded to 'utf_16', change if different
-    try:
-        input_df = pd.read_csv(input_file_path, encoding=input_encoding, sep=input_sep)
-        len(input_df['DateTime']) # check whether the `sep` was chosen right
-    except:
-        # exit the function if the input file cannot be opened
-        print("\nError while reading the input file. Change the `encoding` or `sep` parameters in the script.")
+    Parameters
+    ----------
+    session_df : DataFrame
+        Observations of all sessions of a single animal, ordered in time and
+        indexed from 0. The `session` column holds the session number.
+
+    Returns
+    ----------
+    trials_df : DataFrame
+        One row per trial with `session`, `trial`, `trialStart`, `stimulus`,
+        `stimulusDuration`, `outcome`, `responseLatency`, `rewardLatency`,
+        `nPremature` and `trialDuration` columns.
+    """
+    return task_spec.trial_table(session_df, TRIAL_SPEC)
+
+
+# ITI trials of the task: observations between 'iti' messages (see `task_spec.trial_table`)
+ITI_SPEC = {
+    'trial_start': 'iti',
+    'start_values': {'iti': 'MsgValue1', 'itiStart': 'DateTime'},
+    'counts': {'nPremature': {'select': 'premature'}},
+    'columns': ['session', 'trial', 'itiStart', 'iti', 'nPremature']}
+
+
+@profiling.profiled('trial_extraction')
+def fcsrtt_trial_iti_tables(session_df):
+    """Trials table (see `fcsrtt_trial_table`) and ITI trials table (see
+    `ITI_SPEC`) of the same observations in a single pass: the columns,
+    the event masks (e.g. 'premature' of both specs) and the numbering
+    of the trials are shared (see `task_spec.trial_tables`)."""
+    return task_spec.trial_tables(session_df, [TRIAL_SPEC, ITI_SPEC])
+
+
+def format_iti_table(animal_iti_out, animal_id, id_rfid):
+    """Adds the animal IDs and the session start to the ITI trials table of
+    an animal (see `ITI_SPEC`) and orders the columns. `None` if there were
+    no 'iti' messages. `sessionStart` is the time of the last 'iti' message
+    of the session."""
+    if animal_iti_out.empty:
         return None
 
-    # drop first rows from the data with the technical info
-    input_df = input_df[~input_df['DateTime'].astype(str).apply(lambda x: x.startswith('#'))]
-    # remove extra columns with additional information
-    input_df = input_df.loc[:, :"MsgValue3"]
+    animal_iti_out['IdLabel'] = animal_id
+    animal_iti_out['IdRFID'] = id_rfid
+    animal_iti_out['sessionStart'] = animal_iti_out.groupby('session')['itiStart'].transform('last')
+
+    return animal_iti_out[['IdRFID', 'IdLabel', 'session', 'sessionStart', 'trial', 'iti', 'nPremature']]
+
+
+def format_trial_table(animal_out, animal_id, id_rfid):
+    """Adds the animal IDs to the trials table of an animal and orders the columns."""
+    animal_out['IdLabel'] = animal_id
+    animal_out['IdRFID'] = id_rfid
+    return animal_out[['IdRFID', 'IdLabel', 'session', 'trial', 'trialStart', 'stimulus',
+                       'stimulusDuration', 'outcome', 'responseLatency', 'rewardLatency',
+                       'nPremature', 'trialDuration']]
+
+
+def fcsrtt_animal_tables(animal_df, animal_id, id_rfid, by_iti=False):
+    """Extracts the trials (and the ITI trials) of an animal. Both tables are
+    made in a single pass over the observations (see `fcsrtt_trial_iti_tables`),
+    so the ITI trials add only another segmentation of the sessions.
+
+    Parameters
+    ----------
+    animal_df : DataFrame
+        Observations of the sessions of the animal, indexed from 0, with the
+        `session` column (see `fcsrtt_trial_table`).
+
+    animal_id : str
+        Label of the animal.
+
+    id_rfid : str
+        RFID of the animal.
+
+    by_iti : bool
+        Whether to extract the ITI trials as well.
+
+    Returns
+    ----------
+    animal_out : DataFrame or None
+        Trials table (see `format_trial_table`). `None` if there were no trials.
+
+    animal_iti_out : list of DataFrame
+        ITI trials table (see `fcsrtt_trial_iti_tables` and `format_iti_table`), empty if there were none
+        or `by_iti` is `False`.
+    """
+    if by_iti:
+        animal_out, subj_iti_out = fcsrtt_trial_iti_tables(animal_df)
+        subj_iti_out = format_iti_table(subj_iti_out, animal_id, id_rfid)
+    else:
+        animal_out, subj_iti_out = fcsrtt_trial_table(animal_df), None
+    animal_out = None if animal_out.empty else format_trial_table(animal_out, animal_id, id_rfid)
+
+    animal_iti_out = []
+    if subj_iti_out is not None:
+        animal_iti_out.append(subj_iti_out)
+
+    return animal_out, animal_iti_out
 
-    # # sort the values since for some reason observations sometimes mixed in time
-    # input_df['DateTime'] = input_df['DateTime'].astype(float)
-    # input_df.sort_values(by='DateTime', inplace=True)
-    # input_df.reset_index(drop=True, inplace=True)
-    #
-    # # some datetime manipulations
-    # input_df['Timestamp'] = input_df['DateTime'].apply(lambda x: datetime.timestamp(from_ordinal(x)))
-    # input_df['DateTime'] = input_df['Timestamp'].apply(lambda x: datetime.fromtimestamp(x))
 
-    input_df = helper_functions.initial_cleaning(input_df)
+@profiling.profiled('session_detection')
+def fcsrtt_animal_sessions(input_df):
+    """Splits the cleaned data into the sessions of every animal.
+    Session = observations between 'start exp' and 'end exp'; the i-th
+    'start exp' of the animal is paired with its i-th 'end exp'. Sessions of
+    all animals are found in a single pass (see `helper_functions.session_index`).
 
+    Parameters
+    ----------
+    input_df : DataFrame
+        Cleaned data (see `helper_functions.initial_cleaning`), indexed from 0.
+
+    Returns
+    ----------
+    animal_sessions : list of tuple
+        Label of the animal and the observations of its sessions (with the
+        `session` column) for every animal with sessions.
+    """
     # select all possible animal IDs
-    ids = input_df['IdLabel'][~input_df['IdLabel'].isnull()].unique()
-    ids.sort()
-    ids_dict = dict(input_df[['IdLabel','IdRFID']].drop_duplicates().dropna().values)
+    ids = sorted(input_df['IdLabel'].dropna().unique())
+    sessions, unmatched = helper_functions.session_index(input_df)
 
-    # the final files templates
-    final_output = pd.DataFrame({})
-    final_iti_output = pd.DataFrame({})
+    animal_sessions = []
 
     for animal_id in ids: # iterating over all animals
 
         print(f"\nGathering data for the animal {animal_id}...")
 
-        # select the first session by the 'SystemMsg' variable
         # session = observations between 'start exp' and 'end exp'
-        indices_start = input_df[(input_df['IdLabel'] == animal_id) & (input_df['SystemMsg'] == 'start exp')].index
-        indices_end = input_df[(input_df['IdLabel'] == animal_id) & (input_df['SystemMsg'] == 'end exp')].index
-        try:
-            # check whether there are sessions for the animal
-            indices_start[0]
-            # check whether amount of 'start exp' equals to 'end exp'
-            if len(indices_start) != len(indices_end):
-                raise Exception
-        except:
+        # check whether there are sessions for the animal and
+        # whether amount of 'start exp' equals to 'end exp'
+        if animal_id not in sessions or animal_id in unmatched:
             # if either of the above conditions don't hold no further data
             # manipulations will be done with that animal
             print(f"No sessions were found for the animal {animal_id}.")
             continue
 
-        for session_i in range(len(indices_start)): # iterating over all sessions
-            # slice the session
-            ind_start = indices_start[session_i]
-            ind_end = indices_end[session_i]
-            subj_data = input_df.iloc[ind_start:ind_end+1, :].reset_index(drop=True)
-
-            # template for data of a single animal
-            animal_out = pd.DataFrame({})
-
-            # indeces of all trial start times
-            trial_indx = subj_data['SystemMsg'][subj_data['SystemMsg'] == 'symbol to touch'].index
-
-            for i in tqdm(range(len(trial_indx)), desc=f'Session {session_i+1}'): # iterating over all trials
-
-                # trial = observations between 'symbol to touch' values
-                # for the last trial it's from symbol to touch' to 'end exp'
-                if i != len(trial_indx)-1:
-                    trial_df = subj_data.iloc[trial_indx[i]:trial_indx[i+1],:]
-                else:
-                    trial_df = subj_data.iloc[trial_indx[i]:,:]
-
-                # all possible outcomes
-                outcome_list = trial_df['SystemMsg'].unique()
-                # start of the trial
-                trial_start = trial_df['DateTime'].to_list()[0]
-                trial_start_ts = trial_df['Timestamp'].to_list()[0]
-                trial_duration = trial_df['Timestamp'].to_list()[-1] - trial_start_ts
-
-                # response time = time between 'incorrect'/'correct' and trial_start, in ms
-                # reward_latency = time between 'positive' and 'correct', in ms
-                response_time = np.NaN
-                reward_latency = np.NaN
-
-                if 'omission' in outcome_list:
-                    outcome = 'omission'
-                elif 'incorrect' in outcome_list:
-                    outcome = 'incorrect'
-                    response_time = trial_df[trial_df['SystemMsg'] == 'incorrect']['Timestamp'].values[0] - trial_start_ts
-                elif 'correct' in outcome_list:
-                    outcome = 'correct'
-                    response_time = trial_df[trial_df['SystemMsg'] == 'correct']['Timestamp'].values[0] - trial_start_ts
-                    try:
-                        reward_latency = trial_df[trial_df['outLabel'] == 'positive']['Timestamp'].values[0] \
-                        - trial_df[trial_df['SystemMsg'] == 'correct']['Timestamp'].values[0]
-                    except:
-                        # if the animal didn't get the reward rewardLatency will be -1
-                        reward_latency = -1
-                else:
-                    outcome = 'undefined'
-
-                # amount of premature events per trial
-                if 'premature' in outcome_list:
-                    premature_n = trial_df['SystemMsg'].value_counts()['premature']
-                else:
-                    premature_n = 0
-
-                # the id of a stimulus and its duration (based on a raw data)
-                stimulus = trial_df[trial_df['SystemMsg'] == 'symbol to touch']['MsgValue1']
-                stim_time = trial_df[trial_df['SystemMsg'] == 'present time']['MsgValue1']
-
-                if stimulus.empty:
-                    stimulus = np.NaN
-                else:
-                    stimulus = stimulus.values[0]
-
-                if stim_time.empty:
-                    cndt = (subj_data['DateTime'] == trial_df['DateTime'][trial_df['SystemMsg'] == 'symbol to touch'].values[0])
-                    stim_time = subj_data['MsgValue1'][cndt & (subj_data['SystemMsg'] == 'present time')].values[0]
-                else:
-                    stim_time = stim_time.values[0]
-
-                animal_out = animal_out.append(
-                    {'outcome': outcome, 'trialDuration': trial_duration,
-                     'stimulus': stimulus, 'stimulusDuration': stim_time,
-                     'trialStart': trial_start, 'nPremature': premature_n,
-                     'responseLatency': response_time, 'rewardLatency': reward_latency,
-                     'session': session_i+1
-                    },
-                    ignore_index=True)
-
-            if not animal_out.emtpy:
-                animal_out['trial'] = np.arange(1, len(animal_out)+1) # trial indeces
-                animal_out['IdLabel'] = animal_id
-                animal_out['IdRFID'] = animal_out['IdLabel'].apply(lambda x: ids_dict[x])
-                animal_out = animal_out[['IdRFID', 'IdLabel', 'session', 'trial', 'trialStart', 'stimulus',
-                                     'stimulusDuration', 'outcome', 'responseLatency', 'rewardLatency',
-                                     'nPremature', 'trialDuration']]
-
-                # rounding up some values to 3 digits after comma
-                animal_out['responseLatency'] = animal_out['responseLatency'].apply(lambda x: np.round(x, 3))
-                animal_out['rewardLatency'] = animal_out['rewardLatency'].apply(lambda x: np.round(x, 3))
-                animal_out['trialDuration'] = animal_out['trialDuration'].apply(lambda x: np.round(x, 3))
-
-                final_output = final_output.append(animal_out)
-
-            iti_df = None
-
-            if by_iti:
-                iti_indx = subj_data['SystemMsg'][subj_data['SystemMsg'] == 'iti'].index
-
-                subj_iti_out = pd.DataFrame({})
-
-                for i in tqdm(range(len(iti_indx)), desc=f'Session {session_i+1} (by ITI)'):
-                    # iterating over all ITI-trials
-                    if i != len(iti_indx)-1:
-                        iti_df = subj_data.iloc[iti_indx[i]:iti_indx[i+1],:]
-                    else:
-                        iti_df = subj_data.iloc[iti_indx[i]:,:]
-
-                    iti_trial_df = pd.DataFrame({})
-                    iti_trial_df['iti'] = [iti_df['MsgValue1'][iti_df['SystemMsg'] == 'iti'].values[0]]
-                    iti_trial_df['nPremature'] = iti_df['SystemMsg'].to_list().count('premature')
-
-                    subj_iti_out = subj_iti_out.append(iti_trial_df)
-
-                if iti_df is not None:
-                    subj_iti_out['trial'] = np.arange(1, len(subj_iti_out)+1) #iti  trial indeces
-                    subj_iti_out['session'] = session_i+1
-                    subj_iti_out['IdLabel'] = animal_id
-                    subj_iti_out['IdRFID'] = subj_iti_out['IdLabel'].apply(lambda x: ids_dict[x])
-                    subj_iti_out['sessionStart'] = iti_df['DateTime'].to_list()[0]
-
-
-            if by_iti & (iti_df is not None):
-                subj_iti_out = subj_iti_out[['IdRFID', 'IdLabel', 'session', 'sessionStart', 'trial', 'iti', 'nPremature']]
-                final_iti_output = final_iti_output.append(subj_iti_out)
+        animal_sessions.append((animal_id, pd.concat(
+            [helper_functions.session_slice(input_df, session) for session in sessions[animal_id]],
+            ignore_index=True)))
+
+    return animal_sessions
+
+
+@profiling.profiled('final_ranking', rows=lambda final_output, *args: sum(map(len, final_output)))
+def finalize_output(final_output, final_iti_output, by_iti):
+    """Combines the trials tables of all animals (and sessions) and counts
+    the trials disregarding the sessions.
+
+    Parameters
+    ----------
+    final_output : list of DataFrame
+        Trials tables (see `format_trial_table`).
+
+    final_iti_output : list of DataFrame
+        ITI trials tables (see `ITI_SPEC` and `format_iti_table`).
+
+    by_iti : bool
+        Whether the data by ITI trials was requested.
+
+    Returns
+    ----------
+    final_output : DataFrame
+        Resulted DataFrame object.
 
+    final_iti_output : DataFrame
+        Resulted DataFrame object by ITI trials. Empty if `by_iti` is `False`.
+    """
+    final_output = pd.concat(final_output)
     final_output.sort_values(by=['IdLabel', 'session', 'trial'], inplace=True)
-    final_output.insert(4, 'trialTotal', np.NaN)
-    final_output.insert(5, 'trialByStimDuration', np.NaN)
-    final_output['trialTotal'] = final_output.groupby('IdLabel').rank(method="first", ascending=True)
+    final_output.insert(4, 'trialTotal', np.nan)
+    final_output.insert(5, 'trialByStimDuration', np.nan)
+    final_output['trialTotal'] = final_output.groupby('IdLabel').cumcount()+1
     final_output['trialByStimDuration'] = final_output.groupby(['IdLabel', 'stimulusDuration']).cumcount()+1
 
     clmns_to_cnvt = ['session', 'trial', 'trialTotal', 'trialByStimDuration', 'nPremature']
     final_output[clmns_to_cnvt] = final_output[clmns_to_cnvt].astype(int)
 
-    if (by_iti) & (not final_iti_output.empty):
+    if (by_iti) & (len(final_iti_output) > 0):
+        final_iti_output = pd.concat(final_iti_output)
         final_iti_output.sort_values(by=['IdLabel', 'session', 'trial'], inplace=True)
-        final_iti_output.insert(4, 'trialTotal', np.NaN)
-        final_iti_output.insert(5, 'trialByITI', np.NaN)
-        final_iti_output['trialTotal'] = final_iti_output.groupby('IdLabel').rank(method="first", ascending=True)
+        final_iti_output.insert(4, 'trialTotal', np.nan)
+        final_iti_output.insert(5, 'trialByITI', np.nan)
+        final_iti_output['trialTotal'] = final_iti_output.groupby('IdLabel').cumcount()+1
         final_iti_output['trialByITI'] = final_iti_output.groupby(['IdLabel', 'iti']).cumcount()+1
         final_iti_output.reset_index(drop=True, inplace=True)
         final_iti_output['iti'] = final_iti_output['iti'].astype(float)
@@ -234,7 +295,307 @@ def fcsrtt_data_cleaner(input_file_path, input_encoding="utf_16", input_sep=";",
         return final_output, pd.DataFrame()
 
 
+def fcsrtt_data_cleaner(input_file_path, input_encoding="utf_16", input_sep=";", by_iti=False, tz=None,
+                        chunksize=None, n_jobs=None, cache_dir=None, progress=True):
+    """Performs data maipulation from the raw csv file. Transform data in a way
+    that 1 row represents the single trial.
+
+    Parameters
+    ----------
+    input_file_path : str
+        Path to the csv file with the raw data.
+
+    input_encoding : str
+        Encoding of an input file.
+
+    input_sep : str
+        Delimiter to use for an input file.
+
+    by_iti : bool
+        Whether to return the data by ITI trials as well.
+
+    tz : str or None
+        Time zone of the system clock, e.g. "Europe/Berlin". If `None`,
+        the local time zone is used. See `helper_functions.serial_to_datetime`.
+
+    chunksize : int or None
+        If set, the file is read in blocks of `chunksize` rows and only the
+        unfinished sessions are carried between the blocks, so the memory use
+        is bounded by the largest session rather than by the file size.
+        Each 'end exp' closes the latest 'start exp' of the animal.
+
+    n_jobs : int or None
+        If set, the animals are processed in parallel by `n_jobs` processes
+        (-1 means all processors). Every process only gets the sessions of
+        its animal. Not used when `chunksize` is set.
+
+    cache_dir : str or None
+        Folder for the parsed raw files. If set, the raw file is parsed only
+        once; later runs load the cleaned data from the cache. Not used when
+        `chunksize` is set.
+
+    progress : bool
+        Whether to show the progress bar of the animals (of the sessions
+        with `chunksize`).
+
+    Returns
+    ----------
+    final_output : DataFrame
+        Resulted DataFrame object.
+    """
+
+    # the final files templates
+    final_output = []
+    final_iti_output = []
+
+    if chunksize is not None:
+        # streaming mode: the file is read block by block
+        # and only the finished sessions are kept in memory
+        try:
+            chunks = raw_reader.read_raw_chunks(input_file_path, input_encoding, input_sep, chunksize)
+        except:
+            # exit the function if the input file cannot be opened
+            print("\nError while reading the input file. Change the `encoding` or `sep` parameters in the script.")
+            return None
+
+        ids_dict = {}
+        for animal_id, subj_data in tqdm(raw_reader.iter_sessions(chunks, tz=tz), desc='Sessions',
+                                         disable=not progress):
+            ids_dict.update(subj_data[['IdLabel','IdRFID']].drop_duplicates().dropna().values)
+
+            animal_out, subj_iti_out = fcsrtt_animal_tables(subj_data, animal_id, ids_dict[animal_id], by_iti)
+            if animal_out is not None:
+                final_output.append(animal_out)
+            final_iti_output.extend(subj_iti_out)
+
+        return finalize_output(final_output, final_iti_output, by_iti)
+
+    # resulted data is encoded to 'utf_16', change if different
+    try:
+        input_df = read_input_file(input_file_path, input_encoding, input_sep, tz, cache_dir)
+    except:
+        # exit the function if the input file cannot be opened
+        print("\nError while reading the input file. Change the `encoding` or `sep` parameters in the script.")
+        return None
+
+    ids_dict = dict(input_df[['IdLabel','IdRFID']].drop_duplicates().dropna().values)
+
+    animal_sessions = fcsrtt_animal_sessions(input_df)
+
+    if n_jobs is None:
+        results = [fcsrtt_animal_tables(animal_df, animal_id, ids_dict[animal_id], by_iti)
+                   for animal_id, animal_df in tqdm(animal_sessions, desc='Animals', disable=not progress)]
+    else:
+        # parallel mode: only the sessions of an animal are sent to its process
+        del input_df
+        with ProcessPoolExecutor(max_workers=None if n_jobs == -1 else n_jobs) as executor:
+            futures = [executor.submit(fcsrtt_animal_tables, animal_df, animal_id, ids_dict[animal_id], by_iti)
+                       for animal_id, animal_df in animal_sessions]
+            del animal_sessions
+            results = [future.result() for future in tqdm(futures, desc='Animals', disable=not progress)]
+
+    for animal_out, animal_iti_out in results:
+        if animal_out is not None:
+            final_output.append(animal_out)
+        final_iti_output.extend(animal_iti_out)
+
+    return finalize_output(final_output, final_iti_output, by_iti)
+
+
+def continue_counter(output, column, keys, counters):
+    """Continues the trial counter `column` (counted from 1 by `finalize_output`)
+    from the last values of the previous run stored in `counters` and saves
+    the new last values there."""
+    key_values = list(zip(*[output[key].values for key in keys]))
+    output[column] = output[column].values + np.array([counters.get(key, 0) for key in key_values], dtype=int)
+    counters.update(zip(key_values, output[column].values))
+
+
+def fcsrtt_incremental_update(input_file_path, output_file, output_iti_file=None, checkpoint_file=None,
+                              input_encoding="utf_16", input_sep=";", tz=None, progress=True):
+    """Processes only the data appended to the raw csv file since the previous
+    run and appends the new trials to the output files.
+
+    The checkpoint stores the position in the raw file, the observations of
+    the unfinished sessions, the amount of sessions and the last values of
+    the trial counters of every animal. Each 'end exp' closes the latest
+    'start exp' of the animal (same as with `chunksize`).
+
+    Parameters
+    ----------
+    input_file_path : str
+        Path to the csv file with the raw data.
+
+    output_file : str
+        Path to the output csv file (see `fcsrtt_data_cleaner`).
+
+    output_iti_file : str or None
+        Path to the output csv file by ITI trials. If `None`, the data by ITI
+        trials is not processed.
+
+    checkpoint_file : str or None
+        Path to the checkpoint. Defaults to `output_file` + '.checkpoint'.
+        Remove it (and the output files) to process the raw file from scratch.
+
+    input_encoding : str
+        Encoding of an input file.
+
+    input_sep : str
+        Delimiter to use for an input file.
+
+    tz : str or None
+        Time zone of the system clock. See `helper_functions.serial_to_datetime`.
+
+    progress : bool
+        Whether to show the progress bar of the sessions.
+
+    Returns
+    ----------
+    final_output : DataFrame
+        New trials appended to the output file.
+
+    final_iti_output : DataFrame
+        New ITI trials appended to the output file by ITI trials.
+    """
+    if checkpoint_file is None:
+        checkpoint_file = output_file + '.checkpoint'
+    by_iti = output_iti_file is not None
+    output_files = [output_file, output_iti_file] if by_iti else [output_file]
+
+    if os.path.exists(checkpoint_file):
+        with open(checkpoint_file, 'rb') as f:
+            checkpoint = pickle.load(f)
+        if checkpoint['by_iti'] != by_iti:
+            print("\nThe checkpoint was made with a different `output_iti_file` setting.")
+            return None
+    else:
+        checkpoint = {'offset': 0, 'header': None, 'head': None, 'by_iti': by_iti, 'reader': {},
+                      'counters': {'trialTotal': {}, 'trialByStimDuration': {}, 'itiTrialTotal': {}, 'trialByITI': {}},
+                      'output_sizes': {fpath: 0 for fpath in output_files}}
+
+    for fpath in output_files:
+        if checkpoint['output_sizes'][fpath] > 0 and not os.path.exists(fpath):
+            print(f"\nOutput file {fpath} is missing. Remove the checkpoint to process the input file again.")
+            return None
+
+    try:
+        # the beginning of the file must stay the same
+        with open(input_file_path, 'rb') as f:
+            head = f.read(min(checkpoint['offset'], 4096))
+        if checkpoint['head'] is not None and head != checkpoint['head'][:len(head)]:
+            print("\nThe input file was changed since the previous run. Remove the checkpoint to process it again.")
+            return None
+
+        new_df, offset, header = raw_reader.read_raw_tail(input_file_path, checkpoint['offset'], checkpoint['header'],
+                                                          input_encoding, input_sep)
+    except:
+        # exit the function if the input file cannot be opened
+        print("\nError while reading the input file. Change the `encoding` or `sep` parameters in the script.")
+        return None
+
+    final_output = []
+    final_iti_output = []
+    ids_dict = {}
+    for animal_id, subj_data in tqdm(raw_reader.iter_sessions([new_df], tz=tz, state=checkpoint['reader']),
+                                     desc='Sessions', disable=not progress):
+        ids_dict.update(subj_data[['IdLabel','IdRFID']].drop_duplicates().dropna().values)
+
+        animal_out, subj_iti_out = fcsrtt_animal_tables(subj_data, animal_id, ids_dict[animal_id], by_iti)
+        if animal_out is not None:
+            final_output.append(animal_out)
+        final_iti_output.extend(subj_iti_out)
+
+    if len(final_output) > 0:
+        final_output, final_iti_output = finalize_output(final_output, final_iti_output, by_iti)
+    else:
+        final_output, final_iti_output = pd.DataFrame(), pd.DataFrame()
+
+    counters = checkpoint['counters']
+    if not final_output.empty:
+        continue_counter(final_output, 'trialTotal', ['IdLabel'], counters['trialTotal'])
+        continue_counter(final_output, 'trialByStimDuration', ['IdLabel', 'stimulusDuration'],
+                         counters['trialByStimDuration'])
+    if not final_iti_output.empty:
+        continue_counter(final_iti_output, 'trialTotal', ['IdLabel'], counters['itiTrialTotal'])
+        continue_counter(final_iti_output, 'trialByITI', ['IdLabel', 'iti'], counters['trialByITI'])
+
+    # drop the rows appended by the previous run if it was interrupted before saving the checkpoint
+    for fpath, new_output in zip(output_files, [final_output, final_iti_output]):
+        size = checkpoint['output_sizes'][fpath]
+        if os.path.exists(fpath) and os.path.getsize(fpath) > size:
+            with open(fpath, 'r+b') as f:
+                f.truncate(size)
+        if not new_output.empty:
+            with profiling.stage('csv_write', rows=len(new_output)):
+                new_output.to_csv(fpath, mode='a', header=size == 0, index=False)
+        if os.path.exists(fpath):
+            checkpoint['output_sizes'][fpath] = os.path.getsize(fpath)
+
+    with open(input_file_path, 'rb') as f:
+        checkpoint['head'] = f.read(min(offset, 4096))
+    checkpoint['offset'] = offset
+    checkpoint['header'] = header
+
+    # write to a temporary file first, so an interrupted run keeps the previous checkpoint
+    with open(checkpoint_file + '.tmp', 'wb') as f:
+        pickle.dump(checkpoint, f)
+    os.replace(checkpoint_file + '.tmp', checkpoint_file)
+
+    return final_output, final_iti_output
+
+
+def output_file_names(input_file_path, output_path):
+    """Returns the paths of the output file and the output file by ITI trials
+    of the raw csv file: the input file name with the "_PROCESSED" and
+    "_PROCESSED_ITI" suffixes."""
+    input_name = os.path.basename(input_file_path).replace(' ', '_')
+    return (os.path.join(output_path, input_name.replace('.csv', '_PROCESSED.csv')),
+            os.path.join(output_path, input_name.replace('.csv', '_PROCESSED_ITI.csv')))
+
+
+def fcsrtt_process_file(input_file_path, output_path, by_iti=True, **kwargs):
+    """Preprocesses the raw csv file and saves the output files
+    (see `output_file_names`) to the `output_path` folder.
+
+    Parameters
+    ----------
+    input_file_path : str
+        Path to the csv file with the raw data.
+
+    output_path : str
+        Folder for the output files.
+
+    by_iti : bool
+        Whether to save the data by ITI trials as well.
+
+    **kwargs
+        Other arguments of `fcsrtt_data_cleaner`.
+
+    Returns
+    ----------
+    output_files : list of str or None
+        Paths of the saved files. `None` if the input file cannot be opened.
+    """
+    output_file, output_iti_file = output_file_names(input_file_path, output_path)
+
+    result = fcsrtt_data_cleaner(input_file_path=input_file_path, by_iti=by_iti, **kwargs)
+    if result is None:
+        return None
+    final_output, final_iti_output = result
+
+    output_files = []
+    if not final_output.empty:
+        helper_functions.save_csv(final_output, output_file)
+        output_files.append(output_file)
+    if not final_iti_output.empty:
+        helper_functions.save_csv(final_iti_output, output_iti_file)
+        output_files.append(output_iti_file)
+
+    return output_files
+
+
 if __name__ == "__main__":
+    from tkinter import Tk, filedialog
 
     # interactive selection of an input file and output folder
     # ooutput file will be saved with the current time in a name
@@ -255,16 +616,12 @@ if __name__ == "__main__":
 #             by_iti = input('Sorry, I didn\'t understand [Y/n]: ')
 
     # specification of an output file name
-    output_name = input_file.split('/')[-1].replace(' ', '_').replace('.csv', '_PROCESSED.csv')
-    output_iti_name = input_file.split('/')[-1].replace(' ', '_').replace('.csv', '_PROCESSED_ITI.csv')
+    output_file, output_iti_file = output_file_names(input_file, output_path)
     # name_change = input(f"Output file name will be {output_name}.\nEnter a new name to change it" +
     #     " or press [Enter] to skip.\n")
     # if name_change != '':
     #     output_name = name_change + '.csv'
 
-    output_file = f"{output_path}/{output_name}"
-    output_iti_file = f"{output_path}/{output_iti_name}"
-
     # if os.path.exists(output_file):
     #     rewrite_file = input("File already exists. "+
     #                          "Enter a new file name or press [Enter] to rewrite the existing file.\n")
@@ -277,18 +634,13 @@ if __name__ == "__main__":
     print(f"OUTPUT FOLDER: {output_path}")
     print("="*40)
 
-    if by_iti:
-        final_output, final_iti_output = fcsrtt_data_cleaner(input_file_path=input_file, by_iti=by_iti)
+    output_files = fcsrtt_process_file(input_file, output_path, by_iti=by_iti)
 
-        if not final_iti_output.empty:
-            final_iti_output.to_csv(output_iti_file, index=False)
+    if output_files is not None:
+        if output_iti_file in output_files:
             print("\nOutput file by ITI was saved successfully!")
             print(f"File Path: {output_iti_file}")
 
-    else:
-        final_output = fcsrtt_data_cleaner(input_file_path=input_file, by_iti=by_iti)
-
-    if not final_output.empty:
-        final_output.to_csv(output_file, index=False)
-        print("\nOutput file was saved successfully!")
-        print(f"File Path: {output_file}")
+        if output_file in output_files:
+            print("\nOutput file was saved successfully!")
+            print(f"File Path: {output_file}")
@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+
+
+# metrics of the learning curves, the same as in the aggregated tables (see `plot_generator.aggregated_table`)
+METRICS = ['accuracy', 'omit_ratio', 'premature_ratio']
+
+DEFAULT_WINDOWS = [20, 50, 100]
+
+DEFAULT_CRITERIA = [{"name": "accuracy_80", "window": 50, "min_accuracy": 80},
+                    {"name": "accuracy_80_omission_20", "window": 50, "min_accuracy": 80, "max_omit_ratio": 20}]
+
+
+def rolling_metrics(df, windows):
+    """Accuracy, omission and premature ratios over the last N trials of every
+    animal, for all window sizes at once.
+
+    The sums over the windows are differences of the running sums of the
+    outcomes, so the time doesn't depend on the window size and grows
+    linearly with the amount of trials.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Trials table (see `fcsrtt_preprocessor.py`) without the excluded
+        observations, with `IdLabel`, `session`, `trialTotal`, `trialStart`,
+        `outcome` and `nPremature` columns.
+
+    windows : list of int
+        Amounts of the last trials (N).
+
+    Returns
+    ----------
+    metrics_df : DataFrame
+        One row per trial and window with the amount of trials of every
+        outcome in the window, `nPremature` and the metrics (in %, the
+        same formulas as in the aggregated tables). Only the trials with
+        at least N trials of the animal up to them are included.
+    """
+    df = df.sort_values(['IdLabel', 'trialTotal'], kind='stable').reset_index(drop=True)
+    # position of the trial among the trials of the animal
+    position = df.groupby('IdLabel').cumcount().values
+
+    counts = {'correct': (df['outcome'] == 'correct').values,
+              'incorrect': (df['outcome'] == 'incorrect').values,
+              'omission': (df['outcome'] == 'omission').values,
+              'nPremature': df['nPremature'].values}
+    # running sums over the trials of all animals, the window must not cross the animals
+    cumsums = {name: np.concatenate([[0], np.cumsum(values)]) for name, values in counts.items()}
+
+    metrics_df = []
+    for window in windows:
+        rows = np.flatnonzero(position >= window - 1)
+        window_df = df.loc[rows, ['IdLabel', 'session', 'trialTotal', 'trialStart']].reset_index(drop=True)
+        window_df.insert(3, 'window', window)
+        for name, cumsum in cumsums.items():
+            window_df[name] = cumsum[rows + 1] - cumsum[rows + 1 - window]
+        metrics_df.append(window_df)
+    metrics_df = pd.concat(metrics_df, ignore_index=True)
+
+    metrics_df['trial_count'] = metrics_df['correct'] + metrics_df['incorrect'] + metrics_df['omission']
+    metrics_df['accuracy'] = metrics_df['correct'] * 100 / (metrics_df['correct'] + metrics_df['incorrect'])
+    metrics_df['omit_ratio'] = metrics_df['omission'] * 100 / metrics_df['trial_count']
+    metrics_df['premature_ratio'] = metrics_df['nPremature'] * 100 / (metrics_df['nPremature'] +
+                                                                       metrics_df['trial_count'])
+    metrics_df[METRICS] = metrics_df[METRICS].round(2)
+
+    return metrics_df
+
+
+def criterion_mask(window_df, criterion):
+    """Whether the metrics satisfy the criterion: every `min_<metric>` /
+    `max_<metric>` key of the criterion is the lowest / highest allowed
+    value of the metric (both included)."""
+    mask = np.ones(len(window_df), dtype=bool)
+    for key, value in criterion.items():
+        if key.startswith('min_'):
+            mask &= (window_df[key[4:]] >= value).values
+        elif key.startswith('max_'):
+            mask &= (window_df[key[4:]] <= value).values
+    return mask
+
+
+def first_reached(metrics_df, criteria):
+    """Finds the first trial at which every animal reached each criterion.
+
+    Parameters
+    ----------
+    metrics_df : DataFrame
+        Rolling metrics (see `rolling_metrics`).
+
+    criteria : list of dict
+        Criteria with the `name`, the `window` (amount of the last trials)
+        and the limits of the metrics (see `criterion_mask`), e.g.
+        {"name": "accuracy_80", "window": 50, "min_accuracy": 80}.
+
+    Returns
+    ----------
+    criteria_df : DataFrame
+        One row per criterion and animal: `trials_to_criterion` (`trialTotal`
+        of the trial), `sessions_to_criterion` (its session), `reached_at`
+        (its start time) and the metrics at that trial. NaN if the animal
+        never reached the criterion.
+    """
+    animals = np.sort(metrics_df['IdLabel'].unique())
+
+    criteria_df = []
+    for criterion in criteria:
+        window_df = metrics_df[metrics_df['window'] == criterion['window']]
+        if window_df.empty and criterion['window'] not in metrics_df['window'].values:
+            raise ValueError(f"Metrics over {criterion['window']} trials were not computed "
+                             f"for the criterion {criterion['name']}.")
+
+        # trials of an animal are in the order of `trialTotal`
+        reached = window_df[criterion_mask(window_df, criterion)].drop_duplicates('IdLabel')
+        reached = reached.set_index('IdLabel').reindex(animals)
+        reached = reached.rename(columns={'trialTotal': 'trials_to_criterion', 'session': 'sessions_to_criterion',
+                                          'trialStart': 'reached_at'})
+        reached = reached[['trials_to_criterion', 'sessions_to_criterion', 'reached_at'] + METRICS]
+        reached = reached.rename_axis('IdLabel').reset_index()
+        reached.insert(0, 'criterion', criterion['name'])
+        reached.insert(2, 'window', criterion['window'])
+        criteria_df.append(reached)
+
+    return pd.concat(criteria_df, ignore_index=True)
+
+
+def learning_curve_tables(df, windows=None, criteria=None):
+    """Rolling metrics (see `rolling_metrics`) and the trials to criterion
+    (see `first_reached`). The windows of the criteria are computed even if
+    they are not in `windows`.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Trials table without the excluded observations.
+
+    windows : list of int or None
+        Amounts of the last trials, `DEFAULT_WINDOWS` by default.
+
+    criteria : list of dict or None
+        Criteria, `DEFAULT_CRITERIA` by default.
+
+    Returns
+    ----------
+    metrics_df : DataFrame
+        Rolling metrics.
+
+    criteria_df : DataFrame
+        Trials and sessions to criterion of every animal.
+    """
+    windows = DEFAULT_WINDOWS if windows is None else windows
+    criteria = DEFAULT_CRITERIA if criteria is None else criteria
+
+    all_windows = sorted(set(windows) | {criterion['window'] for criterion in criteria})
+    metrics_df = rolling_metrics(df, all_windows)
+    criteria_df = first_reached(metrics_df, criteria)
+
+    return metrics_df[metrics_df['window'].isin(windows)].reset_index(drop=True), criteria_df
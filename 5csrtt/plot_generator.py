@@ -1,15 +1,107 @@
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import os
 import json
-from tkinter import Tk, filedialog
-from functools import partial
+import hashlib
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
+import sys
+sys.path.append('../')
+import profiling
+import learning_curves
 
 plt.switch_backend('agg')
 
+# change it whenever the look of the plots changes,
+# so the plots made by the older code are rendered again
+PLOT_VERSION = 1
 
+MANIFEST_NAME = 'plot_manifest.json'
+
+VIEW_PARAMS = {'legend.fontsize': 'large',
+               'figure.figsize': (15, 5),
+               'axes.labelsize': 'large',
+               'axes.labelweight': 'bold',
+               'axes.titlesize':'x-large',
+               'axes.titleweight': 'bold',
+               'xtick.labelsize':'large',
+               'ytick.labelsize':'large'}
+
+
+def set_view():
+    """Sets the style of the plots. Called once in every process that renders plots."""
+    plt.switch_backend('agg')
+    plt.rcParams.update(VIEW_PARAMS)
+    sns.set_style("whitegrid")
+
+
+def boxplot_suffix(x, by_session=True):
+    """Returns the suffix of the boxplot title and file name."""
+    if x == 'IdLabel':
+        if by_session:
+            return 'by IDs (all Sessions)'
+        else:
+            return 'by IDs (all Stimulus Durations)'
+    elif x == 'stimulusDuration':
+        return 'by Stimulus Duration (all IDs)'
+    else:
+        return 'by Session (all IDs)'
+
+
+def plot_file_name(plot, kwargs):
+    """Returns the name of the jpg file made by `plot(**kwargs)`
+    (`boxplot_totals` or `relplot`)."""
+    yname = kwargs.get('yname') or kwargs['y'].replace('_', ' ').title()
+    if plot.__name__ == 'relplot':
+        suffix = f"by_{kwargs['x']}_and_phase" if kwargs.get('by_phase') else f"by_{kwargs['x']}"
+    else:
+        suffix = boxplot_suffix(kwargs['x'], kwargs.get('by_session', True)).lower().replace(' ', '_')
+    return f"{yname.lower().replace(' ', '_')}_{suffix}.jpg"
+
+
+def plot_hash(plot, kwargs):
+    """Returns the hash of everything the plot depends on: the used columns
+    of the data, the arguments of the plot and the plots version."""
+    columns = [kwargs['x'], kwargs['y']]
+    if plot.__name__ == 'relplot':
+        columns += ['IdLabel'] + (['phase'] if kwargs.get('by_phase') else [])
+    arguments = {key: value for key, value in kwargs.items() if key not in ('data', 'path')}
+
+    sha1 = hashlib.sha1()
+    sha1.update(json.dumps([plot.__name__, PLOT_VERSION, VIEW_PARAMS, arguments], sort_keys=True,
+                           default=str).encode())
+    sha1.update(kwargs['data'][list(dict.fromkeys(columns))].to_csv(index=False).encode())
+    return sha1.hexdigest()
+
+
+def table_hash(df):
+    """Returns the hash of the content of the table."""
+    return hashlib.sha1(df.to_csv(index=False).encode()).hexdigest()
+
+
+def load_plot_manifest(output_path):
+    """Returns the hashes of the output files made by the previous run of
+    `generate_plots` (file path relative to `output_path` -> hash)."""
+    try:
+        with open(os.path.join(output_path, MANIFEST_NAME), 'r') as f:
+            return json.load(f)['outputs']
+    except:
+        return {}
+
+
+def save_plot_manifest(output_path, outputs):
+    """Saves the hashes of the output files (see `load_plot_manifest`)."""
+    manifest_file = os.path.join(output_path, MANIFEST_NAME)
+    tmp_file = f"{manifest_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump({'version': PLOT_VERSION, 'outputs': outputs}, f, indent=4, sort_keys=True)
+    os.replace(tmp_file, manifest_file)
+
+
+@profiling.profiled(lambda data, x, y, **kwargs: f"boxplot_totals({y} by {x})")
 def boxplot_totals(data, x, y, path=None, xname=None, yname=None,
                    add_hline=False, show=False, uniform_color=False,
                    by_session=True):
@@ -55,16 +147,7 @@ def boxplot_totals(data, x, y, path=None, xname=None, yname=None,
         When `False`, data is aggregated from all Stimulus Durations by each subject.
 
     """
-    # set the suffix of the output file name
-    if x == 'IdLabel':
-        if by_session:
-            suffix = 'by IDs (all Sessions)'
-        else:
-            suffix = 'by IDs (all Stimulus Durations)'
-    elif x == 'stimulusDuration':
-        suffix = 'by Stimulus Duration (all IDs)'
-    else:
-        suffix = 'by Session (all IDs)'
+    suffix = boxplot_suffix(x, by_session)
 
     if xname == None:
         xname = x.replace('_', ' ').title()
@@ -85,24 +168,24 @@ def boxplot_totals(data, x, y, path=None, xname=None, yname=None,
     plt.xlabel(xname)
     plt.ylabel(yname)
     plt.title(f"{yname} {suffix}")
-    plt.savefig(f"{path}/{yname.lower().replace(' ', '_')}_{suffix.lower().replace(' ', '_')}.jpg")
+    plt.savefig(f"{path}/{plot_file_name(boxplot_totals, dict(x=x, y=y, yname=yname, by_session=by_session))}")
 
     if show:
         plt.show()
     plt.close()
 
 
+@profiling.profiled(lambda data, x, y, by_phase=False, **kwargs:
+                    f"relplot({y} by {x}{' and phase' if by_phase else ''})")
 def relplot(data, x, y, path=None, xname=None, yname=None,
-            add_yline=False, by_phase=False, show=False, ylim=None):
+            add_yline=False, by_phase=False, show=False, ylim=None, dense=False):
 
     if by_phase:
         height, aspect = (2, 4)
         col = "phase"
-        fname_suffix = f"{x}_and_phase"
     else:
         height, aspect = (2, 8)
         col = None
-        fname_suffix = x
 
     if xname == None:
         xname = x.replace('_', ' ').title()
@@ -110,10 +193,17 @@ def relplot(data, x, y, path=None, xname=None, yname=None,
     if yname == None:
         yname = y.replace('_', ' ').title()
 
-    img = sns.relplot(
-        data=data, x=x, y=y, row="IdLabel",
-        hue="IdLabel", marker="o",  markersize=12, col=col,
-        kind="line", height=height, aspect=aspect, legend=False)
+    if dense:
+        # many points (e.g. by trial): no markers and no aggregation of the same x values
+        img = sns.relplot(
+            data=data, x=x, y=y, row="IdLabel",
+            hue="IdLabel", col=col, estimator=None,
+            kind="line", height=height, aspect=aspect, legend=False)
+    else:
+        img = sns.relplot(
+            data=data, x=x, y=y, row="IdLabel",
+            hue="IdLabel", marker="o",  markersize=12, col=col,
+            kind="line", height=height, aspect=aspect, legend=False)
 
     if add_yline:
         try:
@@ -129,24 +219,101 @@ def relplot(data, x, y, path=None, xname=None, yname=None,
     if ylim:
         img.set(ylim=ylim)
 
-    img.set(xticks=data[x].unique())
+    if not dense:
+        img.set(xticks=data[x].unique())
     img.fig.suptitle(f"{yname} by {xname}", y=1.02, fontsize=20)
-    img.savefig(f"{path}/{yname.lower().replace(' ', '_')}_by_{fname_suffix}.jpg")
+    img.savefig(f"{path}/{plot_file_name(relplot, dict(x=x, y=y, yname=yname, by_phase=by_phase))}")
 
     if show:
         plt.show()
     plt.close()
 
 
-def aggregated_table(df, by1='IdLabel', by2='session', by_phase=False):
+def latency_ms(values):
+    """Latencies in whole ms (they are rounded to ms, see `TRIAL_SPEC`). Sums of
+    whole ms are exact in any order, so the means of the aggregated tables and
+    of `trial_window_sweep` are the same, also the ones exactly halfway between
+    two ms."""
+    return np.round(values * 1000)
+
+
+def mean_latency(total_ms, count):
+    """Mean latency in s from the sum of the latencies in ms, 0 if there are no latencies."""
+    return total_ms / 1000 / np.maximum(count, 1)
+
+
+def outcome_statistics(df, keys):
+    """Computes all statistics of the aggregated tables in a single grouped
+    pass over the trials table.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Trials table.
+
+    keys : list of str
+        Columns to group the trials by.
+
+    Returns
+    ----------
+    counts : DataFrame
+        Amount of trials with every outcome (one column per outcome, NaN if
+        the group has no such trials).
+
+    n_premature : Series
+        Sum of `nPremature` of the group, including the trials without the outcome.
+
+    latencies : DataFrame
+        Mean `responseLatency` and `rewardLatency` of every outcome, columns
+        as (latency, outcome). Mean of the group without latencies is 0.
     """
+    stats = df[keys + ['outcome', 'trial', 'nPremature']].assign(
+        responseLatency=latency_ms(df['responseLatency']), rewardLatency=latency_ms(df['rewardLatency'])
+    ).groupby(keys + ['outcome'], dropna=False).agg(
+        trials=('trial', 'count'), nPremature=('nPremature', 'sum'),
+        responseLatency=('responseLatency', 'sum'), responseCount=('responseLatency', 'count'),
+        rewardLatency=('rewardLatency', 'sum'), rewardCount=('rewardLatency', 'count'))
+    stats['responseLatency'] = mean_latency(stats['responseLatency'], stats['responseCount'])
+    stats['rewardLatency'] = mean_latency(stats['rewardLatency'], stats['rewardCount'])
+    # groups with missing keys are not counted, trials without the outcome
+    # only count for `nPremature`
+    has_keys = np.all([stats.index.get_level_values(key).notna() for key in keys], axis=0)
+    stats = stats[has_keys]
+    has_outcome = stats.index.get_level_values('outcome').notna()
+
+    n_premature = stats['nPremature'].groupby(level=list(range(len(keys)))).sum()
+    # levels with missing values are not sorted by the grouping
+    stats = stats[has_outcome].sort_index()
+    counts = stats['trials'].unstack('outcome').sort_index(axis=1)
+    latencies = stats[['responseLatency', 'rewardLatency']].fillna(0.0).unstack('outcome').sort_index(axis=1)
+
+    return counts, n_premature, latencies
+
+
+@profiling.profiled(lambda df, by1='IdLabel', by2='session', **kwargs: f"aggregated_table({by1}, {by2})")
+def aggregated_table(df, by1='IdLabel', by2='session', by_phase=False):
+    """Summary statistics of every group of trials: amount of trials with
+    every outcome, accuracy, omission and premature ratios and mean latencies.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Trials table (see `fcsrtt_preprocessor.py`).
 
+    by1, by2 : str
+        Columns to group the trials by, e.g. 'IdLabel' and 'session'.
+
+    by_phase : bool
+        Whether to add the `session_start` and `phase` columns (`by2` must be 'session').
+
+    Returns
+    ----------
+    agg_df : DataFrame
+        One row per group.
     """
+    counts, n_premature, latencies = outcome_statistics(df, [by1, by2])
 
-    agg_df = df.groupby(by=[by1, by2, 'outcome'], as_index=False)[['trial']].count()
-    agg_df = pd.pivot_table(data=agg_df, index=[by1, by2], columns='outcome',
-                            values='trial', aggfunc='sum')
-    agg_df.reset_index(drop=False, inplace=True)
+    agg_df = counts.reset_index()
     agg_df.rename_axis('', axis='columns', inplace=True)
 
     if by_phase:
@@ -166,8 +333,7 @@ def aggregated_table(df, by1='IdLabel', by2='session', by_phase=False):
     agg_df['total_count_wo_omit'] = agg_df['correct'] + agg_df['incorrect']
 
     agg_df = pd.merge(left=agg_df,
-                      right=df.groupby(by=[by1, by2],
-                                       as_index=False)[['nPremature']].sum(),
+                      right=n_premature.reset_index(),
                       on=[by1, by2])
 
     agg_df['accuracy'] = agg_df['correct'] * 100 / agg_df['total_count_wo_omit']
@@ -176,13 +342,7 @@ def aggregated_table(df, by1='IdLabel', by2='session', by_phase=False):
     agg_df[['accuracy', 'omit_ratio', 'premature_ratio']] = agg_df[['accuracy', 'omit_ratio', 'premature_ratio']].round(2)
 
     # latencies
-    latencies_df = df.groupby(
-        by=[by1, by2, 'outcome'],
-        as_index=False)
-    latencies_df = latencies_df[['responseLatency', 'rewardLatency']].mean()
-    latencies_df = pd.pivot_table(data=latencies_df, index=[by1, by2], columns='outcome',
-                                  values=['responseLatency','rewardLatency'], aggfunc='sum')
-    latencies_df.reset_index(drop=False, inplace=True)
+    latencies_df = latencies.reset_index()
     latencies_df.columns = ['_'.join(col) for col in latencies_df.columns]
     latencies_df.rename(columns={by1+'_': by1,
                                  by2+'_': by2,
@@ -190,7 +350,6 @@ def aggregated_table(df, by1='IdLabel', by2='session', by_phase=False):
                                  'responseLatency_incorrect': 'incorrect_latency',
                                  'rewardLatency_correct': 'reward_latency'},
                         inplace=True)
-#     latencies_df = latencies_df[[by1, by2, 'correct_latency', 'incorrect_latency', 'reward_latency']].fillna(0)
 
     agg_df = pd.merge(left=agg_df.round(3),
                       right=latencies_df.round(3),
@@ -200,43 +359,229 @@ def aggregated_table(df, by1='IdLabel', by2='session', by_phase=False):
     return agg_df
 
 
-if __name__ == '__main__':
+@profiling.profiled(lambda df, windows: f"trial_window_sweep({len(windows)} windows)")
+def trial_window_sweep(df, windows):
+    """Summary statistics by `IdLabel` and `stimulusDuration` (see
+    `aggregated_table`) for many `trialByStimDuration` windows at once.
 
-    view_params = {'legend.fontsize': 'large',
-                   'figure.figsize': (15, 5),
-                   'axes.labelsize': 'large',
-                   'axes.labelweight': 'bold',
-                   'axes.titlesize':'x-large',
-                   'axes.titleweight': 'bold',
-                   'xtick.labelsize':'large',
-                   'ytick.labelsize':'large'}
-    plt.rcParams.update(view_params)
-    sns.set_style("whitegrid")
+    The trials of every group are ordered by `trialByStimDuration` and the
+    running sums of the outcomes, `nPremature` and the latencies are taken
+    once (latencies in whole ms, see `latency_ms`, so the results are exactly
+    the ones of `aggregated_table`). Totals of a window are the differences of
+    the running sums at its bounds (found by the binary search), so 100 windows
+    cost about as much as a single aggregation.
 
-    root = Tk()
-    root.withdraw()
-    input_file = filedialog.askopenfilename(title='Choose the input file')
-    output_path = filedialog.askdirectory(title='Choose the folder for output files')
+    Parameters
+    ----------
+    df : DataFrame
+        Trials table (see `fcsrtt_preprocessor.py`) without the excluded observations.
+
+    windows : list of (int, int)
+        (`min_trial_number`, `max_trial_number`) pairs, both values are included.
+
+    Returns
+    ----------
+    sweep_df : DataFrame
+        One row per window and group: `min_trial_number`, `max_trial_number`
+        and the columns of `aggregated_table(by1='IdLabel', by2='stimulusDuration')`
+        of the trials in the window. Groups without trials in the window are left out.
+    """
+    keys = ['IdLabel', 'stimulusDuration']
+    grouped = df.groupby(keys)
+    group = grouped.ngroup().values
+    group_keys = grouped.size().index
+    # trials with missing keys (NaN group) are not counted
+    rows = np.flatnonzero(~np.isnan(group) & df['trialByStimDuration'].notna().values)
+
+    trial_number = df['trialByStimDuration'].values[rows].astype(np.int64)
+    first = trial_number.min()
+    span = trial_number.max() - first + 2
+    # single sorted key, the trials of a group follow each other in the order of `trialByStimDuration`
+    sort_key = group[rows].astype(np.int64) * span + (trial_number - first)
+    order = np.argsort(sort_key, kind='stable')
+    sort_key = sort_key[order]
+    rows = rows[order]
+
+    # outcomes are compared as codes, not as text (-1 is a missing outcome)
+    outcome_code, outcomes = pd.factorize(df['outcome'], sort=True)
+    outcome_code = outcome_code[rows]
+    sums = {'nPremature': df['nPremature'].values[rows]}
+    for code, outcome in enumerate(outcomes):
+        is_outcome = outcome_code == code
+        sums[outcome] = is_outcome
+        for latency in ['responseLatency', 'rewardLatency']:
+            values = df[latency].values[rows]
+            has_value = is_outcome & ~np.isnan(values)
+            # running sums in whole ms, the differences of float running sums are off in the last digits
+            sums[(latency, outcome)] = latency_ms(np.where(has_value, values, 0.0)).astype(np.int64)
+            sums[(latency, outcome, 'count')] = has_value
+    cumsums = {name: np.concatenate([[0], np.cumsum(values)]) for name, values in sums.items()}
+
+    # bounds of every window in every group (windows x groups), -1 and `span` - 1
+    # are out of the trial numbers of any group
+    bounds = np.array(windows, dtype=float).reshape(-1, 2)
+    low = np.clip(np.ceil(bounds[:, 0]) - first, -1, span - 1).astype(np.int64)
+    high = np.clip(np.floor(bounds[:, 1]) - first, -1, span - 1).astype(np.int64)
+    group_start = np.arange(len(group_keys)) * span
+    start = np.searchsorted(sort_key, (low[:, None] + group_start[None, :]).ravel(), 'left')
+    end = np.maximum(np.searchsorted(sort_key, (high[:, None] + group_start[None, :]).ravel(), 'right'), start)
+    totals = {name: cumsum[end] - cumsum[start] for name, cumsum in cumsums.items()}
+
+    sweep_df = pd.DataFrame({'min_trial_number': np.repeat(bounds[:, 0], len(group_keys)),
+                             'max_trial_number': np.repeat(bounds[:, 1], len(group_keys)),
+                             'IdLabel': np.tile(group_keys.get_level_values('IdLabel'), len(bounds)),
+                             'stimulusDuration': np.tile(group_keys.get_level_values('stimulusDuration'),
+                                                         len(bounds))})
+    if all(float(value).is_integer() for window in windows for value in window):
+        sweep_df[['min_trial_number', 'max_trial_number']] = sweep_df[['min_trial_number',
+                                                                       'max_trial_number']].astype(int)
+
+    for outcome in outcomes:
+        # as in `aggregated_table`, only the main outcomes are 0 if the group has no such trials
+        if outcome in ["correct", "incorrect", "omission"]:
+            sweep_df[outcome] = totals[outcome]
+        else:
+            sweep_df[outcome] = np.where(totals[outcome] > 0, totals[outcome], np.nan)
+
+    sweep_df['trial_count'] = sweep_df['correct'] + sweep_df['incorrect'] + sweep_df['omission']
+    sweep_df['total_count_wo_omit'] = sweep_df['correct'] + sweep_df['incorrect']
+    sweep_df['nPremature'] = totals['nPremature']
+
+    sweep_df['accuracy'] = sweep_df['correct'] * 100 / sweep_df['total_count_wo_omit']
+    sweep_df['omit_ratio'] = sweep_df['omission'] * 100 / sweep_df['trial_count']
+    sweep_df['premature_ratio'] = sweep_df['nPremature'] * 100 / (sweep_df['nPremature'] + sweep_df['trial_count'])
+    sweep_df[['accuracy', 'omit_ratio', 'premature_ratio']] = sweep_df[['accuracy', 'omit_ratio',
+                                                                        'premature_ratio']].round(2)
+
+    # latencies: mean of the outcome trials, 0 if they have no latencies, NaN if there are no such trials
+    latency_names = {('responseLatency', 'correct'): 'correct_latency',
+                     ('responseLatency', 'incorrect'): 'incorrect_latency',
+                     ('rewardLatency', 'correct'): 'reward_latency'}
+    for latency in ['responseLatency', 'rewardLatency']:
+        for outcome in outcomes:
+            mean = mean_latency(totals[(latency, outcome)], totals[(latency, outcome, 'count')])
+            sweep_df[latency_names.get((latency, outcome), f"{latency}_{outcome}")] = np.where(
+                totals[outcome] > 0, mean, np.nan)
+
+    has_trials = np.sum([totals[outcome] for outcome in outcomes], axis=0) > 0
+    sweep_df = sweep_df[has_trials].round(3).reset_index(drop=True)
+
+    return sweep_df
+
+
+def load_plot_parameters(params_path=None):
+    """Loads the plot parameters from the `plot_parameters.json` file. If the file
+    is not found, default values are used."""
+    if params_path is not None:
+        with open(params_path, 'r') as f:
+            return json.load(f)
 
     if os.path.exists('plot_parameters.json'):
         with open("plot_parameters.json", 'r') as f:
-            params = json.load(f)
+            return json.load(f)
     elif os.path.exists('plot_generator/plot_parameters.json'):
         with open("plot_generator/plot_parameters.json", 'r') as f:
-            params = json.load(f)
+            return json.load(f)
     else:
-        params = {"accuracy_threshold": 80,
-                  "min_trial_number": 0,
-                  "max_trial_number": 50
-                 }
         print("File with plot parameters wasn't found. Using default values.")
+        return {"accuracy_threshold": 80,
+                "min_trial_number": 0,
+                "max_trial_number": 50,
+                "rolling_windows": learning_curves.DEFAULT_WINDOWS,
+                "criteria": learning_curves.DEFAULT_CRITERIA
+               }
+
+
+def render_plot(plot, kwargs):
+    """Renders a single plot (`plot(**kwargs)`), a job of `render_plots`."""
+    try:
+        plot(**kwargs)
+    finally:
+        # a failed plot must not be drawn over by the next one
+        plt.close('all')
+
+
+def render_plots(jobs, n_jobs=None, progress=True):
+    """Renders the plots one by one or on the pool of processes.
+
+    Parameters
+    ----------
+    jobs : list of tuple
+        Plot function (e.g. `relplot`) and its keyword arguments for every plot.
+
+    n_jobs : int or None
+        If set, the plots are rendered in parallel by `n_jobs` processes
+        (-1 means all processors). The style of the plots is set once in
+        every process.
 
+    progress : bool
+        Whether to show the progress bar.
+
+    Returns
+    ----------
+    failed : dict
+        Error message of every plot that could not be rendered, by the name
+        of its file. The rest of the plots are rendered anyway.
+    """
+    failed = {}
+
+    if n_jobs is None:
+        set_view()
+        for plot, kwargs in tqdm(jobs, disable=not progress):
+            try:
+                render_plot(plot, kwargs)
+            except Exception:
+                failed[plot_file_name(plot, kwargs)] = traceback.format_exc()
+        return failed
+
+    with profiling.stage('plot_rendering'):
+        with ProcessPoolExecutor(max_workers=None if n_jobs == -1 else n_jobs, initializer=set_view) as executor:
+            futures = {executor.submit(render_plot, plot, kwargs): plot_file_name(plot, kwargs) for plot, kwargs in jobs}
+            for future in tqdm(as_completed(futures), total=len(futures), disable=not progress):
+                try:
+                    future.result()
+                except Exception:
+                    failed[futures[future]] = traceback.format_exc()
+
+    return failed
+
+
+def generate_plots(input_file, output_path, params, progress=True, n_jobs=None):
+    """Creates the plots and the aggregated tables from the preprocessed file
+    (see `fcsrtt_preprocessor.py`) in the `jpg` and `csv` subfolders of
+    the `output_path` folder.
+
+    Hashes of the inputs of every output file are saved to the manifest
+    (`plot_manifest.json`), so the next run only makes the files whose
+    inputs changed and deletes the files that are not made anymore.
+
+    Parameters
+    ----------
+    input_file : str
+        Path to the preprocessed csv file.
+
+    output_path : str
+        Folder for the output files.
+
+    params : dict
+        Plot parameters (see `load_plot_parameters`).
+
+    progress : bool
+        Whether to show the progress bars.
+
+    n_jobs : int or None
+        If set, the plots are rendered in parallel by `n_jobs` processes
+        (-1 means all processors). See `render_plots`.
+
+    Returns
+    ----------
+    failed : dict
+        Error message of every plot that could not be rendered, by the name
+        of its file.
+    """
     JPG_PATH = os.path.join(output_path, "jpg")
     CSV_PATH = os.path.join(output_path, "csv")
 
-    relplot = partial(relplot, path=JPG_PATH)
-    boxplot_totals = partial(boxplot_totals, path=JPG_PATH)
-
     try:
         os.mkdir(JPG_PATH)
     except FileExistsError:
@@ -249,14 +594,28 @@ if __name__ == '__main__':
 
     # data load
     print("Loading the data...")
-    experiment_df = pd.read_csv(input_file)
+    with profiling.stage('csv_read') as record:
+        experiment_df = pd.read_csv(input_file)
+        record['rows'] = len(experiment_df)
     experiment_df['trialStart'] = pd.to_datetime(experiment_df['trialStart'])
     experiment_df[['session', 'nPremature']] = experiment_df[['session', 'nPremature']].astype(int)
     print("Done")
 
+    # hashes of the output files made by the previous run
+    previous_outputs = load_plot_manifest(output_path)
+    outputs = {}
+
+    def save_table(df, file_name):
+        # the table is saved only if it changed since the previous run
+        outputs[f"csv/{file_name}"] = table_hash(df)
+        if (previous_outputs.get(f"csv/{file_name}") != outputs[f"csv/{file_name}"]
+                or not os.path.exists(f"{CSV_PATH}/{file_name}")):
+            with profiling.stage('csv_write', rows=len(df)):
+                df.to_csv(f"{CSV_PATH}/{file_name}", index=False)
+
     # exclude observations
     excld_df = experiment_df[(experiment_df['outcome'] == 'undefined') | (experiment_df['rewardLatency'] == -1)]
-    excld_df.to_csv(f"{CSV_PATH}/excluded_observations.csv", index=False)
+    save_table(excld_df, "excluded_observations.csv")
     experiment_df = experiment_df[~((experiment_df['outcome'] == 'undefined') | (experiment_df['rewardLatency'] == -1))]
     experiment_df.reset_index(drop=True, inplace=True)
 
@@ -271,42 +630,42 @@ if __name__ == '__main__':
         right=session_phase_df,
         on=['IdLabel','session'])
 
+    metrics = ['accuracy', 'omit_ratio', 'premature_ratio',
+               'correct_latency', 'incorrect_latency', 'reward_latency']
+
+    # plots are collected first and rendered all together
+    jobs = []
+
     ################
     ## BY SESSION ##
     ################
 
-    print("Creating plots by sessions...")
     totals_by_session = aggregated_table(df=experiment_df, by1='IdLabel', by2='session', by_phase=True)
-    totals_by_session.to_csv(f"{CSV_PATH}/totals_by_session.csv", index=False)
+    save_table(totals_by_session, "totals_by_session.csv")
 
-    metrics = ['accuracy', 'omit_ratio', 'premature_ratio',
-               'correct_latency', 'incorrect_latency', 'reward_latency']
-
-    for metric in tqdm(metrics):
+    for metric in metrics:
 
         if metric == 'accuracy':
             add_yline = params['accuracy_threshold']
         else:
             add_yline = False
 
-        relplot(data=totals_by_session, add_yline=add_yline,
-                x='session', y=metric)
+        jobs.append((relplot, dict(data=totals_by_session, add_yline=add_yline,
+                                   x='session', y=metric, path=JPG_PATH)))
 
-        relplot(data=totals_by_session, x='session', y=metric,
-                by_phase=True, add_yline=add_yline)
+        jobs.append((relplot, dict(data=totals_by_session, x='session', y=metric,
+                                   by_phase=True, add_yline=add_yline, path=JPG_PATH)))
 
-        boxplot_totals(data=totals_by_session, add_hline=add_yline,
-                       x='session', y=metric, uniform_color=True)
+        jobs.append((boxplot_totals, dict(data=totals_by_session, add_hline=add_yline,
+                                          x='session', y=metric, uniform_color=True, path=JPG_PATH)))
 
-        boxplot_totals(data=totals_by_session, add_hline=add_yline,
-                       x='IdLabel', y=metric, uniform_color=False)
+        jobs.append((boxplot_totals, dict(data=totals_by_session, add_hline=add_yline,
+                                          x='IdLabel', y=metric, uniform_color=False, path=JPG_PATH)))
 
     ##########################
     ## BY STIMULUS DURATION ##
     ##########################
 
-    print("Creating plots by the stimulus duration...")
-
     sample_df_by_trials = experiment_df[experiment_df['trialByStimDuration'].between(params['min_trial_number'],
                                                                                   params['max_trial_number'])]
     # sample_df_by_trials = experiment_df.groupby(by=['IdLabel', 'stimulusDuration'],
@@ -317,23 +676,92 @@ if __name__ == '__main__':
         by1='IdLabel',
         by2='stimulusDuration')
 
-    totals_by_stimulusDuration.to_csv(f"{CSV_PATH}/totals_by_stimulusDuration.csv", index=False)
+    save_table(totals_by_stimulusDuration, "totals_by_stimulusDuration.csv")
 
-    for metric in tqdm(metrics):
+    for metric in metrics:
 
         if metric == 'accuracy':
             add_yline = params['accuracy_threshold']
         else:
             add_yline = False
 
-        relplot(data=totals_by_stimulusDuration, x='stimulusDuration', y=metric,
-                xname='Stimulus Duration', add_yline=add_yline)
+        jobs.append((relplot, dict(data=totals_by_stimulusDuration, x='stimulusDuration', y=metric,
+                                   xname='Stimulus Duration', add_yline=add_yline, path=JPG_PATH)))
+
+        jobs.append((boxplot_totals, dict(data=totals_by_stimulusDuration, add_hline=add_yline,
+                                          x='stimulusDuration', xname='Stimulus Duration', y=metric,
+                                          uniform_color=True, by_session=False, path=JPG_PATH)))
+
+        jobs.append((boxplot_totals, dict(data=totals_by_stimulusDuration, add_hline=add_yline,
+                                          x='IdLabel', y=metric, uniform_color=False, by_session=False,
+                                          path=JPG_PATH)))
+
+    #####################
+    ## LEARNING CURVES ##
+    #####################
+
+    # parameter files made before the learning curves don't have them
+    windows = params.get('rolling_windows', learning_curves.DEFAULT_WINDOWS)
+    criteria = params.get('criteria', learning_curves.DEFAULT_CRITERIA)
+
+    with profiling.stage('learning_curves', rows=len(experiment_df)):
+        rolling_df, criteria_df = learning_curves.learning_curve_tables(experiment_df, windows, criteria)
+
+    save_table(rolling_df, "rolling_metrics.csv")
+    save_table(criteria_df, "trials_to_criterion.csv")
+
+    for window in windows:
+        window_df = rolling_df[rolling_df['window'] == window]
+
+        for metric in learning_curves.METRICS:
 
-        boxplot_totals(data=totals_by_stimulusDuration, add_hline=add_yline,
-                       x='stimulusDuration', xname='Stimulus Duration', y=metric,
-                       uniform_color=True, by_session=False)
+            if metric == 'accuracy':
+                add_yline = params['accuracy_threshold']
+            else:
+                add_yline = False
+
+            jobs.append((relplot, dict(data=window_df, x='trialTotal', y=metric, xname='Trial',
+                                       yname=f"Rolling {metric.replace('_', ' ').title()} {window}",
+                                       add_yline=add_yline, dense=True, path=JPG_PATH)))
+
+    # only the plots whose inputs changed are rendered
+    changed_jobs = []
+    for plot, kwargs in jobs:
+        file_name = plot_file_name(plot, kwargs)
+        outputs[f"jpg/{file_name}"] = plot_hash(plot, kwargs)
+        if (previous_outputs.get(f"jpg/{file_name}") != outputs[f"jpg/{file_name}"]
+                or not os.path.exists(f"{JPG_PATH}/{file_name}")):
+            changed_jobs.append((plot, kwargs))
+
+    print(f"Creating the plots ({len(changed_jobs)} of {len(jobs)} changed)...")
+    failed = render_plots(changed_jobs, n_jobs, progress)
+
+    for file_name, error in failed.items():
+        print(f"\nPlot {file_name} was not created:\n{error}")
+        # the plot is made again by the next run
+        del outputs[f"jpg/{file_name}"]
+
+    # delete the files of the previous run that are not made anymore (or are outdated)
+    for output_file in set(previous_outputs) - set(outputs):
+        if os.path.exists(os.path.join(output_path, output_file)):
+            os.remove(os.path.join(output_path, output_file))
+
+    save_plot_manifest(output_path, outputs)
+
+    if not failed:
+        print("All data files were saved successfully!")
+
+    return failed
+
+
+if __name__ == '__main__':
+    from tkinter import Tk, filedialog
+
+    root = Tk()
+    root.withdraw()
+    input_file = filedialog.askopenfilename(title='Choose the input file')
+    output_path = filedialog.askdirectory(title='Choose the folder for output files')
 
-        boxplot_totals(data=totals_by_stimulusDuration, add_hline=add_yline,
-                       x='IdLabel', y=metric, uniform_color=False, by_session=False)
+    params = load_plot_parameters()
 
-    print("All data files were saved successfully!")
+    generate_plots(input_file, output_path, params, n_jobs=-1)
@@ -0,0 +1,188 @@
+import os
+import glob
+import json
+import sqlite3
+import argparse
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+
+# change it whenever the layout of the rollup file changes
+ROLLUP_VERSION = 1
+
+# groups of the `rollup` table. All its measures are sums (or min/max), so
+# the coarser views (e.g. totals by session within the dates) are sums of the groups
+ROLLUP_KEYS = ['IdLabel', 'IdRFID', 'session', 'sessionStart', 'phase', 'date', 'stimulusDuration', 'outcome']
+
+# trial-level columns that are kept in the `trials` table
+TRIAL_COLUMNS = ['IdLabel', 'IdRFID', 'session', 'trial', 'trialByStimDuration', 'trialStart', 'date',
+                 'sessionStart', 'phase', 'stimulus', 'stimulusDuration', 'outcome',
+                 'responseLatency', 'rewardLatency', 'nPremature', 'trialDuration']
+
+
+def load_trials(processed_files):
+    """Reads the preprocessed files (see `fcsrtt_preprocessor.py`) and splits
+    the trials the same way as the dashboard and the plot generator do.
+
+    Parameters
+    ----------
+    processed_files : list of str
+        Paths to the preprocessed csv files.
+
+    Returns
+    ----------
+    trials_df : DataFrame
+        Trials with the start time (`sessionStart`) and the `phase` of the
+        session and the `date` of the trial, sorted by animal and session.
+
+    excluded_df : DataFrame
+        Observations that had `outcome` = undefined or `rewardLatency` = -1.
+    """
+    trials_df = pd.concat([pd.read_csv(fpath) for fpath in processed_files], ignore_index=True)
+    trials_df['trialStart'] = pd.to_datetime(trials_df['trialStart'])
+    trials_df[['session', 'nPremature']] = trials_df[['session', 'nPremature']].astype(int)
+
+    # exclude observations
+    is_excluded = (trials_df['outcome'] == 'undefined') | (trials_df['rewardLatency'] == -1)
+    excluded_df = trials_df[is_excluded].reset_index(drop=True)
+    trials_df = trials_df[~is_excluded].reset_index(drop=True)
+
+    # start time and phase of each session
+    trials_df['sessionStart'] = trials_df.groupby(['IdLabel', 'session'])['trialStart'].transform('min')
+    session_hour = trials_df['sessionStart'].dt.hour
+    trials_df['phase'] = np.where((session_hour >= 6) & (session_hour < 18), 'light', 'dark')
+    trials_df['date'] = trials_df['trialStart'].dt.strftime('%Y-%m-%d')
+
+    # trials of an animal are stored next to each other
+    trials_df = trials_df.sort_values(['IdLabel', 'session', 'trial'], kind='stable').reset_index(drop=True)
+    return trials_df[TRIAL_COLUMNS], excluded_df
+
+
+def rollup_table(trials_df):
+    """Aggregates the trials by `ROLLUP_KEYS`.
+
+    Means are kept as the sum and the amount of values (e.g. `responseLatency_sum`
+    and `responseLatency_n`), so they can be combined over any groups.
+    `trialEnd_max` is the end time of the last trial of the group.
+    """
+    trials_df = trials_df.assign(trialEnd=trials_df['trialStart'] +
+                                 pd.to_timedelta(trials_df['trialDuration'], unit='s'))
+
+    rollup_df = trials_df.groupby(ROLLUP_KEYS, dropna=False, sort=True).agg(
+        n=('trial', 'size'),
+        nPremature=('nPremature', 'sum'),
+        responseLatency_sum=('responseLatency', 'sum'),
+        responseLatency_n=('responseLatency', 'count'),
+        rewardLatency_sum=('rewardLatency', 'sum'),
+        rewardLatency_n=('rewardLatency', 'count'),
+        trialByStimDuration_max=('trialByStimDuration', 'max'),
+        trialStart_min=('trialStart', 'min'),
+        trialEnd_max=('trialEnd', 'max'))
+    return rollup_df.reset_index()
+
+
+def iti_table(iti_files):
+    """Amount of premature responses of every animal by ITI, summed up over
+    the ITI files (see `fcsrtt_preprocessor.py`)."""
+    iti_df = pd.concat([pd.read_csv(fpath) for fpath in iti_files], ignore_index=True)
+    return iti_df.groupby(['IdLabel', 'iti'], as_index=False)['nPremature'].sum()
+
+
+def time_columns_to_text(df):
+    """Converts the datetime columns into text, as SQLite has no time type
+    (the text is parsed by `ymd_hms` in the dashboard)."""
+    df = df.copy()
+    for column in df.columns[[pd.api.types.is_datetime64_any_dtype(dtype) for dtype in df.dtypes]]:
+        df[column] = df[column].dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+    return df
+
+
+def build_rollup_store(processed_files, rollup_file, iti_files=None):
+    """Writes the rollup file of the dashboard: a SQLite database with the
+    pre-aggregated views of the preprocessed files.
+
+    Tables:
+
+    * `rollup`: aggregates by animal, session, date, stimulus duration and
+      outcome (see `rollup_table`);
+    * `trials`: trial-level data, stored and indexed by animal and session;
+    * `totals_by_iti`: premature responses by animal and ITI (only if `iti_files` are given);
+    * `excluded`: excluded observations;
+    * `meta`: version of the layout, creation time and the source files.
+
+    The file is written to a temporary file first and then moved, so the
+    dashboard never reads a half-written file.
+
+    Parameters
+    ----------
+    processed_files : list of str
+        Paths to the preprocessed csv files.
+
+    rollup_file : str
+        Path to the output file (e.g. "rollup.sqlite").
+
+    iti_files : list of str or None
+        Paths to the preprocessed files with the ITI data.
+
+    Returns
+    ----------
+    rollup_file : str
+        Path to the saved file.
+    """
+    trials_df, excluded_df = load_trials(processed_files)
+    rollup_df = rollup_table(trials_df)
+
+    tmp_file = f"{rollup_file}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+
+    con = sqlite3.connect(tmp_file)
+    try:
+        time_columns_to_text(rollup_df).to_sql('rollup', con, index=False)
+        time_columns_to_text(trials_df).to_sql('trials', con, index=False)
+        time_columns_to_text(excluded_df).to_sql('excluded', con, index=False)
+        if iti_files:
+            iti_table(iti_files).to_sql('totals_by_iti', con, index=False)
+
+        con.execute("CREATE INDEX rollup_date ON rollup (date)")
+        con.execute("CREATE INDEX trials_animal ON trials (IdLabel, session)")
+        con.execute("CREATE INDEX trials_window ON trials (trialByStimDuration, date)")
+
+        meta = {'version': ROLLUP_VERSION, 'created': datetime.now().isoformat(timespec='seconds'),
+                'processed_files': json.dumps([os.path.basename(fpath) for fpath in processed_files]),
+                'iti_files': json.dumps([os.path.basename(fpath) for fpath in iti_files or []])}
+        pd.DataFrame({'key': list(meta), 'value': [str(value) for value in meta.values()]}).to_sql(
+            'meta', con, index=False)
+        con.commit()
+    finally:
+        con.close()
+
+    os.replace(tmp_file, rollup_file)
+    return rollup_file
+
+
+def expand_patterns(patterns):
+    """Returns the sorted list of the files matching the glob patterns
+    (patterns in quotes are not expanded by the shell). Raises
+    FileNotFoundError if nothing matches a pattern."""
+    files = set()
+    for pattern in patterns:
+        matches = glob.glob(pattern)
+        if len(matches) == 0:
+            raise FileNotFoundError(f"No files match {pattern}.")
+        files.update(matches)
+    return sorted(files)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pre-aggregated rollup file of the preprocessed 5-CSRTT "
+                                                 "files for the dashboard.")
+    parser.add_argument('processed_files', nargs='+', help="preprocessed csv files")
+    parser.add_argument('-o', '--output', default='rollup.sqlite', help="output file")
+    parser.add_argument('--iti', nargs='+', help="preprocessed files with the ITI data")
+    args = parser.parse_args()
+
+    iti_files = None if args.iti is None else expand_patterns(args.iti)
+    rollup_file = build_rollup_store(expand_patterns(args.processed_files), args.output, iti_files)
+    print(f"Rollup file was saved to {rollup_file}")
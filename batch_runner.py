@@ -0,0 +1,276 @@
+import os
+import sys
+import glob
+import json
+import shutil
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+ROOT_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(ROOT_PATH, '5csrtt'))
+sys.path.append(os.path.join(ROOT_PATH, '2vdlr'))
+import fcsrtt_preprocessor
+import tvdlr_preprocessor
+import profiling
+
+
+def expand_inputs(patterns):
+    """Returns the sorted list of the raw csv files from the folders
+    (all csv files inside, recursively) and glob patterns. Output files of
+    the preprocessors ("_PROCESSED" suffix) are left out."""
+    input_files = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '**', '*.csv')
+        input_files.update(glob.glob(pattern, recursive=True))
+
+    return sorted(fpath for fpath in input_files
+                  if os.path.isfile(fpath) and '_PROCESSED' not in os.path.basename(fpath))
+
+
+def is_up_to_date(output_files, input_files):
+    """Whether all output files exist and are newer than all input files."""
+    try:
+        outputs_time = min(os.path.getmtime(fpath) for fpath in output_files)
+    except (OSError, ValueError):
+        return False
+    return all(os.path.getmtime(fpath) <= outputs_time for fpath in input_files)
+
+
+def is_quarantined(input_file, quarantine_path):
+    """Whether the same version of the file (size and modification time)
+    was already quarantined."""
+    quarantined_file = os.path.join(quarantine_path, os.path.basename(input_file))
+    if not os.path.exists(quarantined_file):
+        return False
+    input_stat, quarantined_stat = os.stat(input_file), os.stat(quarantined_file)
+    return (input_stat.st_size == quarantined_stat.st_size) & (input_stat.st_mtime == quarantined_stat.st_mtime)
+
+
+def quarantine(input_file, quarantine_path, error):
+    """Copies the file that cannot be processed to the quarantine folder
+    together with the error message. The original file is left untouched
+    (it may still be written by the system) and is skipped by the next runs
+    until it changes."""
+    os.makedirs(quarantine_path, exist_ok=True)
+    quarantined_file = os.path.join(quarantine_path, os.path.basename(input_file))
+    shutil.copy2(input_file, quarantined_file)
+    with open(quarantined_file + '.error.txt', 'w') as f:
+        f.write(f"{input_file}\n\n{error}")
+    print(f"\nFile {input_file} was quarantined: {quarantined_file}")
+
+
+def run_fcsrtt(input_file, output_path, by_iti, kwargs, report_file=None):
+    """Preprocessing job of a 5-CSRTT file. Returns the output files."""
+    os.makedirs(output_path, exist_ok=True)
+    with profiling.profile_run(report_file):
+        output_files = fcsrtt_preprocessor.fcsrtt_process_file(input_file, output_path, by_iti=by_iti, **kwargs)
+    if output_files is None:
+        raise ValueError("The file cannot be read. Check the `encoding` and `sep` parameters.")
+    if len(output_files) == 0:
+        raise ValueError("No trials were found in the file.")
+    return output_files
+
+
+def run_plots(processed_file, plot_path, plot_params, progress=False, report_file=None):
+    """Plotting job of a preprocessed 5-CSRTT file."""
+    # plotting packages are only needed for the plots, not for the preprocessing
+    import plot_generator
+
+    os.makedirs(plot_path, exist_ok=True)
+    with profiling.profile_run(report_file):
+        failed = plot_generator.generate_plots(processed_file, plot_path, plot_params, progress)
+    if failed:
+        raise RuntimeError(f"Plots {', '.join(failed)} were not created.")
+    return plot_path
+
+
+def run_tvdlr(input_files, output_file, params, kwargs, report_file=None):
+    """Preprocessing job of a group of 2-VDLR files. If some files cannot be
+    read, they are left out. Returns the output file (`None` if nothing was
+    saved) and the errors of the left out files."""
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    with profiling.profile_run(report_file):
+        saved_file = tvdlr_preprocessor.tvdlr_process_files(input_files, output_file, params, **kwargs)
+    if saved_file is not None:
+        return saved_file, {}
+
+    # find the files that cannot be read
+    bad_files = {}
+    for fpath in input_files:
+        try:
+            tvdlr_preprocessor.read_input_file(fpath, kwargs['input_encoding'], kwargs['input_sep'])
+        except Exception:
+            bad_files[fpath] = traceback.format_exc()
+
+    input_files = [fpath for fpath in input_files if fpath not in bad_files]
+    if len(bad_files) == 0 or len(input_files) == 0:
+        return None, bad_files
+    return tvdlr_preprocessor.tvdlr_process_files(input_files, output_file, params, **kwargs), bad_files
+
+
+def plan_jobs(manifest):
+    """Turns the manifest into the list of the jobs that are not up to date.
+
+    Every job is a tuple (kind, job function, arguments, input files), where
+    kind is '5csrtt', 'plots' or '2vdlr'. Plotting jobs of the 5-CSRTT files
+    are returned separately in a dict: input file -> job, as they can only
+    start after the preprocessing of the file.
+    """
+    quarantine_path = manifest.get('quarantine', 'quarantine')
+    # progress bars of the parallel jobs would be mixed up, so they are off by default
+    progress = manifest.get('progress', False)
+    profile_path = manifest.get('profile')
+    if profile_path is not None:
+        os.makedirs(profile_path, exist_ok=True)
+
+    def report_file(fpath, kind):
+        if profile_path is None:
+            return None
+        return os.path.join(profile_path, f"{os.path.basename(fpath)}.{kind}.json")
+
+    jobs, plot_jobs = [], {}
+
+    for task in manifest['jobs']:
+        kwargs = {'input_encoding': task.get('encoding', manifest.get('encoding', "utf_16")),
+                  'input_sep': task.get('sep', manifest.get('sep', ";")),
+                  'tz': task.get('tz', manifest.get('tz'))}
+        if task.get('cache_dir', manifest.get('cache_dir')) is not None:
+            kwargs['cache_dir'] = task.get('cache_dir', manifest.get('cache_dir'))
+
+        input_files = []
+        for fpath in expand_inputs(task['inputs']):
+            if is_quarantined(fpath, quarantine_path):
+                print(f"\nFile {fpath} is skipped: it was quarantined and didn't change since.")
+            else:
+                input_files.append(fpath)
+
+        if task['task'] == '5csrtt':
+            by_iti = task.get('by_iti', True)
+            plot_params = None
+            if task.get('plots', False):
+                import plot_generator
+                plot_params = task.get('plot_params', plot_generator.load_plot_parameters(
+                    os.path.join(ROOT_PATH, '5csrtt', 'plot_parameters.json')))
+
+            for fpath in input_files:
+                output_file, output_iti_file = fcsrtt_preprocessor.output_file_names(fpath, task['output'])
+                # the file is processed again if the ITI output is missing, e.g. when `by_iti` was turned on
+                output_files = [output_file, output_iti_file] if by_iti else [output_file]
+                plot_path = output_file.replace('.csv', '_plots')
+                plot_job = ('plots', run_plots,
+                            (output_file, plot_path, plot_params, progress, report_file(fpath, 'plots')), [fpath])
+
+                if not is_up_to_date(output_files, [fpath]):
+                    jobs.append(('5csrtt', run_fcsrtt, (fpath, task['output'], by_iti, dict(kwargs, progress=progress),
+                                                        report_file(fpath, '5csrtt')), [fpath]))
+                    if plot_params is not None:
+                        plot_jobs[fpath] = plot_job
+                elif plot_params is not None and not is_up_to_date(
+                        [os.path.join(plot_path, plot_generator.MANIFEST_NAME)], [output_file]):
+                    jobs.append(plot_job)
+
+        elif task['task'] == '2vdlr':
+            params = task.get('params', tvdlr_preprocessor.load_params(
+                os.path.join(ROOT_PATH, '2vdlr', 'params.json')))
+            if len(input_files) > 0 and not is_up_to_date([task['output']], input_files):
+                jobs.append(('2vdlr', run_tvdlr, (input_files, task['output'], params, kwargs,
+                                                  report_file(task['output'], '2vdlr')), input_files))
+
+        else:
+            raise ValueError(f"Unknown task {task['task']}. Possible values are '5csrtt' and '2vdlr'.")
+
+    return jobs, plot_jobs
+
+
+def run_manifest(manifest):
+    """Runs all preprocessing and plotting jobs of the manifest on the pool
+    of processes. Files that cannot be processed are quarantined, the rest of
+    the jobs are not affected.
+
+    Parameters
+    ----------
+    manifest : dict
+        Jobs description, see the README file.
+
+    Returns
+    ----------
+    failed : list of str
+        Input files that were quarantined (or jobs that failed).
+    """
+    quarantine_path = manifest.get('quarantine', 'quarantine')
+    n_jobs = manifest.get('n_jobs', -1)
+    jobs, plot_jobs = plan_jobs(manifest)
+    print(f"\n{len(jobs) + len(plot_jobs)} jobs to run.")
+
+    failed = []
+    with ProcessPoolExecutor(max_workers=None if n_jobs == -1 else n_jobs) as executor:
+        running = {executor.submit(job, *args): (kind, job, args, input_files)
+                   for kind, job, args, input_files in jobs}
+
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, job, args, input_files = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception:
+                    error = traceback.format_exc()
+                    if kind == '5csrtt':
+                        quarantine(input_files[0], quarantine_path, error)
+                    else:
+                        print(f"\nJob {kind} of {', '.join(input_files)} failed:\n{error}")
+                    failed.extend(input_files)
+                    continue
+
+                if kind == '5csrtt':
+                    print(f"\nFile {input_files[0]} is processed.")
+                    if input_files[0] in plot_jobs:
+                        kind, job, args, input_files = plot_jobs[input_files[0]]
+                        running[executor.submit(job, *args)] = (kind, job, args, input_files)
+                elif kind == '2vdlr':
+                    output_file, bad_files = result
+                    for fpath, error in bad_files.items():
+                        quarantine(fpath, quarantine_path, error)
+                    failed.extend(bad_files)
+                    if output_file is not None:
+                        print(f"\nFile {output_file} is saved.")
+                else:
+                    print(f"\nPlots of {input_files[0]} are saved.")
+
+    print(f"\nDone. {len(failed)} files failed.")
+    return failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Non-interactive preprocessing (and plotting) of many raw files.")
+    parser.add_argument('task', nargs='?', choices=['5csrtt', '2vdlr'],
+                        help="task of the input files (if no manifest is given)")
+    parser.add_argument('inputs', nargs='*', help="input folders or glob patterns")
+    parser.add_argument('-m', '--manifest', help="json file with the jobs description")
+    parser.add_argument('-o', '--output', help="output folder (5csrtt) or output file (2vdlr)")
+    parser.add_argument('--plots', action='store_true', help="create the plots of the 5csrtt files")
+    parser.add_argument('-j', '--n-jobs', type=int, default=-1, help="amount of processes (-1 means all processors)")
+    parser.add_argument('--quarantine', default='quarantine', help="folder for the files that cannot be processed")
+    parser.add_argument('--profile', help="folder for the json reports with the time and memory use of every stage")
+    parser.add_argument('--progress', action='store_true', help="show the progress bars")
+    args = parser.parse_args()
+
+    if args.manifest is not None:
+        with open(args.manifest, 'r') as f:
+            manifest = json.load(f)
+    elif args.task is not None and args.inputs and args.output is not None:
+        manifest = {'jobs': [{'task': args.task, 'inputs': args.inputs, 'output': args.output,
+                              'plots': args.plots}]}
+    else:
+        parser.error("either the manifest or the task, inputs and output must be given")
+
+    manifest.setdefault('n_jobs', args.n_jobs)
+    manifest.setdefault('quarantine', args.quarantine)
+    manifest.setdefault('profile', args.profile)
+    manifest.setdefault('progress', args.progress)
+
+    failed = run_manifest(manifest)
+    sys.exit(1 if failed else 0)
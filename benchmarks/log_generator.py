@@ -0,0 +1,208 @@
+import argparse
+import numpy as np
+
+
+# columns of the raw file as exported by the system; the columns after
+# `MsgValue3` hold additional information and are dropped by the preprocessors
+COLUMNS = ['DateTime', 'IdRFID', 'IdLabel', 'unitLabel', 'eventDuration', 'outLabel',
+           'SystemMsg', 'MsgValue1', 'MsgValue2', 'MsgValue3', 'extraInfo1', 'extraInfo2']
+
+# serial date-time of the first observation (2020-06-18)
+START_SERIAL = 44000.0
+
+
+def log_row(time, **values):
+    """Returns the raw row at `time` seconds after the start of the log."""
+    row = dict.fromkeys(COLUMNS, '')
+    row['DateTime'] = repr(START_SERIAL + time / 86400)
+    row['extraInfo1'] = '0'
+    row.update({column: str(value) for column, value in values.items()})
+    return row
+
+
+def fcsrtt_log(rng, n_animals=4, n_sessions=5, n_trials=100, itis=(5, 7, 9),
+               stimulus_durations=(1000, 2000, 4000), premature_rate=0.5):
+    """Generates the rows of a raw 5-CSRTT log.
+
+    Parameters
+    ----------
+    rng : numpy.random.Generator
+        Source of the random numbers.
+
+    n_animals : int
+        Amount of animals in the cage.
+
+    n_sessions : int
+        Amount of sessions of every animal.
+
+    n_trials : int
+        Amount of trials in a session.
+
+    itis : sequence of int
+        Possible ITI values, in seconds.
+
+    stimulus_durations : sequence of int
+        Possible stimulus durations, in milliseconds (one per session).
+
+    premature_rate : float
+        Mean amount of premature responses in a trial.
+
+    Returns
+    ----------
+    rows : list of dict
+        Rows of the log, in the time order.
+    """
+    rows = []
+    time = 0.0
+    for _ in range(n_sessions):
+        for animal in range(n_animals):
+            animal_id, id_rfid = f"A{animal+1:02d}", f"9000{animal+1:08d}"
+            rows.append(log_row(time, IdRFID=id_rfid, IdLabel=animal_id, unitLabel='sys', SystemMsg='start exp'))
+            time += 1.3
+            stimulus_duration = rng.choice(stimulus_durations)
+
+            for _ in range(n_trials):
+                rows.append(log_row(time, unitLabel='sys', SystemMsg='iti', MsgValue1=rng.choice(itis)))
+                for _ in range(rng.poisson(premature_rate)):
+                    time += rng.random()
+                    rows.append(log_row(time, unitLabel=f"W{rng.integers(1, 6)}", SystemMsg='premature'))
+                time += 2 + rng.random()
+
+                present_time = log_row(time, unitLabel='sys', SystemMsg='present time',
+                                       MsgValue1=stimulus_duration)
+                stimulus = log_row(time, unitLabel='sys', SystemMsg='symbol to touch',
+                                   MsgValue1=rng.integers(1, 6))
+                # both messages have the same time, so sometimes the system writes them in the other order
+                rows.extend([present_time, stimulus] if rng.random() < 0.2 else [stimulus, present_time])
+                time += 3 * rng.random() + 0.001
+
+                outcome = rng.random()
+                if outcome < 0.15:
+                    rows.append(log_row(time, unitLabel='sys', SystemMsg='omission'))
+                elif outcome < 0.4:
+                    rows.append(log_row(time, unitLabel=f"W{rng.integers(1, 6)}", SystemMsg='incorrect'))
+                elif outcome < 0.97:
+                    rows.append(log_row(time, unitLabel=f"W{rng.integers(1, 6)}", SystemMsg='correct'))
+                    # the reward is not always collected before the end of the session
+                    if rng.random() < 0.95:
+                        time += 2 * rng.random()
+                        rows.append(log_row(time, unitLabel='rew', outLabel='positive'))
+                time += 0.5
+
+            rows.append(log_row(time, IdRFID=id_rfid, IdLabel=animal_id, unitLabel='sys', SystemMsg='end exp'))
+            time += 60
+
+    return rows
+
+
+def tvdlr_log(rng, n_animals=4, n_sessions=5, n_trials=100, correction_rate=0.1, premature_rate=0.4,
+              start_time=0.0):
+    """Generates the rows of a raw 2VDLR log.
+
+    Parameters
+    ----------
+    rng : numpy.random.Generator
+        Source of the random numbers.
+
+    n_animals : int
+        Amount of animals in the cage.
+
+    n_sessions : int
+        Amount of sessions of every animal.
+
+    n_trials : int
+        Amount of trials in a session.
+
+    correction_rate : float
+        Share of the correction trials.
+
+    premature_rate : float
+        Mean amount of pokes before the start of a trial.
+
+    start_time : float
+        Time of the first observation, in seconds after the start of the log.
+
+    Returns
+    ----------
+    rows : list of dict
+        Rows of the log, in the time order.
+    """
+    rows = []
+    time = start_time
+    for _ in range(n_sessions):
+        for animal in range(n_animals):
+            animal_id, id_rfid = f"A{animal+1:02d}", f"9000{animal+1:08d}"
+            rows.append(log_row(time, IdRFID=id_rfid, IdLabel=animal_id, unitLabel='sys', SystemMsg='start exp'))
+            time += 1.1
+
+            for _ in range(n_trials):
+                rows.append(log_row(time, unitLabel='sys', SystemMsg='wait poke'))
+                for _ in range(rng.poisson(premature_rate)):
+                    time += rng.random()
+                    rows.append(log_row(time, unitLabel=f"W{rng.integers(1, 3)}", SystemMsg='poke'))
+                time += 2 * rng.random() + 0.01
+
+                # sometimes the session is ended before the start of the run
+                if rng.random() < 0.9:
+                    window_correct = rng.integers(1, 3)
+                    stimuli = [f"S1+ W{window_correct} I{rng.integers(1, 9)}",
+                               f"S2- W{3-window_correct} I{rng.integers(1, 9)}"]
+                    if rng.random() < 0.5:
+                        stimuli.reverse()
+                    correction = 'cr' if rng.random() < correction_rate else 'nc'
+                    rows.append(log_row(time, unitLabel='sys', SystemMsg='start run', MsgValue1=stimuli[0],
+                                        MsgValue2=stimuli[1], MsgValue3=correction))
+
+                    if rng.random() < 0.9:
+                        time += 3 * rng.random() + 0.01
+                        rows.append(log_row(time, unitLabel=f"W{rng.integers(1, 3)}", SystemMsg='poke'))
+                        if rng.random() < 0.8:
+                            time += rng.random()
+                            rows.append(log_row(time, unitLabel='rew', outLabel='positive'))
+                        # perseverative pokes after the decision
+                        for _ in range(rng.poisson(0.5)):
+                            time += rng.random()
+                            rows.append(log_row(time, unitLabel=f"W{rng.integers(1, 3)}", SystemMsg='poke'))
+                time += 1
+
+            rows.append(log_row(time, IdRFID=id_rfid, IdLabel=animal_id, unitLabel='sys', SystemMsg='end exp'))
+            time += 60
+
+    return rows
+
+
+def write_log(rows, output_file, encoding="utf_16", sep=";"):
+    """Writes the rows to the csv file in the format of the system:
+    the header, two rows with the technical info ('#' in the first column)
+    and the observations."""
+    with open(output_file, 'w', encoding=encoding) as f:
+        f.write(sep.join(COLUMNS) + '\n')
+        f.write('#Version' + sep + '1.0' + sep * (len(COLUMNS) - 2) + '\n')
+        f.write('#Comment' + sep + 'synthetic data' + sep * (len(COLUMNS) - 2) + '\n')
+        for row in rows:
+            f.write(sep.join(row[column] for column in COLUMNS) + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Writes a synthetic raw log of the system.")
+    parser.add_argument('task', choices=['5csrtt', '2vdlr'])
+    parser.add_argument('output_file')
+    parser.add_argument('--animals', type=int, default=4)
+    parser.add_argument('--sessions', type=int, default=5)
+    parser.add_argument('--trials', type=int, default=100, help="trials in a session")
+    parser.add_argument('--premature-rate', type=float, default=None,
+                        help="mean amount of premature responses in a trial")
+    parser.add_argument('--correction-rate', type=float, default=0.1, help="share of correction trials (2vdlr)")
+    parser.add_argument('--itis', type=int, nargs='+', default=[5, 7, 9], help="ITI values in seconds (5csrtt)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.task == '5csrtt':
+        rows = fcsrtt_log(rng, args.animals, args.sessions, args.trials, itis=args.itis,
+                          premature_rate=0.5 if args.premature_rate is None else args.premature_rate)
+    else:
+        rows = tvdlr_log(rng, args.animals, args.sessions, args.trials, correction_rate=args.correction_rate,
+                         premature_rate=0.4 if args.premature_rate is None else args.premature_rate)
+    write_log(rows, args.output_file)
+    print(f"{len(rows)} rows were written to {args.output_file}")
@@ -0,0 +1,218 @@
+import io
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import platform
+import tempfile
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_PATH)
+sys.path.append(os.path.join(ROOT_PATH, '5csrtt'))
+sys.path.append(os.path.join(ROOT_PATH, '2vdlr'))
+import log_generator
+import raw_reader
+import helper_functions
+import fcsrtt_preprocessor
+import tvdlr_preprocessor
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, peak memory is not reported there
+    resource = None
+
+
+def digest(output):
+    """Returns the hash of the stage output (DataFrame or tuple of DataFrames)."""
+    sha1 = hashlib.sha1()
+    for df in output if isinstance(output, tuple) else [output]:
+        sha1.update(df.to_csv(index=False).encode())
+    return sha1.hexdigest()
+
+
+def stage_read_csv(files):
+    start = time.perf_counter()
+    input_df = raw_reader.read_raw_file(files['5csrtt'], "utf_16", ";")
+    return len(input_df), time.perf_counter() - start, input_df
+
+
+def stage_initial_cleaning(files):
+    input_df = raw_reader.read_raw_file(files['5csrtt'], "utf_16", ";")
+    start = time.perf_counter()
+    input_df = helper_functions.initial_cleaning(input_df)
+    return len(input_df), time.perf_counter() - start, input_df
+
+
+def stage_fcsrtt_data_cleaner(files):
+    start = time.perf_counter()
+    output = fcsrtt_preprocessor.fcsrtt_data_cleaner(files['5csrtt'], by_iti=True)
+    seconds = time.perf_counter() - start
+    # input of the `aggregated_table` stage
+    output[0].to_csv(files['5csrtt_output'], index=False)
+    return files['5csrtt_rows'], seconds, output
+
+
+def stage_tvdlr_data_cleaner(files):
+    start = time.perf_counter()
+    output = tvdlr_preprocessor.tvdlr_data_cleaner(files['2vdlr'], params={'animals_to_ignore': []})
+    return files['2vdlr_rows'], time.perf_counter() - start, output
+
+
+def stage_aggregated_table(files):
+    # plotting packages are only needed for this stage
+    import plot_generator
+
+    experiment_df = pd.read_csv(files['5csrtt_output'])
+    start = time.perf_counter()
+    output = (plot_generator.aggregated_table(experiment_df, by1='IdLabel', by2='session'),
+              plot_generator.aggregated_table(experiment_df, by1='IdLabel', by2='stimulusDuration'))
+    return len(experiment_df), time.perf_counter() - start, output
+
+
+STAGES = {'read_csv': stage_read_csv,
+          'initial_cleaning': stage_initial_cleaning,
+          'fcsrtt_data_cleaner': stage_fcsrtt_data_cleaner,
+          'tvdlr_data_cleaner': stage_tvdlr_data_cleaner,
+          'aggregated_table': stage_aggregated_table}
+
+
+def measure(stage, files, repeat):
+    """Runs the stage `repeat` times in the current process. Returns the best
+    wall time, the amount of processed rows, the output hash and the peak
+    memory use of the process."""
+    seconds = []
+    # progress bars and messages of the preprocessors are not shown
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        for _ in range(repeat):
+            rows, stage_seconds, output = STAGES[stage](files)
+            seconds.append(stage_seconds)
+
+    peak_rss_mb = None
+    if resource is not None:
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        peak_rss_mb = round(peak_rss / 1024**2 if sys.platform == 'darwin' else peak_rss / 1024, 1)
+
+    return {'rows': rows, 'seconds': round(min(seconds), 4), 'rows_per_sec': round(rows / min(seconds)),
+            'peak_rss_mb': peak_rss_mb, 'digest': digest(output)}
+
+
+def run_stage(stage, files, repeat):
+    """Runs the stage in a new process, so the peak memory use
+    isn't affected by the previous stages."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(measure, stage, files, repeat).result()
+
+
+def generate_data(data_path, n_trials, n_animals, n_sessions, seed):
+    """Writes the raw 5-CSRTT file and two 2VDLR files (the second one
+    continues the first one) with `n_trials` trials in a session."""
+    files = {'5csrtt': os.path.join(data_path, f"5csrtt_{n_trials}.csv"),
+             '5csrtt_output': os.path.join(data_path, f"5csrtt_{n_trials}_PROCESSED.csv"),
+             '2vdlr': [os.path.join(data_path, f"2vdlr_{n_trials}_{i}.csv") for i in [1, 2]]}
+
+    rng = np.random.default_rng(seed)
+    rows = log_generator.fcsrtt_log(rng, n_animals, n_sessions, n_trials)
+    log_generator.write_log(rows, files['5csrtt'])
+    files['5csrtt_rows'] = len(rows)
+
+    files['2vdlr_rows'] = 0
+    start_time = 0.0
+    for fpath in files['2vdlr']:
+        rows = log_generator.tvdlr_log(rng, n_animals, n_sessions, n_trials, start_time=start_time)
+        log_generator.write_log(rows, fpath)
+        files['2vdlr_rows'] += len(rows)
+        start_time = (float(rows[-1]['DateTime']) - log_generator.START_SERIAL) * 86400 + 3600
+
+    return files
+
+
+def compare(results, baseline, tolerance):
+    """Compares the results with the baseline. Returns the list of the problems:
+    different outputs and stages slower than `tolerance` times the baseline."""
+    problems = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        if result['digest'] != baseline[key]['digest']:
+            problems.append(f"{key}: output differs from the baseline")
+        # very short stages are not compared, their time is mostly noise
+        if result['seconds'] > max(tolerance * baseline[key]['seconds'], baseline[key]['seconds'] + 0.05):
+            problems.append(f"{key}: {result['seconds']} s, baseline {baseline[key]['seconds']} s")
+    return problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Throughput benchmarks of the preprocessing stages.")
+    parser.add_argument('--trials', type=int, nargs='+', default=[50, 200, 800],
+                        help="trials in a session, one data size per value")
+    parser.add_argument('--animals', type=int, default=4)
+    parser.add_argument('--sessions', type=int, default=5)
+    parser.add_argument('--stages', nargs='+', default=list(STAGES), choices=list(STAGES))
+    parser.add_argument('--repeat', type=int, default=3, help="runs of every stage, the best time is reported")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-path', help="folder for the generated files (temporary folder by default)")
+    parser.add_argument('--baseline', help="json file with the baseline results to compare with")
+    parser.add_argument('--save-baseline', action='store_true', help="save the results to the `--baseline` file")
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help="stage is reported as slower if it takes more than `tolerance` times the baseline")
+    parser.add_argument('--output', help="json file for the results")
+    args = parser.parse_args()
+
+    data_path = args.data_path if args.data_path is not None else tempfile.mkdtemp(prefix='benchmarks_')
+    os.makedirs(data_path, exist_ok=True)
+
+    results = {}
+    # error message of every stage that failed
+    failed = {}
+    print(f"{'stage':<22}{'trials':>8}{'rows':>10}{'seconds':>10}{'rows/sec':>12}{'peak RSS, MB':>14}")
+    for n_trials in args.trials:
+        files = generate_data(data_path, n_trials, args.animals, args.sessions, args.seed)
+        for stage in args.stages:
+            try:
+                if stage == 'aggregated_table' and not os.path.exists(files['5csrtt_output']):
+                    run_stage('fcsrtt_data_cleaner', files, 1)
+                result = run_stage(stage, files, args.repeat)
+            except Exception as e:
+                # the other stages are still measured, the run fails at the end
+                failed[f"{stage}/{n_trials}"] = f"{type(e).__name__}: {e}"
+                print(f"{stage:<22}{n_trials:>8}{'FAILED':>10}")
+                continue
+            results[f"{stage}/{n_trials}"] = result
+            print(f"{stage:<22}{n_trials:>8}{result['rows']:>10}{result['seconds']:>10}"
+                  f"{result['rows_per_sec']:>12}{str(result['peak_rss_mb']):>14}")
+
+    if failed:
+        print()
+        for key, error in failed.items():
+            print(f"{key} failed: {error}")
+        # results without the failed stages are neither saved nor compared
+        sys.exit(f"\n{len(failed)} stages failed, no results were saved.")
+
+    report = {'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+              'animals': args.animals, 'sessions': args.sessions, 'seed': args.seed, 'results': results}
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+
+    if args.baseline is not None and args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f"\nBaseline was saved to {args.baseline}")
+    elif args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        problems = compare(results, baseline['results'], args.tolerance)
+        for problem in problems:
+            print(problem)
+        if problems:
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
@@ -0,0 +1,158 @@
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from pandas.api.types import CategoricalDtype
+
+
+# change it whenever the parsing or cleaning of the raw data changes,
+# so the tables cached by the older code are not used anymore
+PARSER_VERSION = 3
+
+# default limit of the cache folder size, in bytes
+DEFAULT_MAX_SIZE = 10 * 1024**3
+
+INDEX_NAME = 'index.json'
+
+
+def file_hash(file_path, block_size=1024**2):
+    """Returns the SHA-1 hash of the file content."""
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def content_key(file_path, cache_dir):
+    """Returns the hash of the file content. The hash is stored in the cache
+    index together with the file size and modification time, so the file
+    is only read again when one of them changes."""
+    index_path = os.path.join(cache_dir, INDEX_NAME)
+    try:
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+
+    stat = os.stat(file_path)
+    abs_path = os.path.abspath(file_path)
+    entry = index.get(abs_path)
+    if entry is not None and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return entry['sha1']
+
+    index[abs_path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': file_hash(file_path)}
+    # write to a temporary file first, so parallel runs never see a partial index
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path)
+
+    return index[abs_path]['sha1']
+
+
+def save_table(df, path):
+    """Saves the DataFrame column by column into the `.npz` file."""
+    arrays = {}
+    dtypes = []
+    for i, column in enumerate(df.columns):
+        values = df[column]
+        if isinstance(values.dtype, CategoricalDtype):
+            arrays[f'codes_{i}'] = values.cat.codes.values
+            arrays[f'categories_{i}'] = np.asarray(values.cat.categories, dtype=object)
+        else:
+            arrays[f'values_{i}'] = np.asarray(values)
+        dtypes.append(str(values.dtype))
+
+    # write to a temporary file first, so parallel runs never see a partial table
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, columns=np.array(df.columns, dtype=object), dtypes=np.array(dtypes, dtype=object), **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_table(path):
+    """Loads the DataFrame saved by `save_table`."""
+    with np.load(path, allow_pickle=True) as arrays:
+        columns = {}
+        for i, (column, dtype) in enumerate(zip(arrays['columns'], arrays['dtypes'])):
+            if f'codes_{i}' in arrays:
+                columns[column] = pd.Categorical.from_codes(arrays[f'codes_{i}'], arrays[f'categories_{i}'])
+            else:
+                values = pd.Series(arrays[f'values_{i}'])
+                # e.g. the pandas string dtype is saved as the object array
+                columns[column] = values if str(values.dtype) == dtype else values.astype(dtype)
+    return pd.DataFrame(columns)
+
+
+def evict(cache_dir, max_size):
+    """Removes the least recently used tables until the size of the cache
+    folder is within `max_size` bytes."""
+    tables = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.npz'):
+            stat = os.stat(os.path.join(cache_dir, name))
+            tables.append((stat.st_mtime, stat.st_size, name))
+
+    total_size = sum(size for _, size, _ in tables)
+    for _, size, name in sorted(tables):
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except OSError:
+            continue
+        total_size -= size
+
+
+def cached_table(file_path, parse, options, cache_dir, max_size=DEFAULT_MAX_SIZE):
+    """Returns the parsed raw data from the cache, parsing (and caching) it
+    only if the file was not parsed before with the same options.
+
+    Parameters
+    ----------
+    file_path : str
+        Path to the csv file with the raw data.
+
+    parse : callable
+        Function that reads and cleans the file: `parse(file_path) -> DataFrame`.
+
+    options : dict
+        Everything that affects the result of `parse` (e.g. name of the parser,
+        `encoding`, `sep`, `tz`). Together with the file content hash and the
+        `PARSER_VERSION` it defines the cached table.
+
+    cache_dir : str
+        Folder for the cached tables. Created if it doesn't exist.
+
+    max_size : int
+        Limit of the cache folder size, in bytes. The least recently used
+        tables are removed when it's exceeded.
+
+    Returns
+    ----------
+    df : DataFrame
+        Parsed data.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+
+    options = json.dumps(dict(options, parser_version=PARSER_VERSION), sort_keys=True, default=str)
+    options_key = hashlib.sha1(options.encode()).hexdigest()[:16]
+    table_path = os.path.join(cache_dir, f"{content_key(file_path, cache_dir)}-{options_key}.npz")
+
+    if os.path.exists(table_path):
+        try:
+            df = load_table(table_path)
+            # the modification time marks the recently used tables
+            os.utime(table_path)
+            return df
+        except (OSError, ValueError, KeyError):
+            # broken file, e.g. the disk was full; parse the data again
+            pass
+
+    df = parse(file_path)
+    save_table(df, table_path)
+    evict(cache_dir, max_size)
+
+    return df
@@ -1,5 +1,9 @@
+import os
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
+from dateutil import tz as dateutil_tz
+import profiling
 
 
 def from_ordinal(ordinal, _epoch=datetime(1899, 12, 30)):
@@ -19,14 +23,354 @@ def from_ordinal(ordinal, _epoch=datetime(1899, 12, 30)):
     return _epoch + timedelta(days=ordinal)
 
 
-def initial_cleaning(input_df):
+def serial_to_datetime(serial, tz=None, _epoch=datetime(1899, 12, 30)):
+    """Converts an array of serial date-times to datetimes and timestamps
+    without creating Python objects for every observation.
+
+    Parameters
+    ----------
+    serial : array-like of float
+        Original serial date-times (days since the `_epoch`).
+
+    tz : str, tzinfo or None
+        Time zone of the system clock that recorded the data, e.g.
+        "Europe/Berlin". If `None` (default), the local time zone of the
+        machine running the script is used (same as `datetime.timestamp`).
+        Ambiguous times (end of the daylight saving time) are resolved to the
+        earlier moment, non-existent ones are shifted forward by the gap.
+
+    _epoch : datetime
+        Start of the count. See `from_ordinal`.
+
+    Returns
+    ----------
+    date_time : ndarray of datetime64[ns]
+        Wall-clock time of the system (time zone naive), rounded to microseconds.
+
+    timestamp : ndarray of float
+        POSIX timestamp, in seconds.
+    """
+    if isinstance(tz, str):
+        tz = dateutil_tz.gettz(tz)
+
+    serial = np.asarray(serial, dtype=float)
+    # microseconds since the epoch, rounded half to even the same way as `timedelta`
+    days = np.trunc(serial)
+    us = days.astype(np.int64) * 86400000000 + np.rint((serial - days) * 8.64e10).astype(np.int64)
+
+    # time zone offset can only change on a whole minute,
+    # so it is resolved once per unique minute of the record
+    minutes, minute_indx = np.unique(us // 60000000, return_inverse=True)
+    minute_ts = np.empty(len(minutes), dtype=np.int64)
+    minute_shift = np.empty(len(minutes), dtype=np.int64)
+    for i, minute in enumerate(minutes.tolist()):
+        wall = _epoch + timedelta(minutes=minute)
+        if tz is None:
+            ts = wall.timestamp()
+            wall_back = datetime.fromtimestamp(ts)
+        else:
+            ts = wall.replace(tzinfo=tz).timestamp()
+            wall_back = datetime.fromtimestamp(ts, tz).replace(tzinfo=None)
+        minute_ts[i] = ts
+        # non-zero only for the non-existent times
+        minute_shift[i] = (wall_back - wall) // timedelta(microseconds=1)
+
+    seconds = minute_ts[minute_indx] + (us // 1000000) % 60
+    timestamp = seconds.astype(float) + (us % 1000000) / 1e6
+
+    date_time = np.datetime64(_epoch, 'us') + (us + minute_shift[minute_indx]).astype('timedelta64[us]')
+
+    return date_time.astype('datetime64[ns]'), timestamp
+
+
+@profiling.profiled('initial_cleaning')
+def initial_cleaning(input_df, by='DateTime', tz=None):
+    """Sorts the observations in time and converts serial date-times.
+
+    Parameters
+    ----------
+    input_df : DataFrame
+        Raw data with the serial `DateTime` column.
+
+    by : str or list of str
+        Columns to sort the observations by.
+
+    tz : str, tzinfo or None
+        Time zone of the system clock. See `serial_to_datetime`.
+
+    Returns
+    ----------
+    input_df : DataFrame
+        Data with `DateTime` (datetime64) and `Timestamp` (float, in seconds) columns.
+    """
     # sort the values since for some reason observations sometimes mixed in time
     input_df['DateTime'] = input_df['DateTime'].astype(float)
-    input_df.sort_values(by='DateTime', inplace=True)
+    input_df.sort_values(by=by, kind='mergesort', inplace=True)
     input_df.reset_index(drop=True, inplace=True)
 
     # some datetime manipulations
-    input_df['Timestamp'] = input_df['DateTime'].apply(lambda x: datetime.timestamp(from_ordinal(x)))
-    input_df['DateTime'] = input_df['Timestamp'].apply(lambda x: datetime.fromtimestamp(x))
+    date_time, timestamp = serial_to_datetime(input_df['DateTime'].values, tz=tz)
+    input_df['Timestamp'] = timestamp
+    input_df['DateTime'] = date_time
 
     return input_df
+
+
+def first_event(df, mask, column, keys=('session', 'trial')):
+    """Returns the value of the `column` for the first observation that
+    satisfies the `mask` in each group defined by `keys`.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Observations ordered in time.
+
+    mask : Series of bool
+        Condition for the observations to consider.
+
+    column : str
+        Name of the column to take the value from.
+
+    keys : tuple of str
+        Columns defining the groups.
+
+    Returns
+    ----------
+    first_values : Series
+        Values indexed by `keys`. Groups without matching observations are absent.
+    """
+    keys = list(keys)
+    return plain_values(df.loc[mask, keys + [column]].drop_duplicates(keys).set_index(keys)[column])
+
+
+def plain_values(values):
+    """Converts the column of the compact table (see `raw_reader.compact_events`)
+    back to the type of the raw data: categorical to the type of its categories
+    (e.g. strings), float32 to float64. Other columns are returned as is."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.astype(values.cat.categories.dtype)
+    if values.dtype == np.float32:
+        return values.astype(np.float64)
+    return values
+
+
+def event_index(df, mask, by='session', on='Timestamp'):
+    """Builds the sorted index of the events (observations that satisfy the
+    `mask`) for the binary search by time within every group, e.g. "the first
+    'present time' of the session at the time T" (see `find_events`).
+
+    Parameters
+    ----------
+    df : DataFrame
+        Observations ordered in time.
+
+    mask : Series of bool
+        Marks the events.
+
+    by : str or array
+        Column (or values aligned with `df`) with the integer group of
+        every observation, e.g. the session number.
+
+    on : str
+        Column with the time of the observations.
+
+    Returns
+    ----------
+    index : dict
+        Group (`keys`), time (`times`) and position in `df` (`rows`) of every
+        event, sorted by the group and the time (events at the same time
+        keep their order in `df`).
+    """
+    rows = np.flatnonzero(np.asarray(mask))
+    keys = (df[by].values if isinstance(by, str) else np.asarray(by))[rows]
+    times = df[on].values[rows]
+    order = np.lexsort((times, keys))
+    return {'keys': keys[order], 'times': times[order], 'rows': rows[order]}
+
+
+def search_events(index, keys, times, side='left'):
+    """Finds the positions in the `index` (see `event_index`) where the
+    `times` would be inserted within the events of their group (`keys`),
+    as `numpy.searchsorted` does. The binary search runs for all times at
+    once, so the amount of groups doesn't matter."""
+    keys, times = np.asarray(keys), np.asarray(times)
+    # bounds of the events of the group
+    low = np.searchsorted(index['keys'], keys, 'left')
+    high = np.searchsorted(index['keys'], keys, 'right')
+    active = low < high
+    while active.any():
+        middle = (low + high) // 2
+        middle_times = index['times'][np.where(active, middle, 0)]
+        go_right = active & ((middle_times < times) if side == 'left' else (middle_times <= times))
+        low = np.where(go_right, middle + 1, low)
+        high = np.where(active & ~go_right, middle, high)
+        active = low < high
+    return low
+
+
+def find_events(index, keys, times, direction='exact'):
+    """Finds the event of the same group for every time (binary search in
+    the `index`, see `event_index`).
+
+    Parameters
+    ----------
+    index : dict
+        Index of the events, see `event_index`.
+
+    keys : array
+        Group of every time.
+
+    times : array
+        Times to look up. Missing times have no events.
+
+    direction : str
+        'exact' - the first event at the time; 'forward' / 'backward' - the
+        first event at or after / the last event at or before the time;
+        'after' / 'before' - the same, but strictly after / before the time;
+        'nearest' - the closest event (the earlier one on a tie).
+
+    Returns
+    ----------
+    rows : array of int
+        Positions of the events in the indexed DataFrame, -1 if there is no
+        such event.
+    """
+    keys, times = np.asarray(keys), np.asarray(times)
+    if len(index['keys']) == 0:
+        return np.full(len(keys), -1)
+
+    found = []
+    for search_direction in (['backward', 'after'] if direction == 'nearest' else [direction]):
+        side = 'left' if search_direction in ('exact', 'forward', 'before') else 'right'
+        positions = search_events(index, keys, times, side)
+        if search_direction in ('backward', 'before'):
+            positions -= 1
+        valid = (positions >= 0) & (positions < len(index['keys'])) & ~pd.isnull(times)
+        positions = np.where(valid, positions, -1)
+        valid &= index['keys'][positions] == keys
+        if search_direction == 'exact':
+            valid &= index['times'][positions] == times
+        found.append(np.where(valid, positions, -1))
+
+    positions = found[0]
+    if direction == 'nearest':
+        before, after = found
+        use_after = (after >= 0) & ((before < 0) | (index['times'][after] - times < times - index['times'][before]))
+        positions = np.where(use_after, after, before)
+
+    return np.where(positions >= 0, index['rows'][positions], -1)
+
+
+def count_events(index, keys, times, direction='before'):
+    """Counts the events of the group (see `event_index`) strictly before
+    or strictly after the time, for every time. Missing times have no events."""
+    keys, times = np.asarray(keys), np.asarray(times)
+    if direction == 'before':
+        counts = search_events(index, keys, times, 'left') - np.searchsorted(index['keys'], keys, 'left')
+    else:
+        counts = np.searchsorted(index['keys'], keys, 'right') - search_events(index, keys, times, 'right')
+    return np.where(pd.isnull(times), 0, counts)
+
+
+def event_values(df, column, rows):
+    """Returns the values of the `column` at the positions `rows`
+    (see `find_events`); NaN where the position is -1."""
+    values = plain_values(df[column].iloc[np.maximum(rows, 0)]).values
+    return np.where(np.asarray(rows) >= 0, values, np.nan)
+
+
+def assign_trials(session_df, trial_start_mask):
+    """Tags every observation with the number of the trial it belongs to.
+    Trial = observations from the trial start to the next trial start
+    (or the end of the session).
+
+    Parameters
+    ----------
+    session_df : DataFrame
+        Observations of one or several sessions, ordered in time. The
+        `session` column holds the session number.
+
+    trial_start_mask : Series of bool
+        Marks the observations that start a trial.
+
+    Returns
+    ----------
+    trials_df : DataFrame
+        Observations with the `trial` column (trial number within the session).
+        Observations before the first trial start of a session are dropped.
+    """
+    trial_id = trial_start_mask.groupby(session_df['session']).cumsum()
+    return session_df.assign(trial=trial_id)[trial_id > 0]
+
+
+def session_index(input_df):
+    """Finds the sessions of all animals in a single pass over the data.
+    Session = observations between 'start exp' and 'end exp' of an animal;
+    the i-th 'start exp' of the animal is paired with its i-th 'end exp'.
+
+    Parameters
+    ----------
+    input_df : DataFrame
+        Cleaned data (see `initial_cleaning`), ordered in time.
+
+    Returns
+    ----------
+    sessions : dict
+        List of the sessions of every animal label, one tuple per session:
+        (start row, end row, file name, session number). Rows are positions
+        in `input_df` (see `session_slice`), the file name is the `fname` of
+        the 'start exp' (`None` if there is no such column). Animals without
+        paired sessions are absent.
+
+    unmatched : dict
+        Rows of the 'start exp' and the rows of the 'end exp' that have no
+        pair, for every animal label whose counts of the messages differ.
+    """
+    rows = np.flatnonzero((input_df['SystemMsg'].isin(['start exp', 'end exp']) & input_df['IdLabel'].notna()).values)
+    marks = input_df.iloc[rows]
+    file_names = marks['fname'].values if 'fname' in marks else [None] * len(rows)
+
+    starts, ends = {}, {}
+    for row, animal_id, msg, file_name in zip(rows.tolist(), marks['IdLabel'].values, marks['SystemMsg'].values,
+                                               file_names):
+        if msg == 'start exp':
+            starts.setdefault(animal_id, []).append((row, file_name))
+        else:
+            ends.setdefault(animal_id, []).append(row)
+
+    sessions, unmatched = {}, {}
+    for animal_id in list(starts) + [animal_id for animal_id in ends if animal_id not in starts]:
+        animal_starts, animal_ends = starts.get(animal_id, []), ends.get(animal_id, [])
+        n_paired = min(len(animal_starts), len(animal_ends))
+        if n_paired > 0:
+            sessions[animal_id] = [(start, end, file_name, session_i+1) for session_i, ((start, file_name), end)
+                                   in enumerate(zip(animal_starts, animal_ends))]
+        if len(animal_starts) != len(animal_ends):
+            unmatched[animal_id] = ([row for row, _ in animal_starts[n_paired:]], animal_ends[n_paired:])
+
+    return sessions, unmatched
+
+
+def session_slice(input_df, session):
+    """Returns the observations of the session (indexed from 0) with the
+    `session` column holding the session number.
+
+    Parameters
+    ----------
+    input_df : DataFrame
+        Data the session index was built from (see `session_index`).
+
+    session : tuple
+        (start row, end row, file name, session number), see `session_index`.
+    """
+    start, end, _, session_number = session
+    return input_df.iloc[start:end+1].reset_index(drop=True).assign(session=session_number)
+
+
+@profiling.profiled('csv_write')
+def save_csv(df, output_file):
+    """Saves the DataFrame to the csv file. The data is written to a temporary
+    file first, so an interrupted run never leaves a partial output file."""
+    tmp_file = f"{output_file}.{os.getpid()}.tmp"
+    df.to_csv(tmp_file, index=False)
+    os.replace(tmp_file, output_file)
@@ -0,0 +1,327 @@
+import os
+import sys
+import asyncio
+import argparse
+import pandas as pd
+
+ROOT_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(ROOT_PATH, '5csrtt'))
+sys.path.append(os.path.join(ROOT_PATH, '2vdlr'))
+import fcsrtt_preprocessor
+import tvdlr_preprocessor
+import helper_functions
+import task_spec
+import raw_reader
+
+# trials of the task (the trial start closes the previous trial), the
+# trial counters of the output (see `finalize_output` of the preprocessors)
+# and the fixed types of the columns whose type depends on the missing values
+# of the batch, so all appended rows are written the same way (e.g. not 1 and 1.0)
+TASKS = {'5csrtt': {'spec': fcsrtt_preprocessor.TRIAL_SPEC,
+                    'counters': [('trialTotal', ['IdLabel']), ('trialByStimDuration', ['IdLabel', 'stimulusDuration'])],
+                    'dtypes': {}},
+         '2vdlr': {'spec': tvdlr_preprocessor.TRIAL_SPEC,
+                   'counters': [('trialTotal', ['IdLabel'])],
+                   'dtypes': {'windowCorrect': 'Int64', 'windowPressed': 'Int64'}}}
+
+
+def watch_state(task='5csrtt', file_name=None, animals_to_ignore=()):
+    """Returns the empty state of the watch mode (see `update_trials`).
+
+    Parameters
+    ----------
+    task : str
+        '5csrtt' or '2vdlr'.
+
+    file_name : str or None
+        Name of the raw file (`fileName` column of the 2VDLR output).
+
+    animals_to_ignore : list of str
+        Labels of the animals whose trials are not emitted.
+
+    Returns
+    ----------
+    state : dict
+        `offset` and `header` of the raw file (see `raw_reader.read_raw_tail`),
+        `open_sessions` (animal ID -> session number, observations from the
+        start of the open trial onward and the amount of emitted trials),
+        `session_count`, `ids` (RFID of each animal label), last values of
+        the trial `counters` and the session `totals` (see `update_totals`).
+    """
+    if task not in TASKS:
+        raise ValueError(f"Unknown task {task}. Possible values are '5csrtt' and '2vdlr'.")
+    return {'task': task, 'file_name': file_name, 'animals_to_ignore': set(animals_to_ignore),
+            'offset': 0, 'header': None, 'open_sessions': {}, 'session_count': {}, 'ids': {},
+            'counters': {column: {} for column, _ in TASKS[task]['counters']}, 'totals': {}}
+
+
+def add_rows(session, rows):
+    """Appends the new observations to the open session, keeping them in time order."""
+    rows = rows.assign(session=session['session'])
+    if session['rows'] is None or session['rows'].empty:
+        session['rows'] = rows.reset_index(drop=True)
+        return
+    # both parts are sorted, so the sorting is only needed when
+    # the new rows start before the end of the kept ones
+    in_order = rows.empty or session['rows']['DateTime'].iloc[-1] <= rows['DateTime'].iloc[0]
+    session['rows'] = pd.concat([session['rows'], rows], ignore_index=True)
+    if not in_order:
+        session['rows'].sort_values(by='DateTime', kind='mergesort', inplace=True, ignore_index=True)
+
+
+def closed_trials(task, session, session_closed):
+    """Extracts the trials of the open session that were closed by the next
+    trial start (or by the 'end exp' if `session_closed`) and drops their
+    observations from the session.
+
+    Only the observations from the start of the first trial that was not
+    emitted yet are kept (and the ones at the same time right before it,
+    where the 'present time' of the trial can be), so every call costs as
+    much as the trials it closes, not the whole session.
+
+    Returns
+    ----------
+    animal_out : DataFrame or None
+        Trials table of the closed trials (see `fcsrtt_trial_table` and
+        `tvdlr_trial_table`) with the trial numbers within the session.
+        `None` if no trials were closed.
+    """
+    df = session['rows']
+    if df is None or df.empty:
+        return None
+    trial_starts = task_spec.event_mask(df, TASKS[task]['spec']['trial_start']).values.nonzero()[0]
+    n_closed = len(trial_starts) if session_closed else len(trial_starts) - 1
+    if n_closed <= 0:
+        return None
+
+    if task == '5csrtt':
+        animal_out = fcsrtt_preprocessor.fcsrtt_trial_table(df)
+    else:
+        animal_out = tvdlr_preprocessor.tvdlr_trial_table(df)
+    animal_out = animal_out[animal_out['trial'] <= n_closed].copy()
+    animal_out['trial'] += session['emitted']
+    session['emitted'] += n_closed
+
+    if not session_closed:
+        # observations of the open trial, with the ones at the time of its start
+        keep_from = trial_starts[n_closed]
+        start_time = df['DateTime'].iloc[keep_from]
+        while keep_from > 0 and df['DateTime'].iloc[keep_from-1] == start_time:
+            keep_from -= 1
+        session['rows'] = df.iloc[keep_from:].reset_index(drop=True)
+
+    return animal_out
+
+
+def update_totals(totals, new_trials):
+    """Adds the new trials to the session totals: amount of trials, of every
+    outcome and of the premature responses by animal and session."""
+    counts = pd.crosstab([new_trials['IdLabel'], new_trials['session']], new_trials['outcome'])
+    counts['trials'] = counts.sum(axis=1)
+    counts['nPremature'] = new_trials.groupby(['IdLabel', 'session'])['nPremature'].sum()
+    for key, values in counts.iterrows():
+        session_totals = totals.setdefault(key, {})
+        for column, value in values.items():
+            session_totals[column] = session_totals.get(column, 0) + int(value)
+
+
+def session_totals(state):
+    """Returns the session totals (see `update_totals`) as a DataFrame, one
+    row per animal and session."""
+    if not state['totals']:
+        return pd.DataFrame()
+    totals = pd.DataFrame.from_dict(state['totals'], orient='index').fillna(0).astype(int)
+    totals.index = pd.MultiIndex.from_tuples(totals.index, names=['IdLabel', 'session'])
+    columns = ['trials'] + sorted(column for column in totals.columns if column not in ('trials', 'nPremature'))
+    return totals[columns + ['nPremature']].sort_index().reset_index()
+
+
+def update_trials(state, new_df, tz=None):
+    """Processes the new observations of the raw file and returns the trials
+    they closed: a trial is emitted as soon as the next trial start
+    ('symbol to touch' for 5-CSRTT, 'wait poke' for 2VDLR) or the 'end exp'
+    of the session arrives.
+
+    Each 'end exp' closes the latest 'start exp' of the animal (same as with
+    `chunksize` of the preprocessors). Sessions are numbered at their
+    'start exp', so a session without the 'end exp' is counted as well.
+
+    Parameters
+    ----------
+    state : dict
+        State of the watch mode (see `watch_state`), updated in place.
+
+    new_df : DataFrame
+        New rows of the raw data (see `raw_reader.read_raw_tail`).
+
+    tz : str or None
+        Time zone of the system clock. See `helper_functions.serial_to_datetime`.
+
+    Returns
+    ----------
+    new_trials : DataFrame
+        New trials with the same columns as the output of the preprocessor
+        (trial counters continue from the previous calls). Empty if no trials
+        were closed.
+    """
+    task = state['task']
+    if new_df.empty:
+        return pd.DataFrame()
+    chunk = helper_functions.initial_cleaning(new_df.copy(), tz=tz)
+    state['ids'].update(chunk[['IdLabel', 'IdRFID']].drop_duplicates().dropna().values)
+
+    open_sessions = state['open_sessions']
+    # position of the 'start exp' of the sessions opened in this block
+    session_starts = {}
+    animal_outs = []
+
+    marks = chunk[chunk['SystemMsg'].isin(['start exp', 'end exp']) & chunk['IdLabel'].notna()]
+    for position, animal_id, msg in zip(marks.index, marks['IdLabel'].values, marks['SystemMsg'].values):
+        if animal_id in state['animals_to_ignore']:
+            continue
+        if msg == 'start exp':
+            if animal_id in open_sessions:
+                print(f"\nSession {open_sessions[animal_id]['session']} of the animal {animal_id} "
+                      "without 'end exp' was dropped.")
+                del open_sessions[animal_id]
+            state['session_count'][animal_id] = state['session_count'].get(animal_id, 0) + 1
+            open_sessions[animal_id] = {'session': state['session_count'][animal_id], 'rows': None, 'emitted': 0}
+            session_starts[animal_id] = position
+        elif animal_id in open_sessions:
+            session = open_sessions.pop(animal_id)
+            add_rows(session, chunk.iloc[session_starts.pop(animal_id, 0):position+1])
+            animal_outs.append((animal_id, closed_trials(task, session, session_closed=True)))
+
+    for animal_id, session in open_sessions.items():
+        add_rows(session, chunk.iloc[session_starts.get(animal_id, 0):])
+        animal_outs.append((animal_id, closed_trials(task, session, session_closed=False)))
+
+    animal_outs = [(animal_id, animal_out) for animal_id, animal_out in animal_outs
+                   if animal_out is not None and not animal_out.empty]
+    if not animal_outs:
+        return pd.DataFrame()
+
+    if task == '5csrtt':
+        new_trials, _ = fcsrtt_preprocessor.finalize_output(
+            [fcsrtt_preprocessor.format_trial_table(animal_out, animal_id, state['ids'][animal_id])
+             for animal_id, animal_out in animal_outs], [], False)
+    else:
+        new_trials = tvdlr_preprocessor.finalize_output(
+            [animal_out.assign(IdLabel=animal_id, fileName=state['file_name'])
+             for animal_id, animal_out in animal_outs], state['ids'])
+    new_trials = new_trials.astype(TASKS[task]['dtypes']).reset_index(drop=True)
+
+    for column, keys in TASKS[task]['counters']:
+        fcsrtt_preprocessor.continue_counter(new_trials, column, keys, state['counters'][column])
+    update_totals(state['totals'], new_trials)
+
+    return new_trials
+
+
+def poll_file(input_file_path, state, input_encoding="utf_16", input_sep=";", tz=None):
+    """Reads the rows appended to the raw file since the previous call and
+    returns the trials they closed (see `update_trials`)."""
+    if not os.path.exists(input_file_path) or os.path.getsize(input_file_path) == state['offset']:
+        return pd.DataFrame()
+    if os.path.getsize(input_file_path) < state['offset']:
+        raise ValueError(f"The input file {input_file_path} was truncated. Start the watch mode again.")
+
+    try:
+        new_df, offset, header = raw_reader.read_raw_tail(input_file_path, state['offset'], state['header'],
+                                                          input_encoding, input_sep)
+    except ValueError:
+        if state['header'] is None:
+            # the system didn't write the header yet
+            return pd.DataFrame()
+        raise
+    state['offset'], state['header'] = offset, header
+
+    return update_trials(state, new_df, tz)
+
+
+async def watch_file(input_file_path, task='5csrtt', input_encoding="utf_16", input_sep=";", tz=None,
+                     interval=1.0, state=None, animals_to_ignore=()):
+    """Tails the raw file while the system appends to it and yields the new
+    trials as soon as they are closed. Only the new rows are parsed on
+    every check; the open sessions and trials of every animal are kept in
+    the state.
+
+    Parameters
+    ----------
+    input_file_path : str
+        Path to the csv file with the raw data. It doesn't have to exist yet.
+
+    task : str
+        '5csrtt' or '2vdlr'.
+
+    input_encoding : str
+        Encoding of an input file.
+
+    input_sep : str
+        Delimiter to use for an input file.
+
+    tz : str or None
+        Time zone of the system clock. See `helper_functions.serial_to_datetime`.
+
+    interval : float
+        Time between the checks of the file, in seconds.
+
+    state : dict or None
+        State to continue from (see `watch_state`). The session totals are
+        in `session_totals(state)`.
+
+    animals_to_ignore : list of str
+        Labels of the animals whose trials are not emitted.
+
+    Yields
+    ----------
+    new_trials : DataFrame
+        New trials (see `update_trials`).
+    """
+    if state is None:
+        state = watch_state(task, os.path.basename(input_file_path), animals_to_ignore)
+    loop = asyncio.get_running_loop()
+    while True:
+        # the file is read in a thread, so the other tasks of the loop are not blocked
+        new_trials = await loop.run_in_executor(None, poll_file, input_file_path, state,
+                                                input_encoding, input_sep, tz)
+        if not new_trials.empty:
+            yield new_trials
+        await asyncio.sleep(interval)
+
+
+async def watch_to_csv(input_file_path, output_file, task='5csrtt', interval=1.0, **kwargs):
+    """Appends the new trials of the watched file (see `watch_file`) to the
+    output csv file and prints the totals of the updated sessions."""
+    state = watch_state(task, os.path.basename(input_file_path), kwargs.pop('animals_to_ignore', ()))
+    async for new_trials in watch_file(input_file_path, task, interval=interval, state=state, **kwargs):
+        new_trials.to_csv(output_file, mode='a', header=not os.path.exists(output_file), index=False)
+        totals = session_totals(state).set_index(['IdLabel', 'session'])
+        updated = new_trials[['IdLabel', 'session']].drop_duplicates().itertuples(index=False, name=None)
+        print(f"\n{len(new_trials)} new trials.")
+        print(totals.loc[list(updated)].to_string())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Live watch mode: turns the raw file into trials while "
+                                                 "the system is writing it.")
+    parser.add_argument('task', choices=['5csrtt', '2vdlr'])
+    parser.add_argument('input_file', help="raw csv file")
+    parser.add_argument('-o', '--output', required=True, help="output csv file, the new trials are appended to it")
+    parser.add_argument('--interval', type=float, default=1.0, help="time between the checks of the file, in seconds")
+    parser.add_argument('--encoding', default="utf_16")
+    parser.add_argument('--sep', default=";")
+    parser.add_argument('--tz', help="time zone of the system clock")
+    args = parser.parse_args()
+
+    animals_to_ignore = []
+    if args.task == '2vdlr':
+        animals_to_ignore = tvdlr_preprocessor.load_params(
+            os.path.join(ROOT_PATH, '2vdlr', 'params.json'))['animals_to_ignore']
+
+    try:
+        asyncio.run(watch_to_csv(args.input_file, args.output, args.task, args.interval,
+                                 input_encoding=args.encoding, input_sep=args.sep, tz=args.tz,
+                                 animals_to_ignore=animals_to_ignore))
+    except KeyboardInterrupt:
+        print("\nWatch mode was stopped.")
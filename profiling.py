@@ -0,0 +1,192 @@
+import sys
+import json
+import time
+import platform
+import tracemalloc
+from datetime import datetime
+from functools import wraps
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, peak RSS is not reported there
+    resource = None
+
+
+# report of the current run, `None` when the profiling is off
+_report = None
+# records of the stages that are running now (stages can be nested)
+_running = []
+
+
+def enable(trace_memory=False):
+    """Starts recording the stages of the pipeline (see `stage`).
+
+    Parameters
+    ----------
+    trace_memory : bool
+        Whether to record the peak of the memory allocated by Python while
+        every stage runs (`tracemalloc`, Python 3.9+). It slows the code down, so it is off by
+        default; the peak memory use of the whole process (RSS) is always recorded.
+    """
+    global _report
+    _report = {'started': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+               'start': time.perf_counter(), 'stages': {}}
+    _running.clear()
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    """Stops recording the stages and returns the report (see `report`)."""
+    global _report
+    result = report()
+    _report = None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+    return result
+
+
+def is_enabled():
+    return _report is not None
+
+
+def peak_rss_mb():
+    """Returns the peak memory use of the process (RSS), in MB."""
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak_rss / 1024**2 if sys.platform == 'darwin' else peak_rss / 1024, 1)
+
+
+@contextmanager
+def stage(name, rows=None):
+    """Records the wall time, the amount of processed rows and the peak memory
+    of the code inside the `with` block. Records of the stages with the same
+    name are summed up. Does nothing if the profiling is off.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage, e.g. 'csv_read'.
+
+    rows : int or None
+        Amount of processed rows. Can be set later with `record['rows'] = ...`.
+
+    Yields
+    ----------
+    record : dict
+        Record of the stage.
+    """
+    record = {'rows': rows}
+    if _report is None:
+        yield record
+        return
+
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        # peak of the outer stage must include the memory allocated before this one
+        if _running:
+            _running[-1]['peak_traced'] = max(_running[-1]['peak_traced'], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        record['peak_traced'] = 0
+    _running.append(record)
+
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        seconds = time.perf_counter() - start
+        _running.pop()
+
+        stages = _report['stages']
+        stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'rows': 0, 'peak_rss_mb': None})
+        stages[name]['calls'] += 1
+        stages[name]['seconds'] += seconds
+        stages[name]['rows'] += record['rows'] or 0
+        stages[name]['peak_rss_mb'] = peak_rss_mb()
+
+        if tracing:
+            peak_traced = max(record['peak_traced'], tracemalloc.get_traced_memory()[1])
+            if _running:
+                _running[-1]['peak_traced'] = max(_running[-1]['peak_traced'], peak_traced)
+            stages[name]['peak_traced_mb'] = max(stages[name].get('peak_traced_mb', 0),
+                                                 round(peak_traced / 1024**2, 1))
+
+
+def profiled(name, rows=None):
+    """Decorator that records every call of the function as the stage `name`
+    (see `stage`).
+
+    Parameters
+    ----------
+    name : str or callable
+        Name of the stage or a function that returns the name from the
+        arguments of the call.
+
+    rows : callable or None
+        Function that returns the amount of processed rows from the arguments
+        of the call. By default the length of the first argument is used if
+        it's a DataFrame.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _report is None:
+                return func(*args, **kwargs)
+
+            if rows is not None:
+                n_rows = rows(*args, **kwargs)
+            else:
+                first_arg = args[0] if args else next(iter(kwargs.values()), None)
+                n_rows = len(first_arg) if hasattr(first_arg, 'columns') else None
+            with stage(name(*args, **kwargs) if callable(name) else name, n_rows):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def report():
+    """Returns the report of the current run: the total wall time and, for
+    every stage, the amount of calls, the wall time and the rows (summed up
+    over the calls) and the peak memory use of the process at the end of the
+    stage (`peak_rss_mb`, MB). With `trace_memory` the peak of the memory
+    allocated by Python while the stage runs (`peak_traced_mb`, MB) is
+    reported as well. Time of the
+    nested stages is included in the outer ones."""
+    if _report is None:
+        return None
+
+    stages = {}
+    for name, record in _report['stages'].items():
+        stages[name] = dict(record, seconds=round(record['seconds'], 4))
+        if record['seconds'] > 0 and record['rows'] > 0:
+            stages[name]['rows_per_sec'] = round(record['rows'] / record['seconds'])
+
+    return {'started': _report['started'], 'python': _report['python'],
+            'total_seconds': round(time.perf_counter() - _report['start'], 4),
+            'peak_rss_mb': peak_rss_mb(), 'stages': stages}
+
+
+def save_report(report_file):
+    """Saves the report of the current run (see `report`) to the json file."""
+    with open(report_file, 'w') as f:
+        json.dump(report(), f, indent=4)
+
+
+@contextmanager
+def profile_run(report_file=None, trace_memory=False):
+    """Profiles the code inside the `with` block and saves the report
+    (see `report`) to the json file. Does nothing if `report_file` is `None`."""
+    if report_file is None:
+        yield
+        return
+
+    enable(trace_memory)
+    try:
+        yield
+    finally:
+        save_report(report_file)
+        disable()
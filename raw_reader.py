@@ -0,0 +1,514 @@
+import io
+import codecs
+import itertools
+import numpy as np
+import pandas as pd
+from pandas.api.types import CategoricalDtype, is_string_dtype, is_object_dtype
+import helper_functions
+import profiling
+
+
+try:
+    import pyarrow
+    import pyarrow.csv
+except ImportError:
+    # optional, the default parser of pandas is used without it
+    pyarrow = None
+
+
+# types of the raw columns. Labels are always read as strings, otherwise
+# their type is guessed (e.g. numeric RFIDs mixed with text). Type of the
+# message values depends on the task, so it is guessed
+RAW_DTYPES = {'DateTime': float, 'IdRFID': str, 'IdLabel': str, 'unitLabel': str, 'eventDuration': float,
+              'outLabel': str, 'SystemMsg': str}
+
+# columns with a few distinct labels, kept as categorical codes in memory
+CATEGORY_COLUMNS = ['IdRFID', 'IdLabel', 'unitLabel', 'outLabel', 'SystemMsg', 'fname']
+
+# byte order marks of the encodings (UTF-32 ones start with the UTF-16 ones, so they go first)
+BOMS = [(codecs.BOM_UTF32_LE, 'utf_32'), (codecs.BOM_UTF32_BE, 'utf_32'), (codecs.BOM_UTF8, 'utf_8_sig'),
+        (codecs.BOM_UTF16_LE, 'utf_16'), (codecs.BOM_UTF16_BE, 'utf_16')]
+
+# encodings and separators that are tried if the file cannot be read with the given ones
+ENCODINGS = ['utf_16', 'utf_8', 'latin_1']
+SEPARATORS = [';', ',', '\t', '|']
+
+
+def info_rows_end(text, start):
+    """Returns the position in the `text` after the rows with the technical
+    info ('#' in the first column) that begin at `start`."""
+    while text.startswith('#', start):
+        line_end = text.find('\n', start)
+        if line_end == -1:
+            return len(text)
+        start = line_end + 1
+    return start
+
+
+def drop_info_rows(text, start=0):
+    """Returns the `text` from `start` (the start of a line) without the rows
+    with the technical info ('#' in the first column), wherever they are in
+    the text, e.g. the info rows repeated in the middle of the file."""
+    parts = []
+    while True:
+        if text.startswith('#', start):
+            info_start = start
+        else:
+            info_start = text.find('\n#', start)
+            if info_start == -1:
+                break
+            info_start += 1
+        parts.append(text[start:info_start])
+        start = info_rows_end(text, info_start)
+    parts.append(text[start:])
+    return ''.join(parts)
+
+
+def raw_columns(header_columns):
+    """Columns of the raw file to parse: the extra columns after `MsgValue3`
+    hold additional information and are not parsed at all."""
+    if 'MsgValue3' in header_columns:
+        return header_columns[:header_columns.index('MsgValue3')+1]
+    return header_columns
+
+
+def raw_dtypes(columns):
+    """Types of the `columns` to parse (see `RAW_DTYPES`)."""
+    return {column: RAW_DTYPES[column] for column in columns if column in RAW_DTYPES}
+
+
+def sniff_format(input_file_path, input_encoding="utf_16", input_sep=";", sample_size=65536, verbose=True):
+    """Finds the encoding, the separator and the rows with the technical info
+    of the raw file from its first bytes. The given encoding and separator are
+    tried first; if the header cannot be read with them, the encoding of the
+    byte order mark and other common encodings and separators are tried.
+
+    Parameters
+    ----------
+    input_file_path : str
+        Path to the csv file with the raw data.
+
+    input_encoding : str or None
+        Expected encoding of the file.
+
+    input_sep : str or None
+        Expected delimiter of the file.
+
+    sample_size : int
+        Amount of the first bytes to look at.
+
+    verbose : bool
+        Whether to print a message if the file is read with a different
+        encoding or separator than the given ones.
+
+    Returns
+    ----------
+    encoding : str
+        Encoding of the file.
+
+    sep : str
+        Delimiter of the file.
+
+    columns : list of str
+        Columns to parse (see `raw_columns`).
+
+    n_info_rows : int
+        Amount of the rows with the technical info after the header.
+    """
+    with open(input_file_path, 'rb') as f:
+        sample = f.read(sample_size)
+
+    # BOM marks the encoding of the whole file
+    bom_encoding = next((encoding for bom, encoding in BOMS if sample.startswith(bom)), None)
+    encodings = dict.fromkeys(encoding for encoding in [input_encoding, bom_encoding] + ENCODINGS
+                              if encoding is not None)
+    separators = dict.fromkeys(sep for sep in [input_sep] + SEPARATORS if sep is not None)
+
+    for encoding in encodings:
+        try:
+            text = codecs.getincrementaldecoder(encoding)().decode(sample).lstrip('\ufeff')
+        except (UnicodeError, LookupError):
+            continue
+        header_end = text.find('\n') + 1
+        header = text[:header_end].rstrip('\r\n')
+        for sep in separators:
+            columns = header.split(sep)
+            if 'DateTime' in columns and 'SystemMsg' in columns:
+                if verbose and (encoding, sep) != (input_encoding, input_sep):
+                    print(f"\nFile {input_file_path} is read with encoding {encoding!r} and separator {sep!r}.")
+                n_info_rows = text.count('\n', header_end, info_rows_end(text, header_end))
+                return encoding, sep, raw_columns(columns), n_info_rows
+
+    raise ValueError(f"Header of the raw file {input_file_path} wasn't found. "
+                     "Check the `encoding` and `sep` parameters.")
+
+
+def read_arrow(data, sep, columns):
+    """Parses the UTF-8 csv data with pyarrow (in several threads). Labels
+    are kept as dictionaries, so no Python string is made for every row;
+    they become categorical columns with the sorted categories (same as
+    after `compact_events`). Other columns get the same types as with
+    the parser of pandas."""
+    column_types = {column: pyarrow.dictionary(pyarrow.int32(), pyarrow.string()) if column_type is str
+                    else pyarrow.float64() for column, column_type in raw_dtypes(columns).items()}
+    table = pyarrow.csv.read_csv(
+        io.BytesIO(data), parse_options=pyarrow.csv.ParseOptions(delimiter=sep),
+        convert_options=pyarrow.csv.ConvertOptions(include_columns=columns, column_types=column_types,
+                                                   strings_can_be_null=True))
+
+    for i, field in enumerate(table.schema):
+        if pyarrow.types.is_null(field.type):
+            # empty columns are float in pandas
+            table = table.set_column(i, field.name, table.column(i).cast(pyarrow.float64()))
+        elif pyarrow.types.is_temporal(field.type):
+            # dates are not guessed by pandas
+            table = table.set_column(i, field.name, table.column(i).cast(pyarrow.string()))
+
+    df = table.to_pandas()
+    for column in df.columns[[isinstance(dtype, CategoricalDtype) for dtype in df.dtypes]]:
+        df[column] = df[column].cat.reorder_categories(df[column].cat.categories.sort_values())
+    return df
+
+
+def read_raw_file(input_file_path, input_encoding="utf_16", input_sep=";", engine=None):
+    """Reads the whole raw csv file. Only the needed columns are parsed,
+    with the types from `RAW_DTYPES`.
+
+    The file is transcoded to UTF-8 at once (instead of line by line while
+    parsing) and the rows with the technical info are cut out before
+    the parsing (see `drop_info_rows`).
+
+    Parameters
+    ----------
+    input_file_path : str
+        Path to the csv file with the raw data.
+
+    input_encoding : str
+        Encoding of an input file. See `sniff_format`.
+
+    input_sep : str
+        Delimiter to use for an input file. See `sniff_format`.
+
+    engine : str or None
+        Parser of pandas, 'c' or 'pyarrow'. By default 'pyarrow' is used
+        if it is installed. With 'pyarrow' the labels are read as categorical
+        (see `compact_events`).
+
+    Returns
+    ----------
+    df : DataFrame
+        Raw data without the technical info rows and extra columns,
+        `DateTime` holds the serial date-times (float).
+    """
+    with profiling.stage('header_filtering'):
+        encoding, sep, columns, _ = sniff_format(input_file_path, input_encoding, input_sep)
+    if engine is None:
+        engine = 'c' if pyarrow is None else 'pyarrow'
+
+    with profiling.stage('csv_read'):
+        with open(input_file_path, 'rb') as f:
+            text = f.read().decode(encoding).lstrip('\ufeff')
+
+    with profiling.stage('header_filtering'):
+        header_end = text.find('\n') + 1
+        data = text[:header_end].encode('utf_8') + drop_info_rows(text, header_end).encode('utf_8')
+        del text
+
+    with profiling.stage('csv_read') as record:
+        if engine == 'pyarrow':
+            df = read_arrow(data, sep, columns)
+        else:
+            # 'round_trip' parses the floats exactly the same way as Python
+            df = pd.read_csv(io.BytesIO(data), sep=sep, usecols=columns, dtype=raw_dtypes(columns),
+                             float_precision='round_trip')
+        record['rows'] = len(df)
+
+    return df
+
+
+@profiling.profiled('compaction')
+def compact_events(df):
+    """Converts the cleaned data into the compact representation: the labels
+    (`SystemMsg`, `IdLabel`, `unitLabel`, etc.) and the text message values
+    become categorical (small integer codes instead of Python strings), the
+    numeric message values are stored as float32 when no precision is lost.
+    `DateTime` (datetime64, int64 nanoseconds) and `Timestamp` are kept as is.
+
+    Comparisons like `df['SystemMsg'] == 'iti'` work on the codes, so the
+    extractors don't need any changes; values taken from the compact columns
+    into the outputs are converted back with `helper_functions.plain_values`.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Cleaned data (see `helper_functions.initial_cleaning`).
+
+    Returns
+    ----------
+    df : DataFrame
+        The same data with the compact column types.
+    """
+    columns = {}
+    for column in df.columns:
+        values = df[column]
+        # text is `object` or, since pandas 3, `str`
+        is_text = is_string_dtype(values) or is_object_dtype(values)
+        if is_text and (column in CATEGORY_COLUMNS or column.startswith('MsgValue')):
+            columns[column] = values.astype('category')
+        elif values.dtype == np.float64 and (column.startswith('MsgValue') or column == 'eventDuration'):
+            values32 = values.values.astype(np.float32)
+            if np.array_equal(values32.astype(np.float64), values.values, equal_nan=True):
+                columns[column] = pd.Series(values32, index=values.index)
+    return df.assign(**columns) if columns else df
+
+
+def concat_events(dfs):
+    """Concatenates the compact tables (see `compact_events`) of several files.
+    Categories of the same column are merged first, otherwise pandas would
+    turn the column back into Python strings."""
+    dfs = list(dfs)
+    for column in dfs[0].columns:
+        if not all(column in df and isinstance(df[column].dtype, CategoricalDtype) for df in dfs):
+            continue
+        categories = dfs[0][column].cat.categories
+        for df in dfs[1:]:
+            categories = categories.union(df[column].cat.categories)
+        dfs = [df.assign(**{column: df[column].cat.set_categories(categories)}) for df in dfs]
+    return pd.concat(dfs, ignore_index=True)
+
+
+def read_raw_chunks(input_file_path, input_encoding="utf_16", input_sep=";", chunksize=100000):
+    """Reads the raw csv file block by block.
+
+    Parameters
+    ----------
+    input_file_path : str
+        Path to the csv file with the raw data.
+
+    input_encoding : str
+        Encoding of an input file.
+
+    input_sep : str
+        Delimiter to use for an input file.
+
+    chunksize : int
+        Number of lines in a block (blocks have less rows if there were rows
+        with the technical info among the lines).
+
+    Returns
+    ----------
+    chunks : generator of DataFrame
+        Blocks of the raw data without the technical info rows and extra columns.
+        The file is opened (and its format is found, see `sniff_format`) before
+        the first block is requested, so reading errors are raised by this function itself.
+    """
+    with profiling.stage('header_filtering'):
+        encoding, sep, columns, _ = sniff_format(input_file_path, input_encoding, input_sep)
+    f = open(input_file_path, 'r', encoding=encoding)
+    header = f.readline().lstrip('\ufeff')
+    with profiling.stage('csv_read') as record:
+        first_chunk = read_lines_chunk(f, header, sep, columns, chunksize)
+        record['rows'] = 0 if first_chunk is None else len(first_chunk)
+
+    def chunks():
+        with f:
+            chunk = first_chunk
+            while chunk is not None:
+                yield chunk
+                with profiling.stage('csv_read') as record:
+                    chunk = read_lines_chunk(f, header, sep, columns, chunksize)
+                    record['rows'] = 0 if chunk is None else len(chunk)
+
+    return chunks()
+
+
+def read_lines_chunk(f, header, sep, columns, chunksize):
+    """Parses the next `chunksize` lines of the open raw file `f` without the
+    rows with the technical info (see `drop_info_rows`). `None` at the end
+    of the file."""
+    lines = list(itertools.islice(f, chunksize))
+    if not lines:
+        return None
+    with profiling.stage('header_filtering'):
+        text = drop_info_rows(''.join(lines))
+    return pd.read_csv(io.StringIO(header + text), sep=sep, usecols=columns, dtype=raw_dtypes(columns),
+                       float_precision='round_trip')
+
+
+def read_raw_tail(input_file_path, offset=0, header=None, input_encoding="utf_16", input_sep=";"):
+    """Reads the raw csv file starting from the byte `offset`, e.g. only
+    the rows appended to the file since the previous reading.
+
+    Only complete lines are read, so the file may be read while the system
+    is still writing to it. The format of the file is found by `sniff_format`
+    on every call (only the beginning of the file is read for it); the message
+    about a different format is printed at the first reading only.
+
+    Parameters
+    ----------
+    input_file_path : str
+        Path to the csv file with the raw data.
+
+    offset : int
+        Position in the file (in bytes) to start from. It must be the start
+        of a line, e.g. the `offset` returned by the previous call.
+
+    header : str or None
+        Header line of the file. Must be set if `offset` is not 0.
+
+    input_encoding : str
+        Encoding of an input file. See `sniff_format`.
+
+    input_sep : str
+        Delimiter to use for an input file. See `sniff_format`.
+
+    Returns
+    ----------
+    df : DataFrame
+        New rows of the raw data without the technical info rows and extra columns.
+
+    offset : int
+        Position in the file after the last complete line that was read.
+
+    header : str
+        Header line of the file.
+    """
+    with profiling.stage('header_filtering'):
+        input_encoding, input_sep, _, _ = sniff_format(input_file_path, input_encoding, input_sep,
+                                                       verbose=offset == 0)
+
+    with open(input_file_path, 'rb') as f:
+        data = f.read(4)
+        # BOM marks the byte order of the whole file
+        bom = next((bom for bom, _ in BOMS if data.startswith(bom)), b'')
+        f.seek(offset)
+        data = f.read()
+
+    decoder = codecs.getincrementaldecoder(input_encoding)()
+    if offset > 0:
+        decoder.decode(bom)
+    text = decoder.decode(data)
+
+    # the last line may be incomplete, it'll be read next time
+    rest = text[text.rfind('\n')+1:]
+    n_rest = len(rest.encode(input_encoding)) - len(''.encode(input_encoding)) + len(decoder.getstate()[0])
+    text = text[:len(text)-len(rest)]
+
+    with profiling.stage('header_filtering'):
+        if offset == 0:
+            header_end = text.find('\n') + 1
+            header = text[:header_end].lstrip('\ufeff')
+            text = drop_info_rows(text, header_end)
+        else:
+            # the previous reading may have stopped inside the info rows
+            # (e.g. the file was read right after the system created it)
+            text = drop_info_rows(text)
+    offset += len(data) - n_rest
+
+    columns = raw_columns(header.rstrip('\r\n').split(input_sep))
+    if 'DateTime' not in columns:
+        raise ValueError(f"Header of the raw file {input_file_path} wasn't found. "
+                         "Check the `encoding` and `sep` parameters.")
+
+    with profiling.stage('csv_read') as record:
+        df = pd.read_csv(io.StringIO(header + text), sep=input_sep, usecols=columns,
+                         dtype=raw_dtypes(columns),
+                         float_precision='round_trip')
+        record['rows'] = len(df)
+
+    return df, offset, header
+
+
+def iter_sessions(chunks, by='DateTime', tz=None, state=None):
+    """Yields the finished sessions from the blocks of the raw data.
+
+    Session = observations between 'start exp' and 'end exp' of an animal.
+    Observations of an unfinished session are carried over to the next
+    block, so only the data from the earliest open session onward is kept in
+    memory. Each 'end exp' closes the latest 'start exp' of the same animal;
+    sessions that were not closed by the end of the data are skipped.
+
+    Parameters
+    ----------
+    chunks : iterable of DataFrame
+        Blocks of the raw data (see `read_raw_chunks`), in the file order.
+
+    by : str or list of str
+        Columns to sort the observations by. See `helper_functions.initial_cleaning`.
+
+    tz : str, tzinfo or None
+        Time zone of the system clock. See `helper_functions.serial_to_datetime`.
+
+    state : dict or None
+        Reading state to continue from, e.g. when new data were appended to
+        the file since the previous call (pass an empty dict the first time).
+        It is updated in place; the unfinished sessions are kept in it
+        instead of being skipped.
+
+    Yields
+    ----------
+    animal_id : str
+        Label of the animal.
+
+    session_df : DataFrame
+        Observations of the session (indexed from 0) with the `session` column
+        holding the session number of the animal.
+    """
+    by = [by] if isinstance(by, str) else list(by)
+    keep_open = state is not None
+    state = {} if state is None else state
+    buffer = state.get('buffer')
+    open_sessions = state.setdefault('open_sessions', {}) # animal ID -> row number of the 'start exp'
+    session_count = state.setdefault('session_count', {})
+    row_count = state.get('row_count', 0)
+
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        chunk = helper_functions.initial_cleaning(chunk.copy(), by=by, tz=tz)
+        # row number in the file order, used to find the session boundaries
+        # after the carried over observations are merged with the new block
+        chunk['_row'] = range(row_count, row_count + len(chunk))
+        row_count += len(chunk)
+
+        with profiling.stage('session_detection', rows=len(chunk)):
+            if buffer is None or buffer.empty:
+                buffer = chunk
+            else:
+                # both parts are sorted, so the sorting is only needed
+                # when the new block starts before the end of the carried over data
+                in_order = tuple(buffer[by].iloc[-1]) <= tuple(chunk[by].iloc[0])
+                buffer = pd.concat([buffer, chunk], ignore_index=True)
+                if not in_order:
+                    buffer.sort_values(by=by, kind='mergesort', inplace=True, ignore_index=True)
+
+            marks = chunk[chunk['SystemMsg'].isin(['start exp', 'end exp']) & chunk['IdLabel'].notna()]
+            finished_sessions = []
+            for animal_id, msg, row in marks[['IdLabel', 'SystemMsg', '_row']].values:
+                if msg == 'start exp':
+                    open_sessions[animal_id] = row
+                elif animal_id in open_sessions:
+                    finished_sessions.append((animal_id, open_sessions.pop(animal_id), row))
+
+            position = pd.Series(buffer.index, index=buffer['_row'])
+            session_dfs = []
+            for animal_id, row_start, row_end in finished_sessions:
+                session_count[animal_id] = session_count.get(animal_id, 0) + 1
+                session_df = buffer.iloc[position[row_start]:position[row_end]+1]
+                session_df = session_df.drop(columns='_row').reset_index(drop=True)
+                session_dfs.append((animal_id, session_df.assign(session=session_count[animal_id])))
+
+            # keep only the observations starting from the earliest open session
+            if open_sessions:
+                buffer = buffer.iloc[min(position[row] for row in open_sessions.values()):].reset_index(drop=True)
+            else:
+                buffer = None
+
+        yield from session_dfs
+
+        state['buffer'] = buffer
+        state['row_count'] = row_count
+
+    if not keep_open:
+        for animal_id in open_sessions:
+            print(f"\nSession of the animal {animal_id} without 'end exp' was skipped.")
@@ -0,0 +1,238 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+import numpy as np
+import pandas as pd
+from pandas.api.types import CategoricalDtype, is_string_dtype, is_object_dtype
+import helper_functions
+
+ROOT_PATH = os.path.dirname(os.path.abspath(__file__))
+
+# change it whenever the layout of the store changes
+STORE_VERSION = 1
+
+META_NAME = 'meta.json'
+
+
+def is_store(path):
+    """Whether the path is a session store (see `save_store`)."""
+    return os.path.isfile(os.path.join(path, META_NAME))
+
+
+def save_store(input_df, store_path, options=None):
+    """Saves the cleaned data into the session store: a folder with one
+    `.npy` file per column (fixed-width values that can be memory-mapped,
+    see `open_store`) and `meta.json` with the session index
+    (see `helper_functions.session_index`).
+
+    Text columns are saved as integer codes, their values (categories)
+    are kept in `meta.json`.
+
+    Parameters
+    ----------
+    input_df : DataFrame
+        Cleaned data (see `read_input_file` of the preprocessors).
+
+    store_path : str
+        Folder of the store. If it exists, it is replaced.
+
+    options : dict or None
+        Reading options of the data (e.g. name of the parser, `tz`),
+        checked by `load_table`.
+    """
+    sessions, unmatched = helper_functions.session_index(input_df)
+
+    # write to a temporary folder first, so nobody sees a partial store
+    tmp_path = f"{store_path}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    columns = []
+    for i, column in enumerate(input_df.columns):
+        values = input_df[column]
+        # text (`object` or, since pandas 3, `str`) can't be memory-mapped
+        if is_string_dtype(values) or is_object_dtype(values):
+            values = values.astype('category')
+        column_meta = {'name': column, 'file': f"{i}.npy"}
+        if isinstance(values.dtype, CategoricalDtype):
+            np.save(os.path.join(tmp_path, column_meta['file']), values.cat.codes.values)
+            column_meta['categories'] = values.cat.categories.tolist()
+        else:
+            np.save(os.path.join(tmp_path, column_meta['file']), values.values)
+        columns.append(column_meta)
+
+    date_time = input_df['DateTime'].values
+    meta = {'version': STORE_VERSION, 'options': options or {}, 'n_rows': len(input_df), 'columns': columns,
+            # time ranges are found by the binary search only if the rows are in the time order
+            'sorted_by_time': bool(np.all(date_time[1:] >= date_time[:-1])),
+            'sessions': sessions, 'unmatched': unmatched}
+    with open(os.path.join(tmp_path, META_NAME), 'w') as f:
+        json.dump(meta, f)
+
+    shutil.rmtree(store_path, ignore_errors=True)
+    os.replace(tmp_path, store_path)
+
+
+def open_store(store_path):
+    """Opens the session store (see `save_store`). Columns are memory-mapped,
+    so nothing is read from the disk until the values are used.
+
+    Returns
+    ----------
+    store : dict
+        `arrays`: memory-mapped column values (codes for the text columns),
+        `categories`: values of the text columns, `sessions` and `unmatched`
+        (see `helper_functions.session_index`), `n_rows`, `sorted_by_time`
+        and `options`.
+    """
+    with open(os.path.join(store_path, META_NAME), 'r') as f:
+        meta = json.load(f)
+    if meta['version'] != STORE_VERSION:
+        raise ValueError(f"Store {store_path} was made by another version of the code. Convert the file again.")
+
+    return {'arrays': {column['name']: np.load(os.path.join(store_path, column['file']), mmap_mode='r')
+                       for column in meta['columns']},
+            'categories': {column['name']: column['categories'] for column in meta['columns']
+                           if 'categories' in column},
+            'sessions': {animal_id: [tuple(session) for session in animal_sessions]
+                         for animal_id, animal_sessions in meta['sessions'].items()},
+            'unmatched': {animal_id: tuple(rows) for animal_id, rows in meta['unmatched'].items()},
+            'n_rows': meta['n_rows'], 'sorted_by_time': meta['sorted_by_time'], 'options': meta['options']}
+
+
+def store_rows(store, animal_id=None, session=None, start=None, end=None):
+    """Returns the range of the rows of the session and/or the time range.
+
+    Parameters
+    ----------
+    store : dict
+        Opened store (see `open_store`).
+
+    animal_id : str or None
+        Label of the animal. If set, `session` must be set as well.
+
+    session : int or None
+        Session number of the animal (from 1).
+
+    start, end : datetime-like or None
+        Time range (`DateTime`, both ends included). Only the part of the
+        session within the range is returned if the session is set.
+
+    Returns
+    ----------
+    row_start, row_stop : int
+        Rows `row_start` to `row_stop` (not included) of the store.
+    """
+    row_start, row_stop = 0, store['n_rows']
+    if animal_id is not None:
+        if session is None:
+            raise ValueError("Session number must be set together with the animal.")
+        if animal_id not in store['sessions'] or not 1 <= session <= len(store['sessions'][animal_id]):
+            raise KeyError(f"Session {session} of the animal {animal_id} is not in the store.")
+        session_start, session_end, _, _ = store['sessions'][animal_id][session-1]
+        row_start, row_stop = session_start, session_end + 1
+
+    if start is not None or end is not None:
+        if not store['sorted_by_time']:
+            raise ValueError("Rows of the store are not in the time order, time ranges are not supported.")
+        date_time = store['arrays']['DateTime'][row_start:row_stop]
+        # only the pages of the binary search are read
+        if end is not None:
+            row_stop = row_start + np.searchsorted(date_time, np.datetime64(pd.Timestamp(end)), side='right')
+        if start is not None:
+            row_start = row_start + np.searchsorted(date_time, np.datetime64(pd.Timestamp(start)), side='left')
+        row_start = min(row_start, row_stop)
+
+    return int(row_start), int(row_stop)
+
+
+def store_view(store, animal_id=None, session=None, start=None, end=None, columns=None):
+    """Returns the values of the session and/or the time range (see `store_rows`)
+    without copying them: slices of the memory-mapped columns.
+
+    Parameters
+    ----------
+    columns : list of str or None
+        Columns to return, all by default.
+
+    Returns
+    ----------
+    values : dict
+        Array of every column; codes for the text columns (their values are
+        in `store['categories']`, -1 means a missing value).
+    """
+    row_start, row_stop = store_rows(store, animal_id, session, start, end)
+    columns = list(store['arrays']) if columns is None else columns
+    return {column: store['arrays'][column][row_start:row_stop] for column in columns}
+
+
+def store_frame(store, animal_id=None, session=None, start=None, end=None, columns=None):
+    """Returns the observations of the session and/or the time range
+    (see `store_rows`) as a DataFrame indexed from 0, the same as the
+    cleaned data (see `raw_reader.compact_events`). If the session is set,
+    the `session` column holds its number (see `helper_functions.session_slice`)."""
+    df = pd.DataFrame({column: pd.Categorical.from_codes(values, store['categories'][column])
+                       if column in store['categories'] else values
+                       for column, values in store_view(store, animal_id, session, start, end, columns).items()})
+    if session is not None:
+        df['session'] = session
+    return df
+
+
+def load_table(store_path, options=None):
+    """Loads the whole cleaned data from the store.
+
+    Parameters
+    ----------
+    store_path : str
+        Folder of the store.
+
+    options : dict or None
+        Reading options the data must have been made with (see `save_store`).
+    """
+    store = open_store(store_path)
+    for key, value in (options or {}).items():
+        if store['options'].get(key) != value:
+            raise ValueError(f"Store {store_path} was made with {key}={store['options'].get(key)!r}, "
+                             f"not {value!r}. Convert the file again.")
+    return store_frame(store)
+
+
+def convert_file(input_file_path, store_path, task='5csrtt', input_encoding="utf_16", input_sep=";", tz=None):
+    """Reads and cleans the raw file with the preprocessor of the `task`
+    ('5csrtt' or '2vdlr') and saves it into the session store."""
+    # preprocessors use this module, so they are imported only here
+    if task == '5csrtt':
+        sys.path.append(os.path.join(ROOT_PATH, '5csrtt'))
+        import fcsrtt_preprocessor
+        input_df = fcsrtt_preprocessor.read_input_file(input_file_path, input_encoding, input_sep, tz)
+        parser = 'fcsrtt'
+    elif task == '2vdlr':
+        sys.path.append(os.path.join(ROOT_PATH, '2vdlr'))
+        import tvdlr_preprocessor
+        input_df = tvdlr_preprocessor.read_input_file(input_file_path, input_encoding, input_sep, tz)
+        parser = 'tvdlr'
+    else:
+        raise ValueError(f"Unknown task {task}. Possible values are '5csrtt' and '2vdlr'.")
+
+    save_store(input_df, store_path, options={'parser': parser, 'tz': tz,
+                                              'source': os.path.basename(input_file_path)})
+    return store_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Converts the raw file into the session store "
+                                                 "(memory-mapped columns and the session index).")
+    parser.add_argument('task', choices=['5csrtt', '2vdlr'])
+    parser.add_argument('input_file', help="raw csv file")
+    parser.add_argument('-o', '--output', help="folder of the store (the input file name with '.store' by default)")
+    parser.add_argument('--encoding', default="utf_16")
+    parser.add_argument('--sep', default=";")
+    parser.add_argument('--tz', help="time zone of the system clock")
+    args = parser.parse_args()
+
+    store_path = args.output if args.output is not None else os.path.splitext(args.input_file)[0] + '.store'
+    convert_file(args.input_file, store_path, args.task, args.encoding, args.sep, args.tz)
+    print(f"Store was saved to {store_path}")
@@ -0,0 +1,295 @@
+import numpy as np
+import pandas as pd
+import helper_functions
+
+
+def event_mask(df, select):
+    """Marks the observations that match the event selector of a task spec.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Observations.
+
+    select : str or dict
+        'message' - `SystemMsg` equals the message;
+        {'column': ..., 'equals': ...} - the column equals the value;
+        {'column': ..., 'startswith': ...} - the text of the column starts with the value.
+
+    Returns
+    ----------
+    mask : Series of bool
+    """
+    if isinstance(select, str):
+        return df['SystemMsg'] == select
+    if 'equals' in select:
+        return df[select['column']] == select['equals']
+    if 'startswith' in select:
+        return df[select['column']].str.startswith(select['startswith'], na=False)
+    raise ValueError(f"Unknown event selector {select}.")
+
+
+def case_mask(trials_df, when):
+    """Whether all conditions of the outcome case hold for every trial.
+    A condition is the name of an event (the event happened in the trial)
+    or {'equal': [column, column]} (both columns have the same value)."""
+    mask = np.ones(len(trials_df), dtype=bool)
+    for condition in when:
+        if isinstance(condition, str):
+            mask &= trials_df[condition].notna().values
+        else:
+            left, right = condition['equal']
+            mask &= (trials_df[left] == trials_df[right]).values
+    return mask
+
+
+def selector_mask(masks, df, select):
+    """Returns the mask of the event selector (see `event_mask`) as an array,
+    computed once per selector and kept in `masks`."""
+    if repr(select) not in masks:
+        masks[repr(select)] = event_mask(df, select).values
+    return masks[repr(select)]
+
+
+def selector_index(indexes, df, mask, select, trial_key):
+    """Returns the index of the events (see `helper_functions.event_index`)
+    grouped by trial, built once per selector and kept in `indexes`."""
+    if repr(select) not in indexes:
+        indexes[repr(select)] = helper_functions.event_index(df, mask, by=trial_key)
+    return indexes[repr(select)]
+
+
+def spec_columns(spec):
+    """Columns of the observations the spec uses."""
+    selectors = [spec['trial_start']]
+    selectors += [part['select'] for kind in ('events', 'counts', 'flags') for part in spec.get(kind, {}).values()]
+    columns = {'session', 'Timestamp', 'SystemMsg'}
+    columns.update(select['column'] for select in selectors if not isinstance(select, str))
+    columns.update(spec.get('start_values', {}).values())
+    columns.update(value['column'] for value in spec.get('values', {}).values())
+    if any('fallback' in value for value in spec.get('values', {}).values()):
+        # the fallback events are looked up by time
+        columns.add('DateTime')
+    return columns
+
+
+def trial_table(session_df, spec):
+    """Transforms the observations of one animal's sessions into the trials
+    table of the task described by the spec, in a single vectorized pass:
+    the events of all trials are found at once by the binary search
+    (see `helper_functions.event_index`). See `trial_tables` for several
+    specs of the same observations.
+
+    Parts of the spec are computed in this order, so the later ones can
+    use the columns of the earlier ones:
+
+    * `trial_start`: event selector (see `event_mask`) of the observation
+      that starts a trial. Trial = observations from the trial start to the
+      next one (or to the end of the session);
+    * `start_values`: output column -> column of the trial start observation;
+    * `duration`: {'name': ..., 'round': ...}, time from the trial start
+      to the last observation of the trial;
+    * `events`: name -> {'select': selector, 'from': event, 'direction': ...},
+      the event of the trial found from the time of the `from` event
+      ('start' by default, the trial start) in the `direction` (see
+      `helper_functions.find_events`, 'forward' by default). Its time is
+      kept in the column with the name of the event, NaN if there is no event;
+    * `values`: name -> {'event': ..., 'column': ..., 'missing': ..., 'fallback': ...},
+      value of the column at the event, `missing` (NaN by default) if there
+      is no event. `fallback` = {'select': selector, 'at': column} takes the
+      value from the event of the session at the time in the column instead;
+    * `counts`: name -> {'select': selector, 'before' / 'after': event},
+      amount of the events in the trial (strictly before / after the event);
+    * `flags`: name -> {'select': selector, 'requires': event}, 1.0 if the
+      trial has the event, NaN if there is no `requires` event;
+    * `derive`: name -> function of the trials table, for the task-specific
+      values (e.g. parsing of the stimulus labels);
+    * `outcome`: {'name': ..., 'cases': [{'case': ..., 'when': [...], 'label': ...}], 'default': ...},
+      the first case whose conditions hold (see `case_mask`) gives the
+      label (the name of the case by default);
+    * `latencies`: name -> {'between': [event, event]} or
+      {'cases': {case: [event, event] or number}, 'missing': ...}, time
+      between the events (for the trials of the case only), `missing` if
+      the case holds but an event is absent; optional 'round';
+    * `columns`: columns of the returned table.
+
+    Parameters
+    ----------
+    session_df : DataFrame
+        Observations of all sessions of a single animal, ordered in time and
+        indexed from 0. The `session` column holds the session number.
+
+    spec : dict
+        Task spec (e.g. `TRIAL_SPEC` of the preprocessors).
+
+    Returns
+    ----------
+    trials_df : DataFrame
+        One row per trial with the `columns` of the spec.
+    """
+    return trial_tables(session_df, [spec])[0]
+
+
+def trial_tables(session_df, specs):
+    """Trials tables of several specs (e.g. the trials and the ITI trials of
+    the task, see `trial_table`) in a single pass over the observations:
+    the columns of all specs are copied once, the mask of every event
+    selector is computed once for all specs and the trials of all specs
+    are numbered by one grouped cumulative sum. The indexes of the events
+    are grouped by trial, so they are built for every spec that looks up
+    the events.
+
+    Parameters
+    ----------
+    session_df : DataFrame
+        Observations of all sessions of a single animal, ordered in time and
+        indexed from 0. The `session` column holds the session number.
+
+    specs : list of dict
+        Task specs.
+
+    Returns
+    ----------
+    tables : list of DataFrame
+        Trials table of every spec.
+    """
+    # only the used columns are copied into the trials
+    columns = set().union(*[spec_columns(spec) for spec in specs])
+    df = session_df[[column for column in session_df.columns if column in columns]]
+
+    masks = {}
+    # trial number within the session, 0 before the first trial start of the session
+    trial_ids = pd.DataFrame({i: selector_mask(masks, df, spec['trial_start']) for i, spec in enumerate(specs)},
+                             index=df.index).groupby(df['session']).cumsum()
+
+    return [spec_table(df, trial_ids[i].values, masks, spec) for i, spec in enumerate(specs)]
+
+
+def spec_table(session_df, trial_id, masks, spec):
+    """Trials table of a single spec (see `trial_tables`).
+
+    Parameters
+    ----------
+    session_df : DataFrame
+        Observations with the columns of the specs, indexed from 0.
+
+    trial_id : array of int
+        Trial number of every observation within its session, 0 before the
+        first trial start.
+
+    masks : dict
+        Masks of the event selectors over `session_df` (see `selector_mask`).
+
+    spec : dict
+        Task spec.
+
+    Returns
+    ----------
+    trials_df : DataFrame
+        One row per trial with the `columns` of the spec.
+    """
+    keys = ['session', 'trial']
+
+    # observations before the first trial start of a session are dropped
+    in_trial = trial_id > 0
+    df = session_df[in_trial].assign(trial=trial_id[in_trial])
+    is_start = selector_mask(masks, session_df, spec['trial_start'])[in_trial]
+    # running number of the trial over all sessions, the group of the event lookups
+    trial_key = is_start.cumsum()
+    trial_keys = trial_key[is_start]
+
+    start_values = spec.get('start_values', {})
+    trials_df = df.loc[is_start, keys + ['Timestamp'] + list(start_values.values())]
+    trials_df = trials_df.set_index(keys)
+    trial_start_ts = trials_df.pop('Timestamp')
+    for name, column in start_values.items():
+        trials_df[name] = helper_functions.plain_values(trials_df[column])
+    trials_df = trials_df[list(start_values)]
+
+    if 'duration' in spec:
+        trial_end_ts = df.drop_duplicates(keys, keep='last').set_index(keys)['Timestamp']
+        trials_df[spec['duration']['name']] = trial_end_ts - trial_start_ts
+        if 'round' in spec['duration']:
+            trials_df[spec['duration']['name']] = trials_df[spec['duration']['name']].round(
+                spec['duration']['round'])
+
+    # the same events are often looked up several times
+    indexes = {}
+    times = {'start': trial_start_ts.values}
+    event_rows = {}
+    for name, event in spec.get('events', {}).items():
+        mask = selector_mask(masks, session_df, event['select'])[in_trial]
+        event_rows[name] = helper_functions.find_events(selector_index(indexes, df, mask, event['select'], trial_key),
+                                                        trial_keys, times[event.get('from', 'start')],
+                                                        event.get('direction', 'forward'))
+        times[name] = helper_functions.event_values(df, 'Timestamp', event_rows[name])
+        trials_df[name] = times[name]
+
+    for name, value in spec.get('values', {}).items():
+        rows = event_rows[value['event']]
+        values = helper_functions.event_values(df, value['column'], rows)
+        if 'fallback' in value:
+            # the event is looked up in the whole session, not only in the trial
+            fallback_index = helper_functions.event_index(
+                session_df, selector_mask(masks, session_df, value['fallback']['select']), on='DateTime')
+            fallback_rows = helper_functions.find_events(fallback_index, trials_df.index.get_level_values('session'),
+                                                         trials_df[value['fallback']['at']], 'exact')
+            values = np.where(rows >= 0, values, helper_functions.event_values(session_df, value['column'], fallback_rows))
+        values = pd.Series(values, index=trials_df.index)
+        trials_df[name] = values.where(rows >= 0, value['missing']) if 'missing' in value else values
+
+    for name, count in spec.get('counts', {}).items():
+        mask = selector_mask(masks, session_df, count['select'])[in_trial]
+        if 'before' in count or 'after' in count:
+            direction = 'before' if 'before' in count else 'after'
+            trials_df[name] = helper_functions.count_events(selector_index(indexes, df, mask, count['select'],
+                                                                           trial_key),
+                                                            trial_keys, times[count[direction]], direction)
+        else:
+            # trial keys run from 1 in the order of the trials
+            trials_df[name] = np.bincount(trial_key[mask], minlength=len(trials_df)+1)[1:]
+
+    for name, flag in spec.get('flags', {}).items():
+        mask = selector_mask(masks, session_df, flag['select'])[in_trial]
+        has_event = (np.bincount(trial_key[mask], minlength=len(trials_df)+1)[1:] > 0).astype(float)
+        trials_df[name] = np.where(event_rows[flag['requires']] >= 0, has_event, np.nan) if 'requires' in flag \
+            else has_event
+
+    for name, function in spec.get('derive', {}).items():
+        trials_df[name] = function(trials_df)
+
+    cases = {}
+    if 'outcome' in spec:
+        outcome = spec['outcome']
+        not_matched = np.ones(len(trials_df), dtype=bool)
+        for case in outcome['cases']:
+            # cases are exclusive, the first one that holds is taken
+            cases[case['case']] = not_matched & case_mask(trials_df, case['when'])
+            not_matched &= ~cases[case['case']]
+        trials_df[outcome['name']] = np.select(list(cases.values()),
+                                               [case.get('label', case['case']) for case in outcome['cases']],
+                                               outcome.get('default', np.nan))
+
+    for name, latency in spec.get('latencies', {}).items():
+        if 'between' in latency:
+            start, end = latency['between']
+            values = times[end] - times[start]
+        else:
+            conditions, choices = [], []
+            for case, between in latency['cases'].items():
+                conditions.append(cases[case])
+                if isinstance(between, (int, float)):
+                    choices.append(between)
+                else:
+                    start, end = between
+                    choices.append(times[end] - times[start])
+                    if 'missing' in latency:
+                        choices[-1] = np.where(np.isnan(choices[-1]), latency['missing'], choices[-1])
+            values = np.select(conditions, choices, np.nan)
+        trials_df[name] = values
+        if 'round' in latency:
+            trials_df[name] = trials_df[name].round(latency['round'])
+
+    trials_df.reset_index(inplace=True)
+
+    return trials_df[spec['columns']]
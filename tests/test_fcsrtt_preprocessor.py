@@ -0,0 +1,77 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_PATH)
+sys.path.append(os.path.join(ROOT_PATH, '5csrtt'))
+sys.path.append(os.path.join(ROOT_PATH, 'benchmarks'))
+import log_generator
+import helper_functions
+import fcsrtt_preprocessor
+
+
+def raw_log(tmp_path):
+    """Small synthetic 5-CSRTT log."""
+    raw_file = os.path.join(tmp_path, 'cage.csv')
+    log_generator.write_log(log_generator.fcsrtt_log(np.random.default_rng(0), n_animals=3, n_sessions=3,
+                                                     n_trials=30), raw_file)
+    return raw_file
+
+
+def assert_same_output(output, expected):
+    """The outputs are the same as written to the csv file (the index is not saved)."""
+    pd.testing.assert_frame_equal(output.reset_index(drop=True), expected.reset_index(drop=True))
+
+
+def test_chunksize_same_output(tmp_path):
+    raw_file = raw_log(tmp_path)
+    final_output, final_iti_output = fcsrtt_preprocessor.fcsrtt_data_cleaner(raw_file, by_iti=True, progress=False)
+    assert len(final_output) == 3 * 3 * 30
+
+    # blocks end in the middle of the sessions and of the trials
+    chunk_output, chunk_iti_output = fcsrtt_preprocessor.fcsrtt_data_cleaner(raw_file, by_iti=True, progress=False,
+                                                                             chunksize=333)
+    assert_same_output(chunk_output, final_output)
+    assert_same_output(chunk_iti_output, final_iti_output)
+
+
+def test_n_jobs_same_output(tmp_path):
+    raw_file = raw_log(tmp_path)
+    final_output, final_iti_output = fcsrtt_preprocessor.fcsrtt_data_cleaner(raw_file, by_iti=True, progress=False)
+
+    # animals are processed in 2 processes, the tables are merged in the order of the animals
+    jobs_output, jobs_iti_output = fcsrtt_preprocessor.fcsrtt_data_cleaner(raw_file, by_iti=True, progress=False,
+                                                                           n_jobs=2)
+    assert_same_output(jobs_output, final_output)
+    assert_same_output(jobs_iti_output, final_iti_output)
+
+
+def sorted_csv(csv_file):
+    """Trials of the csv file in the order of the animals, sessions and trials."""
+    return pd.read_csv(csv_file).sort_values(['IdLabel', 'session', 'trial'], kind='stable').reset_index(drop=True)
+
+
+def test_incremental_update_same_output(tmp_path):
+    raw_file = raw_log(tmp_path)
+    with open(raw_file, 'rb') as f:
+        data = f.read()
+
+    # the system appends to the file, the updates run at random moments (also in the middle of the lines)
+    growing_file = os.path.join(tmp_path, 'cage_growing.csv')
+    output_file, output_iti_file = os.path.join(tmp_path, 'out.csv'), os.path.join(tmp_path, 'out_iti.csv')
+    rng = np.random.default_rng(1)
+    for size in list(np.sort(rng.choice(len(data), 20, replace=False))) + [len(data), len(data)]:
+        with open(growing_file, 'wb') as f:
+            f.write(data[:size])
+        new_trials, _ = fcsrtt_preprocessor.fcsrtt_incremental_update(growing_file, output_file, output_iti_file,
+                                                                      progress=False)
+    # nothing is appended if the file didn't change
+    assert new_trials.empty
+
+    final_output, final_iti_output = fcsrtt_preprocessor.fcsrtt_data_cleaner(raw_file, by_iti=True, progress=False)
+    helper_functions.save_csv(final_output, os.path.join(tmp_path, 'expected.csv'))
+    helper_functions.save_csv(final_iti_output, os.path.join(tmp_path, 'expected_iti.csv'))
+    pd.testing.assert_frame_equal(sorted_csv(output_file), sorted_csv(os.path.join(tmp_path, 'expected.csv')))
+    pd.testing.assert_frame_equal(sorted_csv(output_iti_file), sorted_csv(os.path.join(tmp_path, 'expected_iti.csv')))
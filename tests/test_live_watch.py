@@ -0,0 +1,64 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_PATH)
+sys.path.append(os.path.join(ROOT_PATH, 'benchmarks'))
+import log_generator
+import helper_functions
+import live_watch
+import fcsrtt_preprocessor
+import tvdlr_preprocessor
+
+
+def watch_in_pieces(raw_file, output_file, task, animals_to_ignore=()):
+    """Writes the raw file in pieces cut at random bytes (also in the middle
+    of the lines), polls it after every piece and appends the new trials to
+    the output file, as `live_watch.watch_to_csv` does."""
+    with open(raw_file, 'rb') as f:
+        data = f.read()
+    growing_file = raw_file.replace('.csv', '_growing.csv')
+    state = live_watch.watch_state(task, os.path.basename(raw_file), animals_to_ignore)
+    rng = np.random.default_rng(1)
+    for size in list(np.sort(rng.choice(len(data), 40, replace=False))) + [len(data)]:
+        with open(growing_file, 'wb') as f:
+            f.write(data[:size])
+        new_trials = live_watch.poll_file(growing_file, state)
+        if not new_trials.empty:
+            new_trials.to_csv(output_file, mode='a', header=not os.path.exists(output_file), index=False)
+
+
+def sorted_csv(csv_file):
+    """Trials of the csv file in the order of the animals, sessions and trials."""
+    return pd.read_csv(csv_file).sort_values(['IdLabel', 'session', 'trial'], kind='stable').reset_index(drop=True)
+
+
+def test_live_fcsrtt_same_output(tmp_path):
+    raw_file = os.path.join(tmp_path, 'cage.csv')
+    log_generator.write_log(log_generator.fcsrtt_log(np.random.default_rng(0), n_animals=3, n_sessions=3,
+                                                     n_trials=30), raw_file)
+    watch_in_pieces(raw_file, os.path.join(tmp_path, 'live.csv'), '5csrtt')
+
+    final_output, _ = fcsrtt_preprocessor.fcsrtt_data_cleaner(raw_file, progress=False)
+    helper_functions.save_csv(final_output, os.path.join(tmp_path, 'expected.csv'))
+    pd.testing.assert_frame_equal(sorted_csv(os.path.join(tmp_path, 'live.csv')),
+                                  sorted_csv(os.path.join(tmp_path, 'expected.csv')))
+
+
+def test_live_tvdlr_same_output(tmp_path):
+    raw_file = os.path.join(tmp_path, 'cage.csv')
+    log_generator.write_log(log_generator.tvdlr_log(np.random.default_rng(0), n_animals=3, n_sessions=2,
+                                                    n_trials=30), raw_file)
+    watch_in_pieces(raw_file, os.path.join(tmp_path, 'live.csv'), '2vdlr', animals_to_ignore=['A02'])
+
+    final_output = tvdlr_preprocessor.tvdlr_data_cleaner([raw_file], {'animals_to_ignore': ['A02']})
+    helper_functions.save_csv(final_output, os.path.join(tmp_path, 'expected.csv'))
+    pd.testing.assert_frame_equal(sorted_csv(os.path.join(tmp_path, 'live.csv')),
+                                  sorted_csv(os.path.join(tmp_path, 'expected.csv')))
+
+    # rows appended at different times are written the same way (no 1 and 1.0 in a column)
+    live_text = pd.read_csv(os.path.join(tmp_path, 'live.csv'), dtype=str)
+    for column in ['windowCorrect', 'windowPressed']:
+        assert not live_text[column].str.endswith('.0').any()
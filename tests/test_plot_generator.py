@@ -0,0 +1,41 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_PATH)
+sys.path.append(os.path.join(ROOT_PATH, '5csrtt'))
+import plot_generator
+
+
+def trials_table(n_trials=3000):
+    """Synthetic trials of 3 animals with 2 stimulus durations, latencies in s rounded to ms."""
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'IdLabel': rng.choice(['m1', 'm2', 'm3'], n_trials),
+                       'stimulusDuration': rng.choice([1000.0, 2000.0], n_trials),
+                       'outcome': rng.choice(['correct', 'incorrect', 'omission'], n_trials, p=[0.6, 0.3, 0.1]),
+                       'nPremature': rng.integers(0, 3, n_trials),
+                       'trial': 1})
+    df['responseLatency'] = np.where(df['outcome'] != 'omission', rng.uniform(0.05, 2, n_trials).round(3), np.nan)
+    df['rewardLatency'] = np.where(df['outcome'] == 'correct', rng.uniform(0.5, 2, n_trials).round(3), np.nan)
+    df['trialByStimDuration'] = df.groupby(['IdLabel', 'stimulusDuration']).cumcount() + 1
+    # mean reward latency of the first 4 trials of m1 is exactly halfway between two ms (1.2425)
+    first = df.index[(df['IdLabel'] == 'm1') & (df['stimulusDuration'] == 1000.0)][:4]
+    df.loc[first, 'outcome'] = ['correct', 'incorrect', 'correct', 'omission']
+    df.loc[first, 'rewardLatency'] = [0.75, np.nan, 1.735, np.nan]
+    return df
+
+
+def test_trial_window_sweep_matches_aggregated_table():
+    df = trials_table()
+    windows = [(1, 4), (1, 10), (1, 50), (3, 40), (5, 5), (20, 300), (100, 1000)]
+    sweep_df = plot_generator.trial_window_sweep(df, windows)
+
+    for min_trial, max_trial in windows:
+        expected = plot_generator.aggregated_table(df[df['trialByStimDuration'].between(min_trial, max_trial)],
+                                                   by1='IdLabel', by2='stimulusDuration')
+        window_df = sweep_df[(sweep_df['min_trial_number'] == min_trial) &
+                             (sweep_df['max_trial_number'] == max_trial)]
+        pd.testing.assert_frame_equal(window_df.drop(columns=['min_trial_number', 'max_trial_number'])
+                                      .reset_index(drop=True), expected, check_dtype=False)
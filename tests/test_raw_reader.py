@@ -0,0 +1,49 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_PATH)
+sys.path.append(os.path.join(ROOT_PATH, 'benchmarks'))
+import log_generator
+import raw_reader
+
+
+def raw_logs(tmp_path):
+    """Small synthetic 5-CSRTT log and its copy with the technical info rows
+    repeated in the middle and at the end of the file."""
+    raw_file = os.path.join(tmp_path, 'cage.csv')
+    log_generator.write_log(log_generator.fcsrtt_log(np.random.default_rng(0), n_animals=2, n_sessions=2,
+                                                     n_trials=20), raw_file)
+    with open(raw_file, 'r', encoding='utf_16') as f:
+        lines = f.readlines()
+    info_rows = lines[1:3]
+    lines = lines[:500] + info_rows[:1] + lines[500:1000] + info_rows + lines[1000:] + info_rows[1:]
+
+    info_file = os.path.join(tmp_path, 'cage_info.csv')
+    with open(info_file, 'w', encoding='utf_16') as f:
+        f.writelines(lines)
+    return raw_file, info_file
+
+
+def test_info_rows_anywhere(tmp_path):
+    raw_file, info_file = raw_logs(tmp_path)
+    expected = raw_reader.read_raw_file(raw_file, engine='c')
+
+    pd.testing.assert_frame_equal(raw_reader.read_raw_file(info_file, engine='c'), expected)
+
+    chunks = list(raw_reader.read_raw_chunks(info_file, chunksize=300))
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), expected, check_dtype=False)
+
+    # the file is read in pieces as if it was still written, pieces end in the middle of the lines
+    with open(info_file, 'rb') as f:
+        data = f.read()
+    growing_file = os.path.join(tmp_path, 'cage_growing.csv')
+    parts, offset, header = [], 0, None
+    for size in list(range(997, len(data), 7919)) + [len(data)]:
+        with open(growing_file, 'wb') as f:
+            f.write(data[:size])
+        df, offset, header = raw_reader.read_raw_tail(growing_file, offset, header)
+        parts.append(df)
+    pd.testing.assert_frame_equal(pd.concat(parts, ignore_index=True), expected, check_dtype=False)
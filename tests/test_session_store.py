@@ -0,0 +1,53 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_PATH)
+sys.path.append(os.path.join(ROOT_PATH, 'benchmarks'))
+import log_generator
+import raw_reader
+import helper_functions
+import session_store
+
+
+def cleaned_log(tmp_path):
+    """Cleaned data of a small synthetic 5-CSRTT log, text columns are not compacted."""
+    raw_file = os.path.join(tmp_path, 'cage.csv')
+    log_generator.write_log(log_generator.fcsrtt_log(np.random.default_rng(0), n_animals=2, n_sessions=2,
+                                                     n_trials=20), raw_file)
+    return helper_functions.initial_cleaning(raw_reader.read_raw_file(raw_file, engine='c'))
+
+
+def test_save_open_round_trip(tmp_path):
+    input_df = cleaned_log(tmp_path)
+    store_path = os.path.join(tmp_path, 'cage.store')
+    session_store.save_store(input_df, store_path, options={'parser': 'fcsrtt'})
+
+    store = session_store.open_store(store_path)
+    assert all(isinstance(values, np.memmap) for values in store['arrays'].values())
+    # text columns (`object` or `str`) are saved as codes
+    assert {'IdLabel', 'SystemMsg'} <= set(store['categories'])
+
+    loaded_df = session_store.load_table(store_path, options={'parser': 'fcsrtt'})
+    assert list(loaded_df.columns) == list(input_df.columns)
+    for column in input_df.columns:
+        pd.testing.assert_series_equal(helper_functions.plain_values(loaded_df[column]),
+                                       input_df[column].reset_index(drop=True), check_dtype=False)
+
+
+def test_store_frame_session(tmp_path):
+    input_df = cleaned_log(tmp_path)
+    store_path = os.path.join(tmp_path, 'cage.store')
+    session_store.save_store(input_df, store_path)
+    store = session_store.open_store(store_path)
+
+    animal_id = sorted(store['sessions'])[0]
+    session_df = session_store.store_frame(store, animal_id, 2)
+    row_start, row_stop = session_store.store_rows(store, animal_id, 2)
+    assert (session_df['session'] == 2).all()
+    # system messages of the session have no animal
+    assert set(session_df['IdLabel'].dropna()) == {animal_id}
+    pd.testing.assert_series_equal(session_df['Timestamp'],
+                                   input_df['Timestamp'].iloc[row_start:row_stop].reset_index(drop=True))
@@ -0,0 +1,43 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_PATH)
+sys.path.append(os.path.join(ROOT_PATH, '2vdlr'))
+sys.path.append(os.path.join(ROOT_PATH, 'benchmarks'))
+import log_generator
+import tvdlr_preprocessor
+
+
+def raw_logs(tmp_path):
+    """Two small synthetic 2VDLR logs, the second one continues the first one."""
+    raw_files = []
+    for i, start_time in enumerate([0.0, 86400.0]):
+        raw_file = os.path.join(tmp_path, f'cage_{i}.csv')
+        log_generator.write_log(log_generator.tvdlr_log(np.random.default_rng(i), n_animals=3, n_sessions=2,
+                                                        n_trials=30, start_time=start_time), raw_file)
+        raw_files.append(raw_file)
+    return raw_files
+
+
+def test_chunksize_same_output(tmp_path):
+    raw_files = raw_logs(tmp_path)
+    params = {'animals_to_ignore': ['A02']}
+    final_output = tvdlr_preprocessor.tvdlr_data_cleaner(raw_files, params)
+    assert set(final_output['IdLabel']) == {'A01', 'A03'}
+
+    # blocks end in the middle of the sessions and of the trials
+    chunk_output = tvdlr_preprocessor.tvdlr_data_cleaner(raw_files, params, chunksize=333)
+    pd.testing.assert_frame_equal(chunk_output.reset_index(drop=True), final_output.reset_index(drop=True))
+
+
+def test_n_jobs_same_output(tmp_path):
+    raw_files = raw_logs(tmp_path)
+    params = {'animals_to_ignore': ['A02']}
+    final_output = tvdlr_preprocessor.tvdlr_data_cleaner(raw_files, params)
+
+    # files are read by 2 processes
+    jobs_output = tvdlr_preprocessor.tvdlr_data_cleaner(raw_files, params, n_jobs=2)
+    pd.testing.assert_frame_equal(jobs_output.reset_index(drop=True), final_output.reset_index(drop=True))